@@ -0,0 +1,64 @@
+"""
+Compare the per-packet SpeadProcessor.process_data against the vectorised
+SpeadProcessor.process_batch on a synthetic SPEAD stream.
+"""
+import time
+import numpy as np
+
+from casperfpga import spead
+
+NUM_PACKETS = 20000
+NUM_HEADERS = 6
+PAYLOAD_WORDS = 128
+ADDRESS_BITS = 48
+
+
+def make_spead_stream(num_packets, num_headers, payload_words):
+    """
+    Build a packets x words array of SPEAD 64,48 packets.
+    """
+    magic = (0x53 << 56) | (4 << 48) | (2 << 40) | (6 << 32) | num_headers
+    hdr_ids = [0x0001, 0x0002, 0x0003, 0x0004, 0x1600, 0x4101]
+    words = np.zeros((num_packets, 1 + num_headers + payload_words),
+                     dtype=np.uint64)
+    words[:, 0] = magic
+    for ctr, hdr_id in enumerate(hdr_ids[:num_headers]):
+        immediate = (1 << 63) if hdr_id != 0x0003 else 0
+        if hdr_id == 0x0004:
+            values = np.full(num_packets, payload_words * 8, dtype=np.uint64)
+        else:
+            values = np.arange(num_packets, dtype=np.uint64) * (ctr + 1)
+        words[:, ctr + 1] = np.uint64(immediate | (hdr_id << ADDRESS_BITS)) | \
+            values
+    words[:, num_headers + 1:] = np.random.randint(
+        0, 2**62, size=(num_packets, payload_words), dtype=np.uint64)
+    return words
+
+
+if __name__ == '__main__':
+    stream = make_spead_stream(NUM_PACKETS, NUM_HEADERS, PAYLOAD_WORDS)
+    stream_lists = [[int(word) for word in row] for row in stream]
+
+    processor = spead.SpeadProcessor(4, '64,48', PAYLOAD_WORDS, NUM_HEADERS)
+    stime = time.time()
+    processor.process_data(stream_lists)
+    t_scalar = time.time() - stime
+
+    stime = time.time()
+    batch = processor.process_batch(stream)
+    t_batch = time.time() - stime
+
+    # spot-check that both decoders agree
+    for idx in [0, NUM_PACKETS // 2, NUM_PACKETS - 1]:
+        assert batch.packet(idx).headers == processor.packets[idx].headers
+        assert batch.packet(idx).data == processor.packets[idx].data
+
+    print('%i packets, %i headers, %i payload words' % (
+        NUM_PACKETS, NUM_HEADERS, PAYLOAD_WORDS))
+    print('process_data:  %.3f s (%.0f pkt/s)' % (
+        t_scalar, NUM_PACKETS / t_scalar))
+    print('process_batch: %.3f s (%.0f pkt/s)' % (
+        t_batch, NUM_PACKETS / t_batch))
+    print('speed-up: %.1fx' % (t_scalar / t_batch))
+
+# end
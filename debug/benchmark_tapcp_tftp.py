@@ -0,0 +1,293 @@
+"""
+Compare TftpSession transfers with and without blksize/windowsize
+negotiation against a local TFTP stand-in for a TAPCP board, with and
+without packet loss. Plain 512-byte lock-step transfers are what
+TapcpTransport did before it kept a session. The last case serves every
+transfer from one port and loses the first ACK of the last block of each
+read, as a board does, so a retransmitted last block can reach the client
+after it has moved on to the next read.
+"""
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+from casperfpga import tftp_session
+
+READ_SIZE = 64 * 1024
+WRITE_SIZE = 64 * 1024
+NUM_TRANSFERS = 20
+NUM_REGISTER_READS = 200
+# time the board takes to handle one packet
+PACKET_DELAY = 0.0002
+LOSS = 0.02
+
+
+class NewRequest(Exception):
+    pass
+
+
+class TftpStandIn(object):
+    """
+    A single-connection TFTP server holding one memory, read and written
+    with TAPCP file names, name.word_offset.word_count.
+    """
+    def __init__(self, options=True, loss=0.0, delay=0.0, timeout=0.05,
+                 same_port=False, drop_final_ack=False):
+        """
+        :param options: take blksize and windowsize options
+        :param loss: the chance of losing each packet, either way
+        :param delay: the time taken to send each packet
+        :param timeout: the time before retransmitting
+        :param same_port: serve every transfer from the listening port,
+            rather than a new port per transfer
+        :param drop_final_ack: lose the first ACK of the last block of
+            every read
+        """
+        self.options = options
+        self.loss = loss
+        self.delay = delay
+        self.timeout = timeout
+        self.same_port = same_port
+        self.drop_final_ack = drop_final_ack
+        self.memory = bytearray(random.getrandbits(8)
+                                for _ in range(256 * 1024))
+        self.pending = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+    def _send(self, sock, packet, client):
+        time.sleep(self.delay)
+        if random.random() >= self.loss:
+            sock.sendto(packet, client)
+
+    def _recv(self, sock, client):
+        """
+        Wait for a packet of the transfer with client. A request from
+        another client port ends the transfer; it is served next.
+        """
+        deadline = time.time() + self.timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or \
+                    not select.select([sock], [], [], remaining)[0]:
+                return None
+            packet, source = sock.recvfrom(65536)
+            opcode = struct.unpack('>H', packet[:2])[0]
+            if opcode in (tftp_session.OPCODE_RRQ, tftp_session.OPCODE_WRQ):
+                if source != client:
+                    self.pending.append((packet, source))
+                    raise NewRequest()
+                # a retransmitted request of this transfer
+                continue
+            if source != client:
+                continue
+            if random.random() < self.loss:
+                return None
+            return struct.unpack('>HH', packet[:4]) + (packet[4:],)
+
+    def _serve(self):
+        while self.running:
+            if self.pending:
+                request, client = self.pending.pop(0)
+            else:
+                if not select.select([self.sock], [], [], 0.1)[0]:
+                    continue
+                request, client = self.sock.recvfrom(65536)
+            opcode = struct.unpack('>H', request[:2])[0]
+            if opcode not in (tftp_session.OPCODE_RRQ,
+                              tftp_session.OPCODE_WRQ):
+                continue
+            fields = request[2:].split(b'\x00')
+            name, offset, size = fields[0].decode().rsplit('.', 2)
+            offset, size = int(offset, 16) * 4, int(size, 16) * 4
+            asked = dict(zip(fields[2::2], fields[3::2]))
+            agreed = {}
+            if self.options:
+                for key in (b'blksize', b'windowsize'):
+                    if key in asked:
+                        agreed[key.decode()] = int(asked[key])
+            if self.same_port:
+                sock = self.sock
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(('127.0.0.1', 0))
+            try:
+                if opcode == tftp_session.OPCODE_RRQ:
+                    self._read(sock, client, offset, size, agreed)
+                else:
+                    self._write(sock, client, offset, agreed)
+            except NewRequest:
+                pass
+            finally:
+                if sock is not self.sock:
+                    sock.close()
+            self._drop_duplicates(request, client)
+
+    def _drop_duplicates(self, request, client):
+        """
+        Forget retransmits of a request that came in while serving it.
+        """
+        while select.select([self.sock], [], [], 0)[0]:
+            self.pending.append(self.sock.recvfrom(65536))
+        self.pending = [pending for pending in self.pending
+                        if pending != (request, client)]
+
+    def _oack(self, sock, client, agreed):
+        packet = struct.pack('>H', tftp_session.OPCODE_OACK)
+        for key, value in agreed.items():
+            packet += ('%s\x00%d\x00' % (key, value)).encode()
+        self._send(sock, packet, client)
+        return packet
+
+    def _read(self, sock, client, offset, size, agreed):
+        blksize = agreed.get('blksize', 512)
+        window = agreed.get('windowsize', 1)
+        data = bytes(self.memory[offset:offset + size])
+        num_blocks = len(data) // blksize + 1
+        acked = 0
+        if agreed:
+            oack = self._oack(sock, client, agreed)
+            for _ in range(10):
+                reply = self._recv(sock, client)
+                if reply is not None and reply[:2] == (
+                        tftp_session.OPCODE_ACK, 0):
+                    break
+                self._send(sock, oack, client)
+            else:
+                return
+        tries = 0
+        dropped = not self.drop_final_ack
+        while acked < num_blocks and tries < 10:
+            last = min(acked + window, num_blocks)
+            for block in range(acked + 1, last + 1):
+                self._send(sock, struct.pack(
+                    '>HH', tftp_session.OPCODE_DATA, block & 0xffff) +
+                    data[(block - 1) * blksize:block * blksize], client)
+            reply = self._recv(sock, client)
+            if reply is not None and not dropped and \
+                    reply[:2] == (tftp_session.OPCODE_ACK,
+                                  num_blocks & 0xffff):
+                dropped = True
+                reply = None
+            if reply is None:
+                tries += 1
+                continue
+            tries = 0
+            block = tftp_session._unwrap_block(reply[1], acked)
+            if reply[0] == tftp_session.OPCODE_ACK and acked < block <= last:
+                acked = block
+
+    def _write(self, sock, client, offset, agreed):
+        blksize = agreed.get('blksize', 512)
+        window = agreed.get('windowsize', 1)
+        if agreed:
+            reply_packet = self._oack(sock, client, agreed)
+        else:
+            reply_packet = struct.pack('>HH', tftp_session.OPCODE_ACK, 0)
+            self._send(sock, reply_packet, client)
+        received = 0
+        since_ack = 0
+        tries = 0
+        while tries < 10:
+            reply = self._recv(sock, client)
+            if reply is None:
+                tries += 1
+                self._send(sock, reply_packet, client)
+                continue
+            tries = 0
+            block = tftp_session._unwrap_block(reply[1], received + 1)
+            if block != received + 1:
+                # a gap, or a duplicate: acknowledge what we have
+                reply_packet = struct.pack(
+                    '>HH', tftp_session.OPCODE_ACK, received & 0xffff)
+                self._send(sock, reply_packet, client)
+                since_ack = 0
+                continue
+            start = offset + received * blksize
+            self.memory[start:start + len(reply[2])] = reply[2]
+            received = block
+            since_ack += 1
+            last = len(reply[2]) < blksize
+            if last or since_ack >= window:
+                reply_packet = struct.pack(
+                    '>HH', tftp_session.OPCODE_ACK, received & 0xffff)
+                self._send(sock, reply_packet, client)
+                since_ack = 0
+            if last:
+                # linger a while in case our last ACK is lost
+                while True:
+                    reply = self._recv(sock, client)
+                    if reply is None:
+                        return
+                    self._send(sock, reply_packet, client)
+
+
+def run(server, blksize, windowsize):
+    session = tftp_session.TftpSession(
+        '127.0.0.1', port=server.port, timeout=1.0,
+        blksize=blksize, windowsize=windowsize)
+    payload = bytes(random.getrandbits(8) for _ in range(WRITE_SIZE))
+    stime = time.time()
+    for ctr in range(NUM_TRANSFERS):
+        offset = (ctr % 3) * READ_SIZE
+        data = session.download('bram.%x.%x' % (offset // 4, READ_SIZE // 4))
+        assert data == bytes(server.memory[offset:offset + READ_SIZE])
+    t_read = time.time() - stime
+    stime = time.time()
+    for ctr in range(NUM_REGISTER_READS):
+        data = session.download('bram.%x.1' % ctr, size=4)
+        assert data == bytes(server.memory[ctr * 4:ctr * 4 + 4])
+    t_register = time.time() - stime
+    stime = time.time()
+    for ctr in range(NUM_TRANSFERS):
+        session.upload('bram.%x.0' % (3 * READ_SIZE // 4), payload)
+    t_write = time.time() - stime
+    assert bytes(server.memory[3 * READ_SIZE:3 * READ_SIZE + WRITE_SIZE]) \
+        == payload
+    stats = session.transfer_stats
+    session.close()
+    return t_read, t_register, t_write, stats
+
+
+if __name__ == '__main__':
+    print('%i x %i kB reads and writes, %i register reads, %.1f ms per '
+          'packet on the board' % (NUM_TRANSFERS, READ_SIZE // 1024,
+                                   NUM_REGISTER_READS, PACKET_DELAY * 1000))
+    cases = [
+        ('lock-step 512', {}, 512, 1),
+        ('negotiated', {}, tftp_session.BLKSIZE, tftp_session.WINDOWSIZE),
+        ('options ignored', {'options': False}, tftp_session.BLKSIZE,
+         tftp_session.WINDOWSIZE),
+        ('one port, lost ACK', {'same_port': True, 'drop_final_ack': True},
+         tftp_session.BLKSIZE, tftp_session.WINDOWSIZE),
+    ]
+    for loss in [0.0, LOSS]:
+        for label, server_kwargs, blksize, windowsize in cases:
+            server = TftpStandIn(loss=loss, delay=PACKET_DELAY,
+                                 **server_kwargs)
+            t_read, t_register, t_write, stats = run(
+                server, blksize, windowsize)
+            server.stop()
+            print('%-18s loss %4.1f%%: read %6.3f s (%6.2f MB/s), '
+                  'registers %6.3f s, write %6.3f s (%6.2f MB/s), '
+                  'blksize %i, window %i' % (
+                      label, loss * 100,
+                      t_read, NUM_TRANSFERS * READ_SIZE / t_read / 1e6,
+                      t_register,
+                      t_write, NUM_TRANSFERS * WRITE_SIZE / t_write / 1e6,
+                      stats['blksize'], stats['windowsize']))
+
+# end
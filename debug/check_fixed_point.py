@@ -0,0 +1,59 @@
+"""
+Check the fixed point conversions in memory at the edges of wide types,
+where float64 cannot hold the limits exactly, and that the array and
+scalar functions agree.
+"""
+import numpy as np
+
+from casperfpga import memory
+
+
+def check_saturation():
+    """
+    Out-of-range numbers saturate to the largest and smallest values of
+    64-bit and wider types.
+    """
+    for bitwidth in [64, 80]:
+        umax = (2**bitwidth) - 1
+        smax = (2**(bitwidth - 1)) - 1
+        smin = 2**(bitwidth - 1)
+        for num in [2.0**bitwidth - 1, 1e30, 2.0**bitwidth * 4]:
+            assert memory.fp2fixed_int(num, bitwidth, 0, False) == umax
+            assert memory.fp2fixed_int(num, bitwidth, 0, True) == smax
+            assert memory.fp2fixed_int(-num, bitwidth, 0, True) == smin
+        assert memory.cast_fixed(2.0**bitwidth, bitwidth, 0) == umax
+    for signed, top in [(False, 2**64 - 1), (True, 2**63 - 1)]:
+        raw = memory.fp2fixed_int_array([1e30, 1.0, 0.0], 64, 0, signed)
+        assert raw.tolist() == [top, 1, 0]
+
+
+def check_wrap():
+    """
+    Wrapping discards the overflowing bits, also past 64 bits.
+    """
+    assert memory.fp2fixed(300.0, 8, 0, False, 'wrap') == 44
+    assert memory.fp2fixed(-300.0, 8, 0, True, 'wrap') == -44
+    assert memory.fp2fixed(2.0**70 + 2.0**20, 64, 0, False, 'wrap') == 2**20
+    assert memory.fp2fixed(2.0**70 + 2.0**20, 80, 0, False, 'wrap') == \
+        2**70 + 2**20
+
+
+def check_agree():
+    """
+    The scalar functions and the wide python paths agree with the arrays.
+    """
+    nums = np.random.uniform(-1000, 1000, 1000)
+    raw = memory.fp2fixed_int_array(nums, 32, 8, True)
+    for num, word in zip(nums, raw):
+        assert memory.fp2fixed_int(num, 32, 8, True) == word
+        assert memory.fp2fixed(num, 64, 8, True) == \
+            memory.fp2fixed(num, 80, 8, True)
+
+
+if __name__ == '__main__':
+    check_saturation()
+    check_wrap()
+    check_agree()
+    print('fixed point checks passed')
+
+# end
@@ -1,15 +1,34 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include <progska.h>
 
 static char module_docstring[] =
     "This module provides a fast uploading interface for SKARABs.";
 static char upload_docstring[] =
-    "Upload the given bin file to the given list of SKARAB boards.";
+    "upload(image, hosts, chunk_size, progress=None, interval=1.0, verbose=0,\n"
+    "       adaptive=True, max_rate=0)\n\n"
+    "Upload the given bin file, or buffer of bin file contents, to the given "
+    "list of SKARAB boards.\n\n"
+    "Returns (exit_code, boards), with a dictionary of telemetry per board, "
+    "in the order of hosts. If given, progress is called with the same list "
+    "of dictionaries at most every interval seconds while uploading; if it "
+    "raises, the upload is aborted and the exception propagated.\n\n"
+    "With adaptive, each board's retransmit timeout follows its round trip "
+    "time and backs off on loss, the number of boards with a chunk in "
+    "flight is halved on loss and grows again with each window of answers, "
+    "and boards that stop answering are dropped. max_rate caps the total "
+    "send rate, in Mb/s; 0 for no cap.";
 
-static PyObject *casperfpga_progskaupload(PyObject *self, PyObject *args);
+static PyObject *casperfpga_progskaupload(PyObject *self, PyObject *args,
+    PyObject *kwargs);
 
 static PyMethodDef module_methods[] = {
-    {"upload", casperfpga_progskaupload, METH_VARARGS, upload_docstring},
+    {"upload", (PyCFunction)(void(*)(void))casperfpga_progskaupload,
+        METH_VARARGS | METH_KEYWORDS, upload_docstring},
     {NULL, NULL, 0, NULL}
 };
 
@@ -17,7 +36,7 @@ static struct PyModuleDef progska =
 {
     PyModuleDef_HEAD_INIT,
     "progska", //name of module
-    "", //Module docstring
+    module_docstring, //Module docstring
     -1, //size of per-interpreter state of the module, or -1 if the module keeps state in global variables.
     module_methods
 };
@@ -26,65 +45,256 @@ PyMODINIT_FUNC PyInit_progska(void) {
     return PyModule_Create(&progska);
 }
 
-static PyObject *casperfpga_progskaupload(PyObject *self, PyObject *args) {
+struct progress_state {
+    PyObject *callback;
+    PyObject *hosts;
+    int num_hosts;
+    PyObject *exc_type, *exc_value, *exc_tb;
+};
+
+static PyObject *board_dict(struct total *t, int index, PyObject *host,
+        const char *abort) {
+    /*
+    The telemetry of one board as a dictionary. Incomplete boards get a
+    failure reason if the upload was aborted.
+    */
+    struct board b;
+    char buffer[256];
+    PyObject *reason, *elapsed, *result;
+
+    if (board_total(t, index, &b) < 0) {
+        PyErr_SetString(PyExc_RuntimeError, "No telemetry for board.");
+        return NULL;
+    }
+    if (b.b_completed) {
+        reason = Py_None;
+        Py_INCREF(reason);
+    } else if (b.b_failed) {
+        snprintf(buffer, sizeof(buffer), "no reply after %u retransmits, "
+            "at chunk %d of %d", b.b_retransmits, b.b_chunks, b.b_total);
+        reason = PyUnicode_FromString(buffer);
+    } else if (b.b_error_code) {
+        snprintf(buffer, sizeof(buffer), "error response 0x%04x at chunk "
+            "%d of %d", b.b_error_code, b.b_chunks, b.b_total);
+        reason = PyUnicode_FromString(buffer);
+    } else if (abort != NULL) {
+        snprintf(buffer, sizeof(buffer), "%s, at chunk %d of %d with no "
+            "reply for %.3fs", abort, b.b_chunks, b.b_total, b.b_silent);
+        reason = PyUnicode_FromString(buffer);
+    } else {
+        reason = Py_None;
+        Py_INCREF(reason);
+    }
+    if (reason == NULL)
+        return NULL;
+    if (b.b_elapsed < 0) {
+        elapsed = Py_None;
+        Py_INCREF(elapsed);
+    } else {
+        elapsed = PyFloat_FromDouble(b.b_elapsed);
+    }
+    result = Py_BuildValue(
+        "{s:O,s:O,s:i,s:i,s:I,s:I,s:I,s:I,s:d,s:d,s:d,s:d,s:N,s:d,s:N}",
+        "host", host,
+        "completed", b.b_completed ? Py_True : Py_False,
+        "chunks", b.b_chunks,
+        "total_chunks", b.b_total,
+        "sent", b.b_sent,
+        "retransmits", b.b_retransmits,
+        "late", b.b_late,
+        "errors", b.b_errors,
+        "rtt", b.b_rtt,
+        "rtt_min", b.b_rtt_min,
+        "rtt_max", b.b_rtt_max,
+        "rto", b.b_rto,
+        "elapsed", elapsed,
+        "silent", b.b_silent,
+        "reason", reason);
+    return result;
+}
+
+static PyObject *board_list(struct total *t, PyObject *hosts, int num_hosts,
+        const char *abort) {
+    PyObject *boards, *board;
+    int host_ctr;
+
+    boards = PyList_New(num_hosts);
+    if (boards == NULL)
+        return NULL;
+    for (host_ctr = 0; host_ctr < num_hosts; host_ctr++) {
+        board = board_dict(t, host_ctr,
+            PySequence_Fast_GET_ITEM(hosts, host_ctr), abort);
+        if (board == NULL) {
+            Py_DECREF(boards);
+            return NULL;
+        }
+        PyList_SET_ITEM(boards, host_ctr, board);
+    }
+    return boards;
+}
+
+static int call_progress(struct total *t, void *data) {
+    /*
+    Called by run_total, without the GIL, at a bounded rate. Also gives
+    Python the chance to handle signals, e.g. KeyboardInterrupt.
+    */
+    struct progress_state *ps = data;
+    PyGILState_STATE gil;
+    PyObject *boards, *rv;
+
+    gil = PyGILState_Ensure();
+    if (PyErr_CheckSignals() < 0)
+        goto fail;
+    if (ps->callback != Py_None) {
+        boards = board_list(t, ps->hosts, ps->num_hosts, NULL);
+        if (boards == NULL)
+            goto fail;
+        rv = PyObject_CallFunctionObjArgs(ps->callback, boards, NULL);
+        Py_DECREF(boards);
+        if (rv == NULL)
+            goto fail;
+        Py_DECREF(rv);
+    }
+    PyGILState_Release(gil);
+    return 0;
+fail:
+    PyErr_Fetch(&ps->exc_type, &ps->exc_value, &ps->exc_tb);
+    PyGILState_Release(gil);
+    return -1;
+}
+
+static PyObject *casperfpga_progskaupload(PyObject *self, PyObject *args,
+        PyObject *kwargs) {
     /*
     Process the arguments from Python and then pass them to the progska
-    C method.
+    C methods. The image is either the name of a bin file, which progska
+    maps, or an object supporting the buffer protocol (bytes, mmap, ...)
+    holding the bin file contents.
     */
-    const char *binfile, *skarabname;
-    PyObject *hostlist_obj, *host_list, *item;
-    const char *packet_size;
-    int host_ctr, num_hosts;
-    int verbose;
-    verbose = 0;
+    static char *kwlist[] = {"image", "hosts", "chunk_size", "progress",
+        "interval", "verbose", "adaptive", "max_rate", NULL};
+    PyObject *image_obj, *hostlist_obj, *host_list, *item, *boards;
+    PyObject *progress_obj = Py_None;
+    Py_buffer image;
+    const char *packet_size, *hostname;
+    double interval = 1.0;
+    double max_rate = 0.0;
+    int adaptive = 1;
+    struct total *t;
+    struct progress_state ps;
+    int host_ctr, num_hosts, result;
+    int verbose = 0;
     // parse the input tuple
-    if (!PyArg_ParseTuple(args, "sOs", &binfile, &hostlist_obj, &packet_size))
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OOs|Odipd", kwlist,
+            &image_obj, &hostlist_obj, &packet_size, &progress_obj,
+            &interval, &verbose, &adaptive, &max_rate))
         return NULL;
-
-    if(strlen(binfile) <= 0){
-        PyErr_SetString(PyExc_RuntimeError,
-            "Must provide a bin file to upload.");
+    if (progress_obj != Py_None && !PyCallable_Check(progress_obj)) {
+        PyErr_SetString(PyExc_TypeError, "progress must be callable.");
         return NULL;
     }
-    if(verbose > 0)
-        printf("Programming: %s\n", binfile);
 
     host_list = PySequence_Fast(hostlist_obj, "Expected a list of hosts.");
-    num_hosts = PySequence_Size(hostlist_obj);
+    if (host_list == NULL)
+        return NULL;
+    num_hosts = PySequence_Fast_GET_SIZE(host_list);
     if(num_hosts <= 0){
+        Py_DECREF(host_list);
         PyErr_SetString(PyExc_RuntimeError,
             "Must provide at least one host to which to upload the bin file.");
         return NULL;
     }
-    if(verbose > 0)
-        printf("Given %i hosts.\n", num_hosts);
-    char **mainargs;
-    int num_mainargs;
-    num_mainargs = num_hosts + 5;
-    mainargs = malloc(num_mainargs * sizeof(char*));
-    const char *progska = "progksa";
-    const char *dashs = "-s";
-    const char *dashf = "-f";
-    mainargs[0] = progska;
-    mainargs[1] = dashs;
-    mainargs[2] = packet_size;
-    mainargs[3] = dashf;
-    mainargs[4] = binfile;
+
+    t = create_total();
+    if(t == NULL){
+        Py_DECREF(host_list);
+        return PyErr_NoMemory();
+    }
+    if(update_chunksize(t, strtoul(packet_size, NULL, 0)) < 0){
+        destroy_total(t);
+        Py_DECREF(host_list);
+        PyErr_Format(PyExc_RuntimeError, "%s is not a reasonable chunk size.",
+            packet_size);
+        return NULL;
+    }
     for (host_ctr = 0; host_ctr < num_hosts; host_ctr++) {
         item = PySequence_Fast_GET_ITEM(host_list, host_ctr);
-        const char *hostname = PyBytes_AsString(item);
-        mainargs[host_ctr + 5] = hostname;
-        if(verbose > 0)
-            printf("\t%s\n", hostname);
+        if (PyUnicode_Check(item))
+            hostname = PyUnicode_AsUTF8(item);
+        else
+            hostname = PyBytes_AsString(item);
+        if (hostname == NULL || add_total(t, (char *)hostname)) {
+            destroy_total(t);
+            Py_DECREF(host_list);
+            if (!PyErr_Occurred())
+                PyErr_Format(PyExc_RuntimeError, "Unable to add host %s.",
+                    hostname);
+            return NULL;
+        }
+    }
+
+    image.obj = NULL;
+    if (PyUnicode_Check(image_obj)) {
+        const char *binfile = PyUnicode_AsUTF8(image_obj);
+        if (binfile == NULL || strlen(binfile) <= 0) {
+            destroy_total(t);
+            Py_DECREF(host_list);
+            PyErr_SetString(PyExc_RuntimeError,
+                "Must provide a bin file to upload.");
+            return NULL;
+        }
+        if (open_total(t, (char *)binfile) < 0) {
+            destroy_total(t);
+            Py_DECREF(host_list);
+            PyErr_Format(PyExc_RuntimeError, "Unable to map %s.", binfile);
+            return NULL;
+        }
+    } else {
+        if (PyObject_GetBuffer(image_obj, &image, PyBUF_SIMPLE) < 0) {
+            destroy_total(t);
+            Py_DECREF(host_list);
+            return NULL;
+        }
+        if (load_total(t, image.buf, image.len) < 0) {
+            PyBuffer_Release(&image);
+            destroy_total(t);
+            Py_DECREF(host_list);
+            PyErr_SetString(PyExc_RuntimeError,
+                "Must provide a bin file to upload.");
+            return NULL;
+        }
+    }
+
+    ps.callback = progress_obj;
+    ps.hosts = host_list;
+    ps.num_hosts = num_hosts;
+    ps.exc_type = ps.exc_value = ps.exc_tb = NULL;
+    // without a callback, still check for signals now and then
+    if (progress_obj == Py_None && interval > 0.2)
+        interval = 0.2;
+    progress_total(t, &call_progress, &ps, (unsigned int)(interval * 1000));
+    // Mb/s to bytes/s
+    pacing_total(t, adaptive, max_rate * 1000000.0 / 8.0);
+
+    // the upload takes a while, let other Python threads run meanwhile
+    Py_BEGIN_ALLOW_THREADS
+    result = run_total(t, verbose, MAX_TIMEOUTS * num_hosts);
+    Py_END_ALLOW_THREADS
+
+    if (ps.exc_type != NULL) {
+        PyErr_Restore(ps.exc_type, ps.exc_value, ps.exc_tb);
+        boards = NULL;
+    } else {
+        boards = board_list(t, host_list, num_hosts, abort_total(t));
     }
-    // call Marc's main function to do the upload
-    int marcresult;
-    marcresult = main(num_mainargs, mainargs);
-    PyObject *ret = Py_BuildValue("i", marcresult);
-    // Py_DECREF(host_list); - is this making the segfault
-    // Py_DECREF(item);
-    free(mainargs);
-    return ret;
+
+    destroy_total(t);
+    if (image.obj != NULL)
+        PyBuffer_Release(&image);
+    Py_DECREF(host_list);
+    if (boards == NULL)
+        return NULL;
+    return Py_BuildValue("(iN)", result, boards);
 }
 
 // end
@@ -9,6 +9,7 @@
 #include <signal.h>
 #include <stdint.h>
 #include <limits.h>
+#include <math.h>
 
 #include <sys/mman.h>
 #include <sys/stat.h>
@@ -22,6 +23,7 @@
 
 #include <netc.h>
 #include <th.h>
+#include <progska.h>
 
 #define CHECK  /* paranoia */
 
@@ -32,13 +34,18 @@
 #define SEQUENCE_STRIDE  0x10  /* (N*STRIDE)+FIRST = initial sequence of board N */
 
 #define MAX_PROBLEMS       10  /* try to deal with tings */
-#define MAX_TIMEOUTS       50  /* */
 
 #define SKARAB_REQ 0x0051  /* gets htons'ed */
 #define SKARAB_ACK 0x0052  /* gets htons'ed */
 
 #define INITIAL_TIMEOUT 20 /* in ms */
 
+/* adaptive pacing, see pacing_total */
+#define MIN_TIMEOUT      5 /* in ms, floor of the rtt based timeout */
+#define MAX_TIMEOUT    200 /* in ms, ceiling of the backed off timeout */
+#define MAX_RETRIES     10 /* unanswered sends of a chunk before a skarab is dropped */
+#define RATE_BURST       4 /* packets the rate cap lets through back to back */
+
 struct skarab
 {
   uint16_t s_sequence;
@@ -49,6 +56,27 @@ struct skarab
 #if 0
   struct timeval s_delta;
 #endif
+
+  /* telemetry, see struct board in progska.h */
+  unsigned int s_index;
+  int s_sent_chunk;
+  unsigned int s_tries;
+  unsigned int s_sent;
+  unsigned int s_retransmits;
+  unsigned int s_late;
+  unsigned int s_errors;
+  unsigned int s_error_code;
+  double s_rtt;
+  double s_rtt_min;
+  double s_rtt_max;
+  struct timeval s_reply;
+  struct timeval s_done;
+
+  /* pacing */
+  int s_inflight;
+  int s_failed;
+  double s_rttvar;
+  struct timeval s_rto;
 };
 
 struct header{
@@ -84,11 +112,28 @@ struct total{
   struct skarab *t_vector;
 
   char *t_base;
+  int t_mapped;
   int t_chunks;
   unsigned int t_length;
 
   struct header t_header;
 
+  const char *t_abort;
+
+  int t_adaptive;
+  double t_window;            /* skarabs allowed a chunk in flight */
+  unsigned int t_inflight;
+  struct timeval t_decrease;  /* last time the window was halved */
+  double t_rate;              /* cap in bytes/s, 0 for none */
+  double t_tokens;
+  struct timeval t_refill;
+  unsigned int t_held;        /* sends held back by window or rate */
+
+  int (*t_progress)(struct total *t, void *data);
+  void *t_progress_data;
+  struct timeval t_progress_interval;
+  struct timeval t_progress_next;
+
   struct iovec t_io[2];
   struct sockaddr_in t_address;
 
@@ -144,11 +189,25 @@ struct total *create_total()
   t->t_vector = NULL;
 
   t->t_base = MAP_FAILED;
+  t->t_mapped = 0;
   t->t_chunks = 0;
   t->t_length = 0;
 
   t->t_header.h_magic = htons(SKARAB_REQ);
 
+  t->t_abort = NULL;
+
+  t->t_adaptive = 0;
+  t->t_window = 0.0;
+  t->t_inflight = 0;
+  t->t_rate = 0.0;
+  t->t_tokens = 0.0;
+  t->t_held = 0;
+
+  t->t_progress = NULL;
+  t->t_progress_data = NULL;
+  component_th(&(t->t_progress_interval), 0);
+
 # if 0
   t->t_header.h_sequence = 0;
   t->t_header.h_chunk = 0;
@@ -211,7 +270,9 @@ void destroy_total(struct total *t)
   }
 
   if(t->t_base != MAP_FAILED){
-    munmap(t->t_base, t->t_chunks * t->t_chunksize);
+    if(t->t_mapped){
+      munmap(t->t_base, t->t_chunks * t->t_chunksize);
+    }
     t->t_base = MAP_FAILED;
   }
 
@@ -254,6 +315,25 @@ int add_total(struct total *t, char *skarab)
   s->s_expire.tv_sec = 0;
   s->s_expire.tv_usec = 0;
 
+  s->s_index = t->t_count - 1;
+  s->s_sent_chunk = -2;
+  s->s_tries = 0;
+  s->s_sent = 0;
+  s->s_retransmits = 0;
+  s->s_late = 0;
+  s->s_errors = 0;
+  s->s_error_code = 0;
+  s->s_rtt = 0.0;
+  s->s_rtt_min = 0.0;
+  s->s_rtt_max = 0.0;
+  s->s_done.tv_sec = 0;
+  s->s_done.tv_usec = 0;
+
+  s->s_inflight = 0;
+  s->s_failed = 0;
+  s->s_rttvar = 0.0;
+  component_th(&(s->s_rto), INITIAL_TIMEOUT);
+
 #if 0
   component_th(&(s->s_delta), INITIAL_TIMEOUT);
 #endif
@@ -347,11 +427,26 @@ static int start_total(struct total *t, int verbose)
     s->s_expire.tv_sec  = when.tv_sec;
     s->s_expire.tv_usec = when.tv_usec;
 
+    s->s_reply.tv_sec  = t->t_begin.tv_sec;
+    s->s_reply.tv_usec = t->t_begin.tv_usec;
+
+    s->s_inflight = 0;
+    s->s_failed = 0;
+
     add_th(&when, &when, &extra);
   }
 
   qsort(t->t_vector, t->t_count, sizeof(struct skarab), &compare_qsort);
 
+  /* start with everybody in flight, the window shrinks on loss */
+  t->t_window = t->t_count;
+  t->t_inflight = 0;
+  t->t_decrease.tv_sec  = t->t_begin.tv_sec;
+  t->t_decrease.tv_usec = t->t_begin.tv_usec;
+  t->t_tokens = RATE_BURST * (8.0 + t->t_chunksize);
+  t->t_refill.tv_sec  = t->t_begin.tv_sec;
+  t->t_refill.tv_usec = t->t_begin.tv_usec;
+
   return 0;
 }
 
@@ -390,6 +485,7 @@ int open_total(struct total *t, char *name)
     printf("mapped %s at %p\n", name, t->t_base);
   }
 
+  t->t_mapped = 1;
   t->t_header.h_total = htons(t->t_chunks);
 
   close(fd);
@@ -397,6 +493,29 @@ int open_total(struct total *t, char *name)
   return 0;
 }
 
+/* upload from memory owned by the caller, which has to stay valid until destroy_total */
+
+int load_total(struct total *t, char *base, unsigned int length)
+{
+  if(length <= 0){
+    fprintf(stderr, "nothing to upload\n");
+    return -1;
+  }
+
+  t->t_chunks = (length + t->t_chunksize - 1) / t->t_chunksize;
+  t->t_length = length;
+
+  if(t->t_verbose > 1){
+    printf("buffer has %u bytes or %d %u byte chunks\n", length, t->t_chunks, t->t_chunksize);
+  }
+
+  t->t_base = base;
+  t->t_mapped = 0;
+  t->t_header.h_total = htons(t->t_chunks);
+
+  return 0;
+}
+
 /*****************************************************************************/
 
 static struct skarab *find_skarab(struct total *t, in_addr_t match)
@@ -410,6 +529,99 @@ static struct skarab *find_skarab(struct total *t, in_addr_t match)
 
 /*****************************************************************************/
 
+static struct timeval *timeout_of(struct total *t, struct skarab *s)
+{
+  return t->t_adaptive ? &(s->s_rto) : &(t->t_interval);
+}
+
+static double seconds_th(struct timeval *tv)
+{
+  return tv->tv_sec + (tv->tv_usec / 1000000.0);
+}
+
+static void set_th(struct timeval *tv, double seconds)
+{
+  tv->tv_sec = (long)seconds;
+  tv->tv_usec = (long)((seconds - tv->tv_sec) * 1000000.0);
+}
+
+/* can s send now ? Otherwise closer is moved to when the rate cap allows it */
+
+static int may_send(struct total *t, struct skarab *s, struct timeval *now, struct timeval *closer)
+{
+  struct timeval delta, when;
+  double need, burst;
+
+  if(t->t_adaptive && !(s->s_inflight) && (t->t_inflight >= t->t_window)){
+    /* an answer from somebody else frees up the window */
+    t->t_held++;
+    return 0;
+  }
+
+  if(t->t_rate > 0.0){
+    need = 8.0 + t->t_chunksize;
+    burst = RATE_BURST * need;
+    sub_th(&delta, now, &(t->t_refill));
+    t->t_tokens += seconds_th(&delta) * t->t_rate;
+    if(t->t_tokens > burst){
+      t->t_tokens = burst;
+    }
+    t->t_refill.tv_sec  = now->tv_sec;
+    t->t_refill.tv_usec = now->tv_usec;
+
+    if(t->t_tokens < need){
+      t->t_held++;
+      if(closer){
+        set_th(&delta, (need - t->t_tokens) / t->t_rate);
+        add_th(&when, now, &delta);
+        if(cmp_th(closer, &when) > 0){
+          closer->tv_sec  = when.tv_sec;
+          closer->tv_usec = when.tv_usec;
+        }
+      }
+      return 0;
+    }
+  }
+
+  return 1;
+}
+
+/* the chunk s has in flight was not answered in time */
+
+static int perform_timeout(struct total *t, struct skarab *s, struct timeval *now)
+{
+  struct timeval delta;
+  double rto;
+
+  if(s->s_tries >= MAX_RETRIES){
+    fprintf(stderr, "giving up on skarab 0x%08x after %u tries\n", s->s_addr, s->s_tries);
+    s->s_failed = 1;
+    s->s_inflight = 0;
+    t->t_inflight--;
+    return 1;
+  }
+
+  /* back off this skarab */
+  rto = seconds_th(&(s->s_rto)) * 2.0;
+  if(rto > (MAX_TIMEOUT / 1000.0)){
+    rto = MAX_TIMEOUT / 1000.0;
+  }
+  set_th(&(s->s_rto), rto);
+
+  /* and treat the loss as congestion, at most once per timeout */
+  sub_th(&delta, now, &(t->t_decrease));
+  if(cmp_th(&delta, &(s->s_rto)) >= 0){
+    t->t_window /= 2.0;
+    if(t->t_window < 1.0){
+      t->t_window = 1.0;
+    }
+    t->t_decrease.tv_sec  = now->tv_sec;
+    t->t_decrease.tv_usec = now->tv_usec;
+  }
+
+  return 0;
+}
+
 static int perform_send(struct total *t, struct skarab *s)
 {
   int wr, need;
@@ -472,6 +684,15 @@ static int perform_send(struct total *t, struct skarab *s)
   }
 
   t->t_sent++;
+  s->s_sent++;
+
+  if(s->s_sent_chunk == s->s_chunk){
+    s->s_retransmits++;
+    s->s_tries++;
+  } else {
+    s->s_sent_chunk = s->s_chunk;
+    s->s_tries = 1;
+  }
 
   if(wr != (8 + t->t_chunksize)){
     fprintf(stderr, "unexpected send length %d\n", wr);
@@ -480,7 +701,15 @@ static int perform_send(struct total *t, struct skarab *s)
 
   gettimeofday(&(s->s_last), NULL);
 
-  add_th(&(s->s_expire), &(s->s_last), &(t->t_interval));
+  add_th(&(s->s_expire), &(s->s_last), timeout_of(t, s));
+
+  if(t->t_rate > 0.0){
+    t->t_tokens -= wr;
+  }
+  if(!(s->s_inflight)){
+    s->s_inflight = 1;
+    t->t_inflight++;
+  }
 
 #ifdef DEBUG
   fprintf(stderr, "sent chunk %d/%d\n", s->s_chunk, t->t_chunks);
@@ -498,6 +727,40 @@ static int perform_index(struct total *t, unsigned int i)
   return perform_send(t, s);
 }
 
+static void update_rtt(struct skarab *s, struct timeval *now)
+{
+  struct timeval delta;
+  double sample, rto;
+
+  sub_th(&delta, now, &(s->s_last));
+  sample = seconds_th(&delta);
+
+  if(s->s_rtt <= 0.0){
+    s->s_rtt = sample;
+    s->s_rttvar = sample / 2.0;
+    s->s_rtt_min = sample;
+    s->s_rtt_max = sample;
+  } else {
+    s->s_rttvar += (fabs(s->s_rtt - sample) - s->s_rttvar) / 4.0;
+    s->s_rtt += (sample - s->s_rtt) / 8.0;
+    if(sample < s->s_rtt_min){
+      s->s_rtt_min = sample;
+    }
+    if(sample > s->s_rtt_max){
+      s->s_rtt_max = sample;
+    }
+  }
+
+  /* as TCP, RFC 6298 */
+  rto = s->s_rtt + (4.0 * s->s_rttvar);
+  if(rto < (MIN_TIMEOUT / 1000.0)){
+    rto = MIN_TIMEOUT / 1000.0;
+  } else if(rto > (MAX_TIMEOUT / 1000.0)){
+    rto = MAX_TIMEOUT / 1000.0;
+  }
+  set_th(&(s->s_rto), rto);
+}
+
 static int perform_receive(struct total *t)
 {
   int rr;
@@ -552,12 +815,15 @@ static int perform_receive(struct total *t)
 #ifdef CHECK
   if(ntohs(answer.h_magic) != SKARAB_ACK){
     fprintf(stderr, "%s: bad reply code 0x%04x - expected 0x%04x\n", inet_ntoa(from.sin_addr), ntohs(answer.h_magic), SKARAB_ACK);
+    s->s_errors++;
     t->t_weird++;
     return -1;
   }
 
   if(ntohs(answer.h_total) != 0){
     fprintf(stderr, "%s: got error code 0x%04x from 0x%08x\n", inet_ntoa(from.sin_addr), ntohs(answer.h_total), ip);
+    s->s_errors++;
+    s->s_error_code = ntohs(answer.h_total);
     t->t_weird++;
     return -1;
   }
@@ -565,6 +831,7 @@ static int perform_receive(struct total *t)
 
   if(where > (s->s_chunk + 1)){
     fprintf(stderr, "%s: chunk 0x%04x from the future - expected 0x%04x\n", inet_ntoa(from.sin_addr), where, s->s_chunk + 1);
+    s->s_errors++;
     t->t_future++;
     return 0;
   }
@@ -572,7 +839,8 @@ static int perform_receive(struct total *t)
   if(where < (s->s_chunk + 1)){
     fprintf(stderr, "%s: stale chunk 0x%04x - expected 0x%04x\n", inet_ntoa(from.sin_addr), where, s->s_chunk + 1);
     /* wait a bit more ... */
-    add_th(&(s->s_expire), &now, &(t->t_interval));
+    add_th(&(s->s_expire), &now, timeout_of(t, s));
+    s->s_late++;
     t->t_late++;
     return 0;
   }
@@ -580,18 +848,48 @@ static int perform_receive(struct total *t)
   if(sequence != s->s_sequence){
     fprintf(stderr, "%s: mismatched sequence number 0x%04x - expected 0x%04x\n", inet_ntoa(from.sin_addr), ntohs(answer.h_sequence), s->s_sequence);
     /* wait a bit more ... otherwise other packet might not drain */
-    add_th(&(s->s_expire), &now, &(t->t_interval));
+    add_th(&(s->s_expire), &now, timeout_of(t, s));
+    s->s_errors++;
     t->t_weird++;
     return 0;
   }
 
   s->s_chunk++;
+  s->s_reply.tv_sec  = now.tv_sec;
+  s->s_reply.tv_usec = now.tv_usec;
+  if(s->s_tries == 1){
+    /* Karn: only replies to packets sent once give rtt samples */
+    update_rtt(s, &now);
+  }
+  if(s->s_chunk >= t->t_chunks){
+    s->s_done.tv_sec  = now.tv_sec;
+    s->s_done.tv_usec = now.tv_usec;
+  }
+
+  if(s->s_inflight){
+    s->s_inflight = 0;
+    t->t_inflight--;
+  }
+  if(t->t_adaptive){
+    /* additive increase, by one per window of answers */
+    t->t_window += 1.0 / t->t_window;
+    if(t->t_window > t->t_count){
+      t->t_window = t->t_count;
+    }
+  }
 
 #if 0
   sub_th(&(s->s_delta), &now, &(s->s_last)));
   /* TODO: loads of fudge factors ... */
 #endif
 
+  if((s->s_chunk < t->t_chunks) && !may_send(t, s, &now, NULL)){
+    /* due now, bulk_send sends it once allowed */
+    s->s_expire.tv_sec  = now.tv_sec;
+    s->s_expire.tv_usec = now.tv_usec;
+    return 0;
+  }
+
   return perform_send(t, s);
 }
 
@@ -616,6 +914,80 @@ int complete_count(struct total *t)
   return number;
 }
 
+/* fill in the telemetry of the skarab added as number index */
+
+int board_total(struct total *t, unsigned int index, struct board *b)
+{
+  unsigned int i;
+  struct skarab *s;
+  struct timeval now, delta;
+
+  s = NULL;
+  for(i = 0; i < t->t_count; i++){
+    if(t->t_vector[i].s_index == index){
+      s = &(t->t_vector[i]);
+      break;
+    }
+  }
+  if(s == NULL){
+    return -1;
+  }
+
+  b->b_completed = (s->s_chunk >= t->t_chunks) ? 1 : 0;
+  b->b_failed = s->s_failed;
+  b->b_rto = seconds_th(timeout_of(t, s));
+  b->b_chunks = (s->s_chunk > 0) ? s->s_chunk : 0;
+  if(b->b_chunks > t->t_chunks){
+    b->b_chunks = t->t_chunks;
+  }
+  b->b_total = t->t_chunks;
+  b->b_sent = s->s_sent;
+  b->b_retransmits = s->s_retransmits;
+  b->b_late = s->s_late;
+  b->b_errors = s->s_errors;
+  b->b_error_code = s->s_error_code;
+  b->b_rtt = s->s_rtt;
+  b->b_rtt_min = s->s_rtt_min;
+  b->b_rtt_max = s->s_rtt_max;
+
+  if(b->b_completed){
+    sub_th(&delta, &(s->s_done), &(t->t_begin));
+    b->b_elapsed = seconds_th(&delta);
+    b->b_silent = 0.0;
+  } else {
+    gettimeofday(&now, NULL);
+    b->b_elapsed = -1.0;
+    sub_th(&delta, &now, &(s->s_reply));
+    b->b_silent = seconds_th(&delta);
+  }
+
+  return 0;
+}
+
+/* why run_total gave up, or NULL */
+
+const char *abort_total(struct total *t)
+{
+  return t->t_abort;
+}
+
+/* call progress(t, data) at most every interval ms while running, a nonzero return aborts */
+
+void progress_total(struct total *t, int (*progress)(struct total *t, void *data), void *data, unsigned int interval)
+{
+  t->t_progress = progress;
+  t->t_progress_data = data;
+  component_th(&(t->t_progress_interval), interval);
+}
+
+/* adapt timeouts to each skarab and the number in flight to losses, and cap the send rate (bytes/s, 0 for none) */
+
+void pacing_total(struct total *t, int adaptive, double rate)
+{
+  t->t_adaptive = adaptive;
+  t->t_rate = (rate > 0.0) ? rate : 0.0;
+}
+
 /*****************************************************************************/
 
 static void handle_signal(int s)
@@ -656,8 +1028,17 @@ static int bulk_send(struct total *t)
 
   for(i = 0; i < t->t_count; i++){
     s = &(t->t_vector[i]);
-    if(s->s_chunk < t->t_chunks){
+    if((s->s_chunk < t->t_chunks) && !(s->s_failed)){
       if(cmp_th(&now, &(s->s_expire)) >= 0){
+        if(t->t_adaptive && s->s_inflight){
+          if(perform_timeout(t, s, &now)){
+            finished++;
+            continue;
+          }
+        }
+        if(!may_send(t, s, &now, &closer)){
+          continue;
+        }
         result = perform_index(t, i);
         if(result > 0){
           finished++;
@@ -697,22 +1078,167 @@ void usage(char *name)
   printf("-v         more output\n");
   printf("-h         this help\n");
   printf("-s size    specify a chunk size (max %u)\n", MAX_CHUNK);
+  printf("-a         adapt timeouts and packets in flight to the network\n");
+  printf("-r rate    cap the total send rate, in Mb/s\n");
   printf("-t count   burst of errors triggering an abort (multiplied by number of skarabs)\n");
   printf("-T count   burst of errors triggering an abort\n");
   printf("\n");
   printf("note: the list of skarabs is space delimited\n");
 }
 
+/* upload to all the skarabs added to t, returns an exit code like main */
+
+int run_total(struct total *t, int verbose, unsigned int timeouts)
+{
+  fd_set fsr;
+  int result, problems, completed, terminal;
+  struct timeval delta, now;
+  unsigned int last, lost;
+
+  terminal = isatty(STDOUT_FILENO);
+
+  if(start_total(t, verbose)){
+    fprintf(stderr, "initialisation failed\n");
+    return EX_SOFTWARE;
+  }
+
+  if(verbose > 1){
+    printf("attempting to upload to %u skarabs\n", t->t_count);
+  }
+
+  problems = 0;
+  last = 0;
+  lost = 0;
+
+  add_th(&(t->t_progress_next), &(t->t_begin), &(t->t_progress_interval));
+
+  for(run = 1; run > 0; ){
+
+    result = bulk_send(t);
+    if(result > 0){
+      break;
+    }
+    if(result < 0){
+      problems++;
+      if(problems > MAX_PROBLEMS){
+        fprintf(stderr, "too many problems, giving up with %d of %u programmed\n", complete_count(t), t->t_count);
+        t->t_abort = "too many problems";
+        return EX_SOFTWARE;
+      }
+    }
+
+    FD_ZERO(&fsr);
+    FD_SET(t->t_fd, &fsr);
+
+    gettimeofday(&now, NULL);
+    if((verbose > 0) && (terminal > 0)){
+      if(last != now.tv_sec){
+        printf("\rTX=%7u", t->t_sent);
+        fflush(stdout);
+        last = now.tv_sec;
+      }
+    }
+
+    if(t->t_progress && (cmp_th(&now, &(t->t_progress_next)) >= 0)){
+      if((*(t->t_progress))(t, t->t_progress_data)){
+        t->t_abort = "aborted by progress callback";
+        run = (-2);
+        break;
+      }
+      add_th(&(t->t_progress_next), &now, &(t->t_progress_interval));
+    }
+
+    sub_th(&delta, &(t->t_stall), &now);
+
+    result = select(t->t_fd + 1, &fsr, NULL, NULL, &delta);
+    if(result < 0){
+      switch(errno){
+        case EAGAIN :
+        case EINTR :
+          break;
+        default :
+          problems++;
+          break;
+      }
+    }
+
+    if(result == 0){
+      t->t_timeout++;
+      t->t_burst++;
+      if((timeouts > 0) && (t->t_burst > timeouts)){
+        fprintf(stderr, "now lost %u packets and overall %u of %u sent so giving up with %d of %u programmed\n", t->t_burst, t->t_timeout, t->t_sent, complete_count(t), t->t_count);
+        t->t_abort = "too many timeouts";
+        return EX_SOFTWARE;
+      }
+
+      gettimeofday(&now, NULL);
+      add_th(&(t->t_stall), &now, &(t->t_interval));
+    }
+
+    if(result > 0){
+      lost = 0;
+      result = perform_receive(t);
+      if(result < 0){
+        problems++;
+      } else {
+        t->t_burst = 0;
+      }
+    }
+
+  }
+
+  if((verbose > 0) && (terminal > 0)){
+    printf("\r");
+  }
+
+  gettimeofday(&now, NULL);
+
+  sub_th(&delta, &now, &(t->t_begin));
+  completed = complete_count(t);
+
+  if(verbose > 0){
+    if(verbose > 1){
+      printf("%u total skarabs\n", t->t_count);
+      printf("%d completed uploads\n", completed);
+      printf("%d upload errors\n", problems);
+      printf("%u required block operations\n", t->t_count * (t->t_chunks + 1));
+      printf("%u sent packets\n", t->t_sent);
+      printf("%u received packets\n", t->t_got);
+      printf("%u error response packets\n", t->t_weird);
+      printf("%u late received packets\n", t->t_late);
+      printf("%u future received packets\n", t->t_future);
+      printf("%u misaddressed packets\n", t->t_alien);
+      printf("%u under or oversized packets\n", t->t_misfit);
+      printf("%u interruptions and stalls\n", t->t_defer);
+      printf("%u select timeouts\n", t->t_timeout);
+      printf("%u sends held back by pacing\n", t->t_held);
+      printf("%lu.%06lus elapsed time\n", delta.tv_sec, delta.tv_usec);
+      printf("%.3fMb/s send data rate\n", ((double)(t->t_sent) * (t->t_chunksize + sizeof(struct header))) / ((delta.tv_sec * 1000000) + delta.tv_usec));
+    } else {
+      printf("programmed %d of %u skarabs in %lu.%06lus with %d problems\n", completed, t->t_count, delta.tv_sec, delta.tv_usec, problems);
+    }
+  }
+
+  if((run < 0) && (t->t_abort == NULL)){
+    t->t_abort = "interrupted";
+  }
+
+  if(run < 0){
+    return EX_UNAVAILABLE;
+  }
+
+  return (completed < t->t_count) ? EX_SOFTWARE : EX_OK;
+}
+
 int main(int argc, char **argv)
 {
   struct total *t;
   struct sigaction sag;
-  fd_set fsr;
-  int verbose, result, problems, completed, scale, terminal;
+  int verbose, scale, result, adaptive;
+  double rate;
   int i, j, c;
   char *app, *name;
-  struct timeval delta, now;
-  unsigned int last, lost, timeouts;
+  unsigned int timeouts;
   unsigned int chunk;
 
   verbose = 2;
@@ -727,8 +1253,8 @@ int main(int argc, char **argv)
 
   timeouts = MAX_TIMEOUTS;
   scale = 1;
-
-  terminal = isatty(STDOUT_FILENO);
+  adaptive = 0;
+  rate = 0.0;
 
   i = j = 1;
   while (i < argc) {
@@ -750,9 +1276,15 @@ int main(int argc, char **argv)
           j++;
           break;
 
+        case 'a' :
+          adaptive = 1;
+          j++;
+          break;
+
         case 'f' :
         case 's' :
         case 't' :
+        case 'r' :
 
           j++;
           if (argv[i][j] == '\0') {
@@ -778,6 +1310,9 @@ int main(int argc, char **argv)
                 return EX_USAGE;
               }
               break;
+            case 'r' :
+              rate = strtod(argv[i] + j, NULL) * 1000000.0 / 8.0;
+              break;
             case 'T' :
               scale = 0;
               /* fall */
@@ -835,119 +1370,11 @@ int main(int argc, char **argv)
   sigaction(SIGHUP, &sag, NULL);
   sigaction(SIGTERM, &sag, NULL);
 
-  if(start_total(t, verbose)){
-    fprintf(stderr, "%s: initialisation failed\n", app);
-    destroy_total(t);
-    return EX_SOFTWARE;
-  }
-
-  if(verbose > 1){
-    printf("attempting to upload to %u skarabs\n", t->t_count);
-  }
-
-  problems = 0;
-  last = 0;
-  lost = 0;
+  pacing_total(t, adaptive, rate);
 
-  for(run = 1; run > 0; ){
-
-    result = bulk_send(t);
-    if(result > 0){
-      break;
-    }
-    if(result < 0){
-      problems++;
-      if(problems > MAX_PROBLEMS){
-        fprintf(stderr, "%s: too many problems, giving up with %d of %u programmed\n", app, completed, t->t_count);
-        destroy_total(t);
-        return EX_SOFTWARE;
-      }
-    }
-
-    FD_ZERO(&fsr);
-    FD_SET(t->t_fd, &fsr);
-
-    gettimeofday(&now, NULL);
-    if((verbose > 0) && (terminal > 0)){
-      if(last != now.tv_sec){
-        printf("\rTX=%7u", t->t_sent);
-        fflush(stdout);
-        last = now.tv_sec;
-      }
-    }
-
-    sub_th(&delta, &(t->t_stall), &now);
-
-    result = select(t->t_fd + 1, &fsr, NULL, NULL, &delta);
-    if(result < 0){
-      switch(errno){
-        case EAGAIN :
-        case EINTR :
-          break;
-        default :
-          problems++;
-          break;
-      }
-    }
-
-    if(result == 0){
-      t->t_timeout++;
-      t->t_burst++;
-      if((timeouts > 0) && (t->t_burst > timeouts)){
-        fprintf(stderr, "%s: now lost %u packets and overall %u of %u sent so giving up with %d of %u programmed\n", app, t->t_burst, t->t_timeout, t->t_sent, completed, t->t_count);
-        destroy_total(t);
-        return EX_SOFTWARE;
-      }
-
-      gettimeofday(&now, NULL);
-      add_th(&(t->t_stall), &now, &(t->t_interval));
-    }
-
-    if(result > 0){
-      lost = 0;
-      result = perform_receive(t);
-      if(result < 0){
-        problems++;
-      } else {
-        t->t_burst = 0;
-      }
-    }
-
-  }
-
-  if((verbose > 0) && (terminal > 0)){
-    printf("\r");
-  }
-
-  gettimeofday(&now, NULL);
-
-  sub_th(&delta, &now, &(t->t_begin));
-  completed = complete_count(t);
-
-  if(verbose > 0){
-    if(verbose > 1){
-      printf("%u total skarabs\n", t->t_count);
-      printf("%d completed uploads\n", completed);
-      printf("%d upload errors\n", problems);
-      printf("%u required block operations\n", t->t_count * (t->t_chunks + 1));
-      printf("%u sent packets\n", t->t_sent);
-      printf("%u received packets\n", t->t_got);
-      printf("%u error response packets\n", t->t_weird);
-      printf("%u late received packets\n", t->t_late);
-      printf("%u future received packets\n", t->t_future);
-      printf("%u misaddressed packets\n", t->t_alien);
-      printf("%u under or oversized packets\n", t->t_misfit);
-      printf("%u interruptions and stalls\n", t->t_defer);
-      printf("%u select timeouts\n", t->t_timeout);
-      printf("%lu.%06lus elapsed time\n", delta.tv_sec, delta.tv_usec);
-      printf("%.3fMb/s send data rate\n", ((double)(t->t_sent) * (t->t_chunksize + sizeof(struct header))) / ((delta.tv_sec * 1000000) + delta.tv_usec));
-    } else {
-      printf("programmed %d of %u skarabs in %lu.%06lus with %d problems\n", completed, t->t_count, delta.tv_sec, delta.tv_usec, problems);
-    }
-  }
+  result = run_total(t, verbose, timeouts);
 
   destroy_total(t);
 
-  return (run < 0) ? EX_UNAVAILABLE : EX_OK;
+  return result;
 }
-
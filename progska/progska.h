@@ -0,0 +1,38 @@
+#ifndef PROGSKA_H_
+#define PROGSKA_H_
+
+#define MAX_TIMEOUTS       50  /* */
+
+struct total;
+
+struct board{
+  int b_completed;
+  int b_chunks;                /* chunks acknowledged */
+  int b_total;                 /* chunks in the image */
+  unsigned int b_sent;         /* packets sent, including retransmits */
+  unsigned int b_retransmits;
+  unsigned int b_late;         /* stale replies */
+  unsigned int b_errors;       /* bad, future and mismatched replies */
+  unsigned int b_error_code;   /* last error code reported by the skarab */
+  double b_rtt;                /* smoothed round trip time, in s */
+  double b_rtt_min;
+  double b_rtt_max;
+  int b_failed;                /* dropped after too many unanswered sends */
+  double b_rto;                /* current retransmit timeout, in s */
+  double b_elapsed;            /* s from start to completion, or -1 */
+  double b_silent;             /* s since the last good reply */
+};
+
+struct total *create_total();
+void destroy_total(struct total *t);
+int update_chunksize(struct total *t, unsigned int chunksize);
+int add_total(struct total *t, char *skarab);
+int open_total(struct total *t, char *name);
+int load_total(struct total *t, char *base, unsigned int length);
+void progress_total(struct total *t, int (*progress)(struct total *t, void *data), void *data, unsigned int interval);
+void pacing_total(struct total *t, int adaptive, double rate);
+int run_total(struct total *t, int verbose, unsigned int timeouts);
+int board_total(struct total *t, unsigned int index, struct board *b);
+const char *abort_total(struct total *t);
+
+#endif
@@ -2,6 +2,18 @@ from .wishbonedevice import WishBoneDevice
 import numpy as np
 import struct,math
 import logging
+import functools
+from contextlib import contextmanager
+
+
+def _batched(func):
+    """ Send all the register writes of an HMCAD1511 method as one sequence
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.batch():
+            return func(self, *args, **kwargs)
+    return wrapper
 
 
 class HMCAD1511(WishBoneDevice):
@@ -171,10 +183,13 @@ class HMCAD1511(WishBoneDevice):
             self.logger.error("Invalid parameter")
             raise ValueError("Invalid parameter")
         self.cs = cs & 0xff
+        # register writes queued by batch(), as (addr_data, cs) tuples
+        self._queue = None
 
 
     # Put some initialization here rather than in __init__ so that instantiate
     # an HMCAD1511 object wouldn't reset/interrupt the running ADCs.
+    @_batched
     def init(self,numChannel=4,clkDivide=1,lowClkFreq=False):
         """ Reset and initialize ADCs
 
@@ -190,33 +205,80 @@ class HMCAD1511(WishBoneDevice):
         self.powerUp()
         self.selectInput([1,2,3,4])
 
-    def _bitCtrl(self, state, sda=0):   
-        # state: 0 - idle, 1 - start, 2 - transmit, 3 - stop
-        if state == self.STATE_3WIRE_START:
-            cmd = (1 * self.M_ADC_SCL) | (sda * self.M_ADC_SDA) | self.cs
-            self._write(cmd, self.A_WB_W_3WIRE)
-        elif state == self.STATE_3WIRE_TRANS:
-            cmd = (0 * self.M_ADC_SCL) | (sda * self.M_ADC_SDA) | self.cs
-            self._write(cmd, self.A_WB_W_3WIRE)
-            cmd = (1 * self.M_ADC_SCL) | (sda * self.M_ADC_SDA) | self.cs
-            self._write(cmd, self.A_WB_W_3WIRE)
-        elif state == self.STATE_3WIRE_STOP:
-            cmd = (1 * self.M_ADC_SCL) | (sda * self.M_ADC_SDA) | 0x00
-            self._write(cmd, self.A_WB_W_3WIRE)
-
     def _wordCtrl(self, data, length=24):
         # wishbone data[9:0] <==> SCL, SDA, cs[7:0]
-        self._bitCtrl(state=self.STATE_3WIRE_START)
-        for i in range(length):
-            bit = (data >> (length-i-1)) & 1
-            self._bitCtrl(sda=bit, state=self.STATE_3WIRE_TRANS)
-        self._bitCtrl(state=self.STATE_3WIRE_STOP)
+        self._write_many(self._compile([data], [self.cs], length),
+                         self.A_WB_W_3WIRE)
+
+    def _compile(self, words, css, length=24):
+        """ Compile 3-wire transfers into the sequence of wishbone words
+        that clocks them out, one after another. Each transfer is a start
+        word (SCL high, chip select asserted), two words per bit (SCL low
+        then high, with SDA set to the bit) and a stop word (SCL high,
+        chip select released).
+
+        words: the addr_data words to shift out
+        css: the chip select to use for each word
+        """
+        words = np.asarray(words, dtype=np.int64).reshape(-1, 1)
+        css = np.asarray(css, dtype=np.int64).reshape(-1, 1)
+        shifts = np.arange(length - 1, -1, -1)
+        sda = ((words >> shifts) & 1) * self.M_ADC_SDA
+        # per word: start, (SCL low, SCL high) per bit, stop
+        seq = np.empty((len(words), 2 * length + 2), dtype=np.int64)
+        seq[:, 0] = self.M_ADC_SCL | css[:, 0]
+        seq[:, 1:-1:2] = sda | css
+        seq[:, 2:-1:2] = self.M_ADC_SCL | sda | css
+        seq[:, -1] = self.M_ADC_SCL
+        return seq.ravel()
 
     def write(self, data, addr):
         data = data & 0xffff
         addr = addr & 0xff
         addr_data = (addr << 16) | data
-        self._wordCtrl(addr_data)
+        if self._queue is not None:
+            self._queue.append((addr_data, self.cs))
+        else:
+            self._wordCtrl(addr_data)
+
+    def write_many(self, writes):
+        """ Write several registers in one go
+
+        writes: a list of (data, addr) tuples, written in order with the
+        current chip select
+
+        E.g.
+            adc.write_many([(0x0001, 0x00), (0x0200, 0x0f)])
+        """
+        with self.batch():
+            for data, addr in writes:
+                self.write(data, addr)
+
+    @contextmanager
+    def batch(self):
+        """ Queue register writes and send them as one sequence
+
+        Every write() inside the block is compiled into a single stream
+        of wishbone words, sent when the block exits. Nested blocks are
+        folded into the outermost one.
+
+        E.g.
+            with adc.batch():
+                adc.reset()
+                adc.setOperatingMode(2)
+        """
+        if self._queue is not None:
+            yield
+            return
+        self._queue = []
+        try:
+            yield
+            queued = self._queue
+        finally:
+            self._queue = None
+        if queued:
+            words, css = zip(*queued)
+            self._write_many(self._compile(words, css), self.A_WB_W_3WIRE)
 
     def _set(self, d1, d2, mask=None):
         # Update some bits of d1 with d2, while keep other bits unchanged
@@ -237,6 +299,7 @@ class HMCAD1511(WishBoneDevice):
             self.logger.error("Invalid parameter")
             raise ValueError("Invalid parameter")
 
+    @_batched
     def test(self, mode='off', _bits_custom1=None, _bits_custom2=None):
         """ Test ADC LVDS
 
@@ -308,6 +371,7 @@ class HMCAD1511(WishBoneDevice):
             2:[[0,1,2,3],[4,5,6,7]],
             1:[[0,1,2,3,4,5,6,7]]}
 
+    @_batched
     def cGain(self, gains, cgain_cfg=False, fgain_cfg=False):
         """ Set the coarse gain of the ADC channels
 
@@ -378,6 +442,7 @@ class HMCAD1511(WishBoneDevice):
             val = self._set(0x0, vals[0], mask)
             self.write(val, rid)
 
+    @_batched
     def fGain(self, gains, numChannel=1):
         """ Set the fine gain of the 8 ADC cores
 
@@ -440,6 +505,7 @@ class HMCAD1511(WishBoneDevice):
             cfg = cfg + (1 << 6)
         return cfg
 
+    @_batched
     def setOperatingMode(self, numChannel, clkDivide=1, lowClkFreq=False):
         """ Set interleaving mode and clock divide factor
 
@@ -494,7 +560,7 @@ class HMCAD1511(WishBoneDevice):
             self.logger.error("Invalid parameter")
             raise ValueError("Invalid parameter")
 
-        data = data.reshape(-1,numChannel,8/numChannel)
+        data = data.reshape(-1,numChannel,8//numChannel)
         data = np.einsum("ijk->jik", data)
         data = data.reshape(numChannel,-1)
         data = np.einsum("ij->ji", data)
@@ -502,6 +568,7 @@ class HMCAD1511(WishBoneDevice):
         return data
 
 
+    @_batched
     def selectInput(self, inputs):
         """ Input select
 
@@ -564,6 +631,7 @@ class HMCAD1520(HMCAD1511):
                     'lvds_advance' : 0b1 << 4,
                     'lvds_delay' : 0b1 << 5, }
 
+    @_batched
     def init(self,numChannel=4,clkDivide=1,lowClkFreq=False,resolution=12):
         """ Reset and initialize ADCs
         """
@@ -575,6 +643,7 @@ class HMCAD1520(HMCAD1511):
         self.powerUp()
         self.selectInput([1,2,3,4])
 
+    @_batched
     def setOperatingMode(self, numChannel, clkDivide=1, lowClkFreq=False, resolution=12):
         """ Set operating mode and clock divide factor
 
@@ -1,23 +1,33 @@
 import logging
 import threading
 import time
+import collections
+from concurrent.futures import Future
 from katcp import Message
 
 LOGGER = logging.getLogger(__name__)
 
-raise DeprecationWarning
-
 
 class AsyncRequester(object):
     """
-    A class to hold information about a specific KATCP request made by a FPGA.
+    Keeps track of the non-blocking KATCP requests made to a host. Each
+    request gets a concurrent.futures.Future, resolved with (reply, informs)
+    when the reply arrives; asyncio code can await it through
+    asyncio.wrap_future.
     """
     def __init__(self, host, request_func, max_requests=100):
+        """
+        :param host: the host the requests go to
+        :param request_func: the callback_request function of the client
+        :param max_requests: the most requests kept, the oldest are
+            dropped to make room
+        """
         self.host = host
         self._nb_request_id_lock = threading.Lock()
         self._nb_request_id = 0
         self._nb_requests_lock = threading.Lock()
-        self._nb_requests = {}
+        # request_id -> AsyncRequest, oldest first
+        self._nb_requests = collections.OrderedDict()
         self._nb_max_requests = max_requests
         self._nb_request_func = request_func
 
@@ -27,10 +37,8 @@ class AsyncRequester(object):
         :param request_id:
         :return:
         """
-        try:
-            return self._nb_requests[request_id]
-        except KeyError:
-            return None
+        with self._nb_requests_lock:
+            return self._nb_requests.get(request_id)
 
     def nb_pop_request_by_id(self, request_id):
         """
@@ -38,27 +46,18 @@ class AsyncRequester(object):
         :param request_id:
         :return:
         """
-        try:
-            self._nb_requests_lock.acquire()
-            r = self._nb_requests.pop(request_id)
-            self._nb_requests_lock.release()
-            return r
-        except KeyError:
-            return None
+        with self._nb_requests_lock:
+            return self._nb_requests.pop(request_id, None)
 
     def nb_pop_oldest_request(self):
         """
 
         :return:
         """
-        req = self._nb_requests[self._nb_requests.keys()[0]]
-        for v in self._nb_requests.values():
-            if v.time_tx < req.time_tx:
-                req = v
-        self._nb_requests_lock.acquire()
-        r = self.nb_pop_request_by_id(req.request_id)
-        self._nb_requests_lock.release()
-        return r
+        with self._nb_requests_lock:
+            if len(self._nb_requests) == 0:
+                return None
+            return self._nb_requests.popitem(last=False)[1]
 
     def nb_get_request_result(self, request_id):
         """
@@ -76,74 +75,90 @@ class AsyncRequester(object):
         :param request_id:
         :param inform_cb:
         :param reply_cb:
-        :return:
+        :return: the AsyncRequest
         """
-        if request_id in self._nb_requests.keys():
-            raise RuntimeError('Trying to add request with id(%s) but it '
-                               'already exists.' % request_id)
-        self._nb_requests_lock.acquire()
-        self._nb_requests[request_id] = AsyncRequest(
-            self.host, request_name, request_id, inform_cb, reply_cb)
-        self._nb_requests_lock.release()
+        req = AsyncRequest(self.host, request_name, request_id, inform_cb,
+                           reply_cb)
+        with self._nb_requests_lock:
+            if request_id in self._nb_requests:
+                raise RuntimeError('Trying to add request with id(%s) but it '
+                                   'already exists.' % request_id)
+            self._nb_requests[request_id] = req
+        return req
 
     def nb_get_next_request_id(self):
         """
 
         :return:
         """
-        self._nb_request_id_lock.acquire()
-        self._nb_request_id += 1
-        reqid = self._nb_request_id
-        self._nb_request_id_lock.release()
-        return str(reqid)
+        with self._nb_request_id_lock:
+            self._nb_request_id += 1
+            return str(self._nb_request_id)
 
-    def nb_replycb(self, msg, *userdata):
+    def nb_replycb(self, msg, request_id):
         """
         The callback for request replies. Check that the ID exists and
         call that request's got_reply function.
         :param msg - the received message
-        :param userdata
+        :param request_id
         """
-        request_id = ''.join(userdata)
-        if request_id not in self._nb_requests.keys():
-            raise RuntimeError('Recieved reply for request_id(%s), but no such '
-                               'stored request.' % request_id)
-        self._nb_requests[request_id].got_reply(msg.copy())
+        req = self.nb_get_request_by_id(request_id)
+        if req is None:
+            LOGGER.debug('%s: reply for request_id(%s), which was dropped.' %
+                         (self.host, request_id))
+            return
+        req.got_reply(msg.copy())
 
-    def nb_informcb(self, msg, *userdata):
+    def nb_informcb(self, msg, request_id):
         """
         The callback for request informs. Check that the ID exists and
         call that request's got_inform function.
         :param msg - the received message
-        :param userdata
+        :param request_id
         """
-        request_id = ''.join(userdata)
-        if request_id not in self._nb_requests.keys():
-            raise RuntimeError('Recieved inform for request_id(%s), but no '
-                               'such stored request.' % request_id)
-        self._nb_requests[request_id].got_inform(msg.copy())
+        req = self.nb_get_request_by_id(request_id)
+        if req is None:
+            return
+        req.got_inform(msg.copy())
 
-    def nb_request(self, request, inform_cb=None, reply_cb=None, *args):
+    def nb_request(self, request, inform_cb=None, reply_cb=None, *args,
+                   **kwargs):
         """
         Make a non-blocking request.
         :param self - this object.
         :param request - the request string.
-        :param inform_cb - an optional callback function, called upon receipt
-        of every inform to the request.
-        :param reply_cb - an optional callback function, called upon receipt
-        of the reply to the request.
+        :param inform_cb - an optional callback function, called as
+        inform_cb(host, request_id, inform) upon receipt of every inform to
+        the request.
+        :param reply_cb - an optional callback function, called as
+        reply_cb(host, request_id) upon receipt of the reply to the request.
         :param args - arguments to the katcp.Message object.
-        """
-        if len(self._nb_requests) == self._nb_max_requests:
+        :param timeout - keyword only, seconds after which the client
+        replies to the request with a failure.
+        :return: a dictionary with the host, request, id and future
+        """
+        timeout = kwargs.pop('timeout', None)
+        if len(kwargs) > 0:
+            raise TypeError('Unexpected keyword arguments: %s' % kwargs)
+        while len(self._nb_requests) >= self._nb_max_requests:
             oldreq = self.nb_pop_oldest_request()
+            if oldreq is None:
+                break
             LOGGER.debug('Request list full, removing oldest one(%s,%s).' % (
                 oldreq.request, oldreq.request_id))
+            oldreq.future.cancel()
         request_id = self.nb_get_next_request_id()
-        self.nb_add_request(request, request_id, inform_cb, reply_cb)
+        req = self.nb_add_request(request, request_id, inform_cb, reply_cb)
         request_msg = Message.request(request, *args)
-        self._nb_request_func(msg=request_msg, reply_cb=self.nb_replycb,
-                              inform_cb=self.nb_informcb, user_data=request_id)
-        return {'host': self.host, 'request': request, 'id': request_id}
+        try:
+            self._nb_request_func(msg=request_msg, reply_cb=self.nb_replycb,
+                                  inform_cb=self.nb_informcb,
+                                  user_data=(request_id, ), timeout=timeout)
+        except Exception as exc:
+            self.nb_pop_request_by_id(request_id)
+            req.future.set_exception(exc)
+        return {'host': self.host, 'request': request, 'id': request_id,
+                'future': req.future}
 
 
 class AsyncRequest(object):
@@ -162,6 +177,7 @@ class AsyncRequest(object):
         self.reply_time = -1
         self.reply_cb = reply_cb
         self.inform_cb = inform_cb
+        self.future = Future()
 
     def __str__(self):
         """
@@ -182,11 +198,15 @@ class AsyncRequest(object):
             error_string = 'rx reply(%s) does not match request(%s)' % (
                 reply_message.name, self.request)
             LOGGER.error(error_string)
-            raise RuntimeError(error_string)
+            if self.future.set_running_or_notify_cancel():
+                self.future.set_exception(RuntimeError(error_string))
+            return
         self.reply = reply_message
         self.reply_time = time.time()
         if self.reply_cb is not None:
             self.reply_cb(self.host, self.request_id)
+        if self.future.set_running_or_notify_cancel():
+            self.future.set_result((self.reply, self.informs))
 
     def got_inform(self, inform_message):
         """
@@ -198,16 +218,16 @@ class AsyncRequest(object):
             _errmsg = 'Received inform for message(%s,%s) after reply. ' \
                       'Invalid?' % (self.request, self.request_id)
             LOGGER.error(_errmsg)
-            raise RuntimeError(_errmsg)
+            return
         if not inform_message.name == self.request:
             _errmsg = 'rx inform(%s) does not match request(%s)' % (
                 inform_message.name, self.request)
             LOGGER.error(_errmsg)
-            raise RuntimeError(_errmsg)
+            return
         self.informs.append(inform_message)
         self.inform_times.append(time.time())
         if self.inform_cb is not None:
-            self.inform_cb(self.host, self.request_id)
+            self.inform_cb(self.host, self.request_id, inform_message)
 
     def complete_ok(self):
         """
@@ -20,6 +20,7 @@ from . import snapadc
 
 from .attribute_container import AttributeContainer
 from .utils import parse_fpg, get_hostname, get_kwarg, get_git_info_from_fpg
+from .utils import get_fpg_fingerprint, fingerprint_matches
 from .transport_katcp import KatcpTransport
 from .transport_tapcp import TapcpTransport
 from .transport_skarab import SkarabTransport
@@ -262,6 +263,28 @@ class CasperFpga(object):
             return data_byte_swapped
         return data
 
+    def read_many(self, reads):
+        """
+        Do a sequence of reads, possibly from different devices, letting
+        the transport batch them if it can.
+
+        :param reads: list of (device_name, size, offset) tuples, sizes and
+            offsets in bytes
+        :return: a list of binary data strings, one per read
+        """
+        data = self.transport.read_many(reads)
+        if self.is_little_endian:
+            swapped = []
+            for d in data:
+                assert ((len(d) % 4) == 0), \
+                    "Can only read multiples of 4 bytes because CasperFpga is doing an endianness flip"
+                data_byte_swapped = b""
+                for i in range(0, len(d), 4):
+                    data_byte_swapped += d[i:i+4][::-1]
+                swapped.append(data_byte_swapped)
+            data = swapped
+        return data
+
     def blindwrite(self, device_name, data, offset=0, **kwargs):
         if self.is_little_endian:
             assert ((len(data) % 4) == 0), \
@@ -273,6 +296,26 @@ class CasperFpga(object):
             return self.transport.blindwrite(device_name, data_byte_swapped, offset, **kwargs)
         return self.transport.blindwrite(device_name, data, offset, **kwargs)
 
+    def blindwrite_many(self, device_name, writes):
+        """
+        Do a sequence of blind writes to a device, in order, letting the
+        transport batch them if it can.
+
+        :param device_name: name of memory device to write
+        :param writes: list of (data, offset) pairs, offsets in bytes
+        """
+        if self.is_little_endian:
+            swapped = []
+            for data, offset in writes:
+                assert ((len(data) % 4) == 0), \
+                    "Can only write multiples of 4 bytes because CasperFpga is doing an endianness flip"
+                data_byte_swapped = b""
+                for i in range(0, len(data), 4):
+                    data_byte_swapped += data[i:i+4][::-1]
+                swapped.append((data_byte_swapped, offset))
+            writes = swapped
+        return self.transport.blindwrite_many(device_name, writes)
+
     def listdev(self):
         """
         Get a list of the memory bus items in this design.
@@ -303,7 +346,9 @@ class CasperFpga(object):
         return self.transport.set_igmp_version(version)
 
     def upload_to_ram_and_program(self, filename=None, wait_complete=True,
-                                  initialise_objects=False, **kwargs):
+                                  initialise_objects=False,
+                                  skip_if_running=False, trust_rcs=False,
+                                  **kwargs):
         """
         Upload an FPG file to RAM and then program the FPGA.
         :param filename: The file to upload
@@ -314,6 +359,10 @@ class CasperFpga(object):
         :param initialise_objects: Flag included in the event some child objects can be initialised
                                    upon creation/startup of the SKARAB with the new firmware
                                    - e.g. The SKARAB ADC
+        :param skip_if_running: do not upload or reboot if the FPGA is
+                                already running this file, see
+                                is_programmed_with
+        :param trust_rcs: see is_programmed_with
         :param **kwargs: chunk_size - set the chunk_size for the SKARAB platform
         :return: Boolean - True/False - Success/Fail
         """
@@ -322,6 +371,13 @@ class CasperFpga(object):
         else:
             filename = self.bitstream
 
+        if skip_if_running and self.is_programmed_with(filename, trust_rcs):
+            self.logger.info('%s is already running, not programming' %
+                             filename)
+            self.get_system_information(filename,
+                                        initialise_objects=initialise_objects)
+            return True
+
         rv = self.transport.upload_to_ram_and_program(
                 filename=filename, wait_complete=wait_complete, **kwargs)
 
@@ -360,6 +416,34 @@ class CasperFpga(object):
         """
         return self.transport.is_running()
 
+    def is_programmed_with(self, filename=None, trust_rcs=False):
+        """
+        Is the FPGA already running the design in an fpg file? Compares the
+        md5 and git information of the file against what the running design
+        reports, so depends on the transport being able to tell.
+
+        SKARAB and PCIe boards only report the git commit in sys_rev_rcs,
+        which every design built from that commit shares, so they are
+        never known to run the file unless trust_rcs is set. That is best
+        effort: another model from the same commit also matches.
+
+        :param filename: the fpg file, defaults to the bitstream
+        :param trust_rcs: take a clean git commit in sys_rev_rcs that the
+            file's git info lists as identifying the design
+        :return: True if the design is known to be running, False otherwise
+        """
+        filename = filename or self.bitstream
+        if filename is None or not filename.endswith('.fpg'):
+            return False
+        expected = get_fpg_fingerprint(filename)
+        try:
+            running = self.transport.get_running_fingerprint(expected)
+        except Exception as exc:
+            self.logger.debug('Could not identify the running design: '
+                              '%s' % exc)
+            return False
+        return fingerprint_matches(expected, running, trust_rcs)
+
     def _detect_little_endianness(self):
         """
         Return True if the board being used is little endian.
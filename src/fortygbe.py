@@ -26,6 +26,8 @@ class FortyGbe(Gbe):
             parent, name, address, length_bytes, device_info)
         self.position = position
         self.logger = parent.logger
+        self._last_stats_sample = None
+        self._last_counters = None
 
         self.reg_map = {'mac'            : 0x0E,
                         'ip'             : 0x14,
@@ -116,6 +118,19 @@ class FortyGbe(Gbe):
         """
         return self.parent.transport.read_wishbone(addr)
 
+    def _wbone_rd_bulk(self, addr, num_words):
+        """
+        Read consecutive 32-bit words, in one bulk transaction if the
+        transport supports it.
+
+        :param addr: address of the first word
+        :param num_words: how many words to read
+        :return: list of integers
+        """
+        if hasattr(self.parent.transport, 'read_wishbone_words'):
+            return self.parent.transport.read_wishbone_words(addr, num_words)
+        return [self._wbone_rd(addr + (4 * ctr)) for ctr in range(num_words)]
+
     def _wbone_wr(self, addr, val):
         """
 
@@ -198,10 +213,7 @@ class FortyGbe(Gbe):
         Get the details of the ethernet core from the device memory map. 
         Updates local variables as well.
         """
-        gbebase = self.address
-        gbedata = []
-        for ctr in range(0, 0x40, 4):
-            gbedata.append(self._wbone_rd(gbebase + ctr))
+        gbedata = self._wbone_rd_bulk(self.address, 0x40 // 4)
         gbebytes = []
         for d in gbedata:
             gbebytes.append((d >> 24) & 0xff)
@@ -328,15 +340,27 @@ class FortyGbe(Gbe):
         self.logger.warn("Retrieving ARP details not yet implemented.")
         raise NotImplementedError
 
-    def get_stats(self):
+    def get_stats(self, wait=0.5):
         """
         Retrieves some statistics for this core.
         Needs to have the debug registers compiled-in to the core at 32b.
+        Rates are worked out against the counters read by the previous
+        call. Only the first call has to take two readings, wait seconds
+        apart.
+
+        :param wait: seconds between readings if there is no previous one
         """
         rv = {}
-        first = self.read_counters()
-        time.sleep(0.5)
+        if self._last_counters is None:
+            first_time = time.time()
+            first = self.read_counters()
+            time.sleep(wait)
+        else:
+            first_time, first = self._last_counters
+        second_time = time.time()
         second = self.read_counters()
+        self._last_counters = (second_time, second)
+        scale = 1.0 / (second_time - first_time)
 
         name = self.name
         txvldcnt = '%s_txvldctr' % name
@@ -355,31 +379,33 @@ class FortyGbe(Gbe):
 
         if txvldcnt in first:
             if second[txvldcnt] >= first[txvldcnt]:
-                rv['tx_gbps'] = 2 * 256 / 1e9 * (second[txvldcnt] - first[txvldcnt])
+                rv['tx_gbps'] = scale * 256 / 1e9 * (second[txvldcnt] - first[txvldcnt])
             else:
-                rv['tx_gbps'] = 2 * 256 / 1e9 * (
+                rv['tx_gbps'] = scale * 256 / 1e9 * (
                     second[txvldcnt] - first[txvldcnt] + (2 ** 32))
 
         if rxvldcnt in first:
             if second[rxvldcnt] >= first[rxvldcnt]:
-                rv['rx_gbps'] = 2 * 256 / 1e9 * (second[rxvldcnt] - first[rxvldcnt])
+                rv['rx_gbps'] = scale * 256 / 1e9 * (second[rxvldcnt] - first[rxvldcnt])
             else:
-                rv['rx_gbps'] = 2 * 256 / 1e9 * (
+                rv['rx_gbps'] = scale * 256 / 1e9 * (
                     second[rxvldcnt] - first[rxvldcnt] + (2 ** 32))
 
         if txcnt in first:
             rv['tx_pkt_cnt'] = second[txcnt]
             if second[txcnt] >= first[txcnt]:
-                rv['tx_pps'] = 2 * (second[txcnt] - first[txcnt])
+                rv['tx_pps'] = scale * (second[txcnt] - first[txcnt])
             else:
-                rv['tx_pps'] = 2 * (second[txcnt] - first[txcnt]) + (2 ** 32)
+                rv['tx_pps'] = scale * (
+                    second[txcnt] - first[txcnt] + (2 ** 32))
 
         if rxcnt in first:
             rv['rx_pkt_cnt'] = second[rxcnt]
             if second[rxcnt] >= first[rxcnt]:
-                rv['rx_pps'] = 2 * (second[rxcnt] - first[rxcnt])
+                rv['rx_pps'] = scale * (second[rxcnt] - first[rxcnt])
             else:
-                rv['rx_pps'] = 2 * (second[rxcnt] - first[rxcnt]) + (2 ** 32)
+                rv['rx_pps'] = scale * (
+                    second[rxcnt] - first[rxcnt] + (2 ** 32))
 
         if txofcnt in second:
             rv['tx_over'] = second['%s_txofctr' % name]
@@ -397,11 +423,26 @@ class FortyGbe(Gbe):
         """
 
         gbebase = self.address
-        gbedata = []
+        rv = self._decode_hw_gbe_stats(
+            self._wbone_rd_bulk(gbebase + 0x48, (0x74 + 4 - 0x48) // 4))
 
-        for ctr in range(0x48, 0x74 + 4, 4):
-            gbedata.append(self._wbone_rd(gbebase + ctr))
+        if rst_counters:
+            # writing 0x1 resets the counters and holds them at 0
+            self._wbone_wr(gbebase + 0x78, 0x1)
+            time.sleep(0.01)
+            # writing 0x0 restarts the counters
+            self._wbone_wr(gbebase + 0x78, 0x0)
+            self._last_stats_sample = None
 
+        return rv
+
+    @staticmethod
+    def _decode_hw_gbe_stats(gbedata):
+        """
+        Decode the words read from the 0x48 - 0x74 statistics window.
+
+        :param gbedata: list of the twelve 32-bit words
+        """
         rv = {}
 
         rv['tx_pps'] = gbedata[0]
@@ -417,14 +458,41 @@ class FortyGbe(Gbe):
         rv['rx_byte_cnt'] = gbedata[9] * (256 / 8)  # convert words to bytes
         rv['rx_over_err_cnt'] = gbedata[10]
         rv['rx_bad_pkt_cnt'] = gbedata[11]
+        return rv
 
-        if rst_counters:
-            # writing 0x1 resets the counters and holds them at 0
-            self._wbone_wr(gbebase + 0x78, 0x1)
-            time.sleep(0.01)
-            # writing 0x0 restarts the counters
-            self._wbone_wr(gbebase + 0x78, 0x0)
-
+    def sample_hw_gbe_stats(self):
+        """
+        Read the statistics window in one transaction and compare it with
+        the previous sample, if there is one. Does not sleep, so it can be
+        polled for many cores at whatever rate suits the caller.
+
+        :return: the dictionary from get_hw_gbe_stats, plus 'timestamp' and
+            'rates'. rates is None on the first call, after that it holds
+            the 'interval' in seconds since the previous sample and the
+            'tx_gbps', 'rx_gbps', 'tx_pps' and 'rx_pps' averaged over it.
+        """
+        gbedata = self._wbone_rd_bulk(self.address + 0x48,
+                                      (0x74 + 4 - 0x48) // 4)
+        stamp = time.time()
+        rv = self._decode_hw_gbe_stats(gbedata)
+        rv['timestamp'] = stamp
+        rv['rates'] = None
+        if self._last_stats_sample is not None:
+            last_stamp, last_data = self._last_stats_sample
+            interval = stamp - last_stamp
+
+            def _delta(idx):
+                # the counters are 32-bit and wrap
+                return (gbedata[idx] - last_data[idx]) % (2 ** 32)
+            if interval > 0:
+                rv['rates'] = {
+                    'interval': interval,
+                    'tx_pps': _delta(1) / interval,
+                    'tx_gbps': _delta(3) * (256 / 1.0e9) / interval,
+                    'rx_pps': _delta(7) / interval,
+                    'rx_gbps': _delta(9) * (256 / 1.0e9) / interval,
+                }
+        self._last_stats_sample = (stamp, gbedata)
         return rv
 
     @staticmethod
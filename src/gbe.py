@@ -159,34 +159,39 @@ class Gbe(object):
         """
         raise NotImplementedError
 
-    def read_rx_counters(self):
+    def _read_counter_registers(self, names):
         """
-        Read all RX counters embedded in this TenGBE yellow block
+        Read a list of counter registers in one batch, which transports
+        that can keep several reads in flight do in about one round trip.
         """
+        rawdata = self.parent.read_many([(name, 4, 0) for name in names])
         results = {}
-        for reg in self.registers['rx']:
-            results[reg] = self.parent.memory_devices[reg].read()['data']['reg']
+        for name, raw in zip(names, rawdata):
+            register = self.parent.memory_devices[name]
+            values = dict((field, value[0]) for field, value in
+                          register._process_data(raw).items())
+            register.last_values = values
+            results[name] = values['reg']
         return results
 
+    def read_rx_counters(self):
+        """
+        Read all RX counters embedded in this TenGBE yellow block
+        """
+        return self._read_counter_registers(self.registers['rx'])
+
     def read_tx_counters(self):
         """
         Read all TX counters embedded in this TenGBE yellow block
         """
-        results = {}
-        for reg in self.registers['tx']:
-            results[reg] = self.parent.memory_devices[reg].read()['data']['reg']
-        return results
+        return self._read_counter_registers(self.registers['tx'])
 
     def read_counters(self):
         """
         Read all the counters embedded in this TenGBE yellow block
         """
-        results = {}
-        for direction in ['tx', 'rx']:
-            for reg in self.registers[direction]:
-                tmp = self.parent.memory_devices[reg].read()
-                results[reg] = tmp['data']['reg']
-        return results
+        return self._read_counter_registers(
+            self.registers['tx'] + self.registers['rx'])
 
     def rx_okay(self, wait_time=0.2, checks=10):
         """
@@ -1,6 +1,49 @@
+import time
+import numpy as np
 
 from .memory import Memory
 
+# (status name, low word register, high word register or None, is a counter)
+HMC_STATUS_FIELDS = []
+for _link in ['LINK2', 'LINK3']:
+    HMC_STATUS_FIELDS.extend([
+        ('hmc_stat_gen_%s' % _link.lower(), 'HMC_STAT_GEN_LOW_%s' % _link,
+         'HMC_STAT_GEN_HIGH_%s' % _link, False),
+        ('hmc_stat_init_%s' % _link.lower(), 'HMC_STAT_INIT_LOW_%s' % _link,
+         'HMC_STAT_INIT_HIGH_%s' % _link, False),
+        ('hmc_ctrl_%s' % _link.lower(), 'HMC_CTRL_LOW_%s' % _link,
+         'HMC_CTRL_HIGH_%s' % _link, False),
+        ('hmc_sent_p_%s' % _link.lower(), 'HMC_SENT_P_LOW_%s' % _link,
+         'HMC_SENT_P_HIGH_%s' % _link, True),
+        ('hmc_sent_np_%s' % _link.lower(), 'HMC_SENT_NP_LOW_%s' % _link,
+         'HMC_SENT_NP_HIGH_%s' % _link, True),
+        ('hmc_sent_r_%s' % _link.lower(), 'HMC_SENT_R_LOW_%s' % _link,
+         'HMC_SENT_R_HIGH_%s' % _link, True),
+        ('hmc_poisoned_packet_%s' % _link.lower(),
+         'HMC_POISONED_PACKET_LOW_%s' % _link,
+         'HMC_POISONED_PACKET_HIGH_%s' % _link, True),
+        ('hmc_rcvd_resp_%s' % _link.lower(), 'HMC_RCVD_RESP_LOW_%s' % _link,
+         'HMC_RCVD_RESP_HIGH_%s' % _link, True),
+        ('hmc_tx_link_retries_%s' % _link.lower(),
+         'HMC_TX_LINK_RETRIES_LOW_%s' % _link,
+         'HMC_TX_LINK_RETRIES_HIGH_%s' % _link, True),
+        ('hmc_err_on_rx_%s' % _link.lower(), 'HMC_ERR_ON_RX_LOW_%s' % _link,
+         'HMC_ERR_ON_RX_HIGH_%s' % _link, True),
+        ('hmc_run_lngth_bitflip_%s' % _link.lower(),
+         'HMC_RUN_LNGTH_BITFLIP_LOW_%s' % _link,
+         'HMC_RUN_LNGTH_BITFLIP_HIGH_%s' % _link, True),
+        ('hmc_err_abort_not_clr_%s' % _link.lower(),
+         'HMC_ERR_ABORT_NOT_CLEAR_LOW_%s' % _link,
+         'HMC_ERR_ABORT_NOT_CLEAR_HIGH_%s' % _link, True),
+        ('hmc_err_rsp_packet_%s' % _link.lower(),
+         'HMC_ERR_RSP_PACKET_%s' % _link, None, False),
+        ('hmc_errstat_%s' % _link.lower(), 'HMC_ERRSTAT_%s' % _link,
+         None, False),
+        ('hmc_crc_err_count_%s' % _link.lower(), 'HMC_CRC_ERR_CNT_%s' % _link,
+         None, True),
+    ])
+HMC_STATUS_FIELDS.append(('hmc_status', 'HMC_STATUS', None, False))
+
 class Hmc(Memory):
     """
     General HMC memory on the FPGA.
@@ -69,6 +112,16 @@ class Hmc(Memory):
                         'HMC_ERRSTAT_LINK3': 0xD0,
                         'HMC_CRC_ERR_CNT_LINK3': 0xD4,
                         'HMC_STATUS': 0xD8}
+        # span of the status registers and where to find each status value
+        self.reg_span = max(self.reg_map.values()) + 4
+        self._status_low = np.array(
+            [self.reg_map[field[1]] // 4 for field in HMC_STATUS_FIELDS])
+        self._status_high = np.array(
+            [self.reg_map[field[2]] // 4 if field[2] else 0
+             for field in HMC_STATUS_FIELDS])
+        self._status_has_high = np.array(
+            [field[2] is not None for field in HMC_STATUS_FIELDS],
+            dtype=np.uint64)
         # dictionary holding all HMC status information
         self.hmc_status_list = {}
         #dictionary holding all HMC revision information
@@ -123,149 +176,42 @@ class Hmc(Memory):
         """
         return self.parent.transport.write_wishbone(addr, val)
 
-    def get_hmc_status(self):
+    def _read_status_words(self, use_bulk=True):
         """
-        Read HMC status
-        :param
-        :return: self.hmc_status_list - this is a dictionary containing all the HMC status information
-        """
-
-        # HMC Status Registers (LINK2)
-        self.hmc_status_list['hmc_stat_gen_link2'] = (self._wbone_rd(self.address + self.reg_map['HMC_STAT_GEN_LOW_LINK2']) +
-                                                      self._wbone_rd(self.address + self.reg_map['HMC_STAT_GEN_HIGH_LINK2']) << 32)
-
-        self.hmc_status_list['hmc_stat_init_link2'] = (self._wbone_rd(self.address + self.reg_map['HMC_STAT_INIT_LOW_LINK2']) +
-                                                      self._wbone_rd(self.address + self.reg_map['HMC_STAT_INIT_HIGH_LINK2']) << 32)
-
-        self.hmc_status_list['hmc_ctrl_link2'] = (self._wbone_rd(self.address +
-                                                 self.reg_map['HMC_CTRL_LOW_LINK2']) +
-                                                 (self._wbone_rd(self.address +
-                                                 self.reg_map['HMC_CTRL_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_sent_p_link2'] = (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_P_LOW_LINK2']) +
-                                                   (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_P_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_sent_np_link2'] = (self._wbone_rd(self.address +
-                                                    self.reg_map['HMC_SENT_NP_LOW_LINK2']) +
-                                                    (self._wbone_rd(self.address +
-                                                    self.reg_map['HMC_SENT_NP_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_sent_r_link2'] = (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_R_LOW_LINK2']) +
-                                                   (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_R_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_poisoned_packet_link2'] = (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_POISONED_PACKET_LOW_LINK2']) +
-                                                            (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_POISONED_PACKET_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_rcvd_resp_link2'] = (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_RCVD_RESP_LOW_LINK2']) +
-                                                      (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_RCVD_RESP_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_tx_link_retries_link2'] = (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_TX_LINK_RETRIES_LOW_LINK2']) +
-                                                            (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_TX_LINK_RETRIES_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_err_on_rx_link2'] = (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_ERR_ON_RX_LOW_LINK2']) +
-                                                      (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_ERR_ON_RX_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_run_lngth_bitflip_link2'] = (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_RUN_LNGTH_BITFLIP_LOW_LINK2']) +
-                                                              (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_RUN_LNGTH_BITFLIP_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_err_abort_not_clr_link2'] = (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_ERR_ABORT_NOT_CLEAR_LOW_LINK2']) +
-                                                              (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_ERR_ABORT_NOT_CLEAR_HIGH_LINK2']) << 32))
-
-        self.hmc_status_list['hmc_err_rsp_packet_link2'] = (self._wbone_rd(self.address +
-                                                           self.reg_map['HMC_ERR_RSP_PACKET_LINK2']))
-
-        self.hmc_status_list['hmc_errstat_link2'] = (self._wbone_rd(self.address + self.reg_map['HMC_ERRSTAT_LINK2']))
-
-        self.hmc_status_list['hmc_crc_err_count_link2'] = (self._wbone_rd(self.address +
-                                                          self.reg_map['HMC_CRC_ERR_CNT_LINK2']))
-
-        # HMC Status Registers (LINK3)
-        self.hmc_status_list['hmc_stat_gen_link3'] = (self._wbone_rd(self.address +
-                                                     self.reg_map['HMC_STAT_GEN_LOW_LINK3']) +
-                                                     (self._wbone_rd(self.address +
-                                                     self.reg_map['HMC_STAT_GEN_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_stat_init_link3'] = (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_STAT_INIT_LOW_LINK3']) +
-                                                      (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_STAT_INIT_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_ctrl_link3'] = (self._wbone_rd(self.address +
-                                                 self.reg_map['HMC_CTRL_LOW_LINK3']) +
-                                                 (self._wbone_rd(self.address +
-                                                 self.reg_map['HMC_CTRL_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_sent_p_link3'] = (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_P_LOW_LINK3']) +
-                                                   (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_P_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_sent_np_link3'] = (self._wbone_rd(self.address +
-                                                    self.reg_map['HMC_SENT_NP_LOW_LINK3']) +
-                                                    (self._wbone_rd(self.address +
-                                                    self.reg_map['HMC_SENT_NP_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_sent_r_link3'] = (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_R_LOW_LINK3']) +
-                                                   (self._wbone_rd(self.address +
-                                                   self.reg_map['HMC_SENT_R_HIGH_LINK3']) << 32))
+        Read every 32-bit word in the HMC status register space.
 
-        self.hmc_status_list['hmc_poisoned_packet_link3'] = (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_POISONED_PACKET_LOW_LINK3']) +
-                                                            (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_POISONED_PACKET_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_rcvd_resp_link3'] = (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_RCVD_RESP_LOW_LINK3']) +
-                                                      (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_RCVD_RESP_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_tx_link_retries_link3'] = (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_TX_LINK_RETRIES_LOW_LINK3']) +
-                                                            (self._wbone_rd(self.address +
-                                                            self.reg_map['HMC_TX_LINK_RETRIES_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_err_on_rx_link3'] = (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_ERR_ON_RX_LOW_LINK3']) +
-                                                      (self._wbone_rd(self.address +
-                                                      self.reg_map['HMC_ERR_ON_RX_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_run_lngth_bitflip_link3'] = (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_RUN_LNGTH_BITFLIP_LOW_LINK3']) +
-                                                              (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_RUN_LNGTH_BITFLIP_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_err_abort_not_clr_link3'] = (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_ERR_ABORT_NOT_CLEAR_LOW_LINK3']) +
-                                                              (self._wbone_rd(self.address +
-                                                              self.reg_map['HMC_ERR_ABORT_NOT_CLEAR_HIGH_LINK3']) << 32))
-
-        self.hmc_status_list['hmc_err_rsp_packet_link3'] = (self._wbone_rd(self.address +
-                                                           self.reg_map['HMC_ERR_RSP_PACKET_LINK3']))
-
-        self.hmc_status_list['hmc_errstat_link3'] = (self._wbone_rd(self.address + self.reg_map['HMC_ERRSTAT_LINK3']))
-
-        self.hmc_status_list['hmc_crc_err_count_link3'] = (self._wbone_rd(self.address +
-                                                          self.reg_map['HMC_CRC_ERR_CNT_LINK3']))
+        :param use_bulk: fetch the whole span in one bulk read, else read
+            the registers one wishbone transaction at a time
+        :return: numpy array of the words, indexed by reg_map offset / 4
+        """
+        if use_bulk:
+            data = self.parent.read(self.name, self.reg_span)
+            return np.frombuffer(data, dtype='>u4').astype(np.uint64)
+        words = np.zeros(self.reg_span // 4, dtype=np.uint64)
+        for offset in sorted(self.reg_map.values()):
+            words[offset // 4] = self._wbone_rd(self.address + offset)
+        return words
+
+    def _decode_status_words(self, words):
+        """
+        Assemble the HMC status values from the raw status words.
 
-        self.hmc_status_list['hmc_status'] = (self._wbone_rd(self.address + self.reg_map['HMC_STATUS']))
+        :param words: numpy array from _read_status_words
+        :return: numpy array of values, in HMC_STATUS_FIELDS order
+        """
+        return words[self._status_low] | \
+            ((words[self._status_high] * self._status_has_high) << 32)
 
+    def get_hmc_status(self, use_bulk=True):
+        """
+        Read HMC status
+        :param use_bulk: read the whole status register space in one bulk
+                         read rather than one wishbone read per register
+        :return: self.hmc_status_list - this is a dictionary containing all the HMC status information
+        """
+        values = self._decode_status_words(self._read_status_words(use_bulk))
+        for ctr, field in enumerate(HMC_STATUS_FIELDS):
+            self.hmc_status_list[field[0]] = int(values[ctr])
         return self.hmc_status_list
 
     def get_hmc_revision(self):
@@ -288,5 +234,87 @@ class Hmc(Memory):
         return self.hmc_revision_list
 
 
+class HmcCounterSampler(object):
+    """
+    Periodically sample the HMC counters and work out how much they have
+    changed since the last sample.
+
+    e.g.
+        sampler = HmcCounterSampler(fpga.hmcs.hmc0)
+        while True:
+            rates = sampler.sample()['rates']
+            time.sleep(1)
+    """
+    def __init__(self, hmc, use_bulk=True):
+        """
+
+        :param hmc: the Hmc to sample
+        :param use_bulk: use bulk reads of the status registers
+        """
+        self.hmc = hmc
+        self.use_bulk = use_bulk
+        self.counter_names = [field[0] for field in HMC_STATUS_FIELDS
+                              if field[3]]
+        self._counter_idx = np.array(
+            [ctr for ctr, field in enumerate(HMC_STATUS_FIELDS) if field[3]])
+        self.last_values = None
+        self.last_time = None
+
+    def sample(self):
+        """
+        Read the counters once.
+
+        :return: a dictionary with the sample 'timestamp', the counter
+            'values' and, from the second sample on, the 'deltas' since the
+            previous sample and the 'rates' per second. deltas and rates
+            are None on the first sample.
+        """
+        words = self.hmc._read_status_words(self.use_bulk)
+        stamp = time.time()
+        values = self.hmc._decode_status_words(words)[self._counter_idx]
+        deltas, rates = None, None
+        if self.last_values is not None:
+            # unsigned subtraction copes with a counter wrapping
+            delta_arr = values - self.last_values
+            rate_arr = delta_arr / max(stamp - self.last_time, 1e-9)
+            deltas = dict(zip(self.counter_names, delta_arr.tolist()))
+            rates = dict(zip(self.counter_names, rate_arr.tolist()))
+        self.last_values = values
+        self.last_time = stamp
+        return {'timestamp': stamp,
+                'values': dict(zip(self.counter_names, values.tolist())),
+                'deltas': deltas, 'rates': rates}
+
+    def collect(self, num_samples, interval):
+        """
+        Take a series of samples.
+
+        :param num_samples: how many samples to take
+        :param interval: seconds between samples
+        :return: a dictionary with 'timestamps', an array of num_samples
+            times, and 'values', 'deltas' and 'rates', each a dictionary of
+            counter name to array. deltas and rates have num_samples - 1
+            entries.
+        """
+        stamps = np.zeros(num_samples)
+        values = np.zeros((num_samples, len(self.counter_names)),
+                          dtype=np.uint64)
+        for ctr in range(num_samples):
+            if ctr > 0:
+                time.sleep(interval)
+            words = self.hmc._read_status_words(self.use_bulk)
+            stamps[ctr] = time.time()
+            values[ctr] = self.hmc._decode_status_words(
+                words)[self._counter_idx]
+        deltas = np.diff(values, axis=0)
+        rates = deltas / np.diff(stamps)[:, np.newaxis]
+        self.last_values = values[-1]
+        self.last_time = stamps[-1]
+        return {
+            'timestamps': stamps,
+            'values': dict(zip(self.counter_names, values.T)),
+            'deltas': dict(zip(self.counter_names, deltas.T)),
+            'rates': dict(zip(self.counter_names, rates.T)),
+        }
 
 # end
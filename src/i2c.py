@@ -1,4 +1,4 @@
-import time,logging,collections,warnings
+import time,logging,collections,warnings,struct
 
 PRERlo = 0
 PRERhi = 1
@@ -19,6 +19,10 @@ CMD_IACK = 1 << 0 # interrupt ack, not supported
 CORE_EN = 1 << 7 # i2c core enable
 INT_EN = 1 << 6 # interrupt enable, not supported
 
+# I2C status
+STAT_ACK = 1 << 7 # 1 means no acknowledgement from the slave
+STAT_TIP = 1 << 1 # transfer in progress
+
 WRITE_BIT = 0
 READ_BIT = 1
 
@@ -72,6 +76,8 @@ class I2C:
 
         # Empirical time for an I2C command transmission to finish
         self.T = 1.0 / target / 1000
+        # A byte and its acknowledge take nine bus clocks
+        self._byte_time = 9 * self.T
 
     def getClock(self, reference=None):
         """ 
@@ -195,6 +201,92 @@ class I2C:
     def _itf_read(self,addr):
         return self.fpga.read_int(self.controller_name, word_offset=addr)
 
+    def _submit(self, writes):
+        """ Write a list of (data, reg) pairs to the controller, in order,
+        in one batch if the interface supports it
+        """
+        if hasattr(self.fpga, 'blindwrite_many'):
+            writes = [(struct.pack('>I', d), reg * 4) for d, reg in writes]
+            self.fpga.blindwrite_many(self.controller_name, writes)
+        else:
+            for d, reg in writes:
+                self.fpga.write_int(self.controller_name, d, word_offset=reg, blindwrite=True)
+
+    def _wait_tip(self, start):
+        """ Wait for the command issued at time start to finish, and
+        return the receive and status registers
+
+        The receive and status registers are neighbours, so one read gets
+        both.  The first poll is held back until a byte could have gone
+        out on the bus, which only costs time when the interface is faster
+        than the bus; after that the polling interval doubles each time.
+        """
+        wait = self._byte_time - (time.time() - start)
+        if wait > 0:
+            time.sleep(wait)
+        delay = self.T
+        for i in range(self._retry+1):
+            rx, status = struct.unpack('>II', self.fpga.read(
+                self.controller_name, 8, receiveReg * 4))
+            if not status & STAT_TIP:
+                return rx & 0xff, status
+            elif i == self._retry:
+                raise IOError('Stuck in TIP state')
+            time.sleep(delay)
+            delay *= 2
+
+    def _run(self, steps):
+        """ Run a compiled I2C sequence and return the bytes read
+
+        :param steps: a list of (transmit, command, check) tuples, one per
+            controller command.  transmit is the byte to load into the
+            transmit register first, or None.  check is 'ack' to expect an
+            acknowledgement from the slave, 'rx' to collect the received
+            byte, or None.
+        """
+        data = []
+        for txr, cmd, check in steps:
+            writes = [] if txr is None else [(txr, transmitReg)]
+            start = time.time()
+            self._submit(writes + [(cmd, commandReg)])
+            rx, status = self._wait_tip(start)
+            if check == 'ack' and status & STAT_ACK:
+                raise IOError('No acknowledgement from target address')
+            elif check == 'rx':
+                data.append(rx)
+        return data
+
+    def _write_steps(self, addr, data):
+        """ Compile an I2C write
+
+        Send start, the address with R/W bit low and the data bytes,
+        expecting an ack after each, then stop.  The stop is issued
+        together with the last byte.
+        """
+        if isinstance(data,int):
+            data = [data]
+        steps = [((addr<<1)|WRITE_BIT, CMD_START|CMD_WRITE, 'ack')]
+        steps += [(d, CMD_WRITE, 'ack') for d in data]
+        if len(steps) > 1:
+            steps[-1] = (steps[-1][0], CMD_WRITE|CMD_STOP, 'ack')
+        else:
+            steps.append((None, CMD_STOP, None))
+        return steps
+
+    def _read_steps(self, addr, length=1):
+        """ Compile an I2C read
+
+        Send start and the address with R/W bit high (expecting an ack),
+        receive length bytes acknowledging all but the last, which ends
+        with a nack and a stop.
+        """
+        steps = [((addr<<1)|READ_BIT, CMD_START|CMD_WRITE, 'ack')]
+        # CMD_READ also gives an ACK from master to slave because
+        # CMD_ACK is actually 0
+        steps += [(None, CMD_READ, 'rx')] * (length-1)
+        steps.append((None, CMD_READ|CMD_NACK|CMD_STOP, 'rx'))
+        return steps
+
     def _write(self,addr,data):
         """ 
         I2C write primitive
@@ -215,15 +307,7 @@ class I2C:
            _write(0x20,0xff)   # Write 0xff to a slave at address 0x20
            _write(0x20,range(10))  # Write [0..9] to a slave at address 0x20
         """
-
-        self._itf_write(transmitReg,    (addr<<1)|WRITE_BIT)
-        self._itf_write(commandReg, CMD_START|CMD_WRITE)
-        if isinstance(data,int):
-            data = [data]
-        for d in data:
-            self._itf_write(transmitReg,    d)
-            self._itf_write(commandReg, CMD_WRITE)
-        self._itf_write(commandReg, CMD_STOP)
+        self._run(self._write_steps(addr, data))
 
     def _read(self,addr,length=1):
         """ 
@@ -248,26 +332,25 @@ class I2C:
            _read(0x20) # Return one byte from a slave at 0x20
            _read(0x20,10)  # Return 10 bytes from a slave at 0x20
         """
-
-        data = []
-        self._itf_write(transmitReg,    (addr<<1)|READ_BIT)
-        self._itf_write(commandReg, CMD_START|CMD_WRITE)
-        for i in range(length-1):
-            # The command below also gives an ACK signal from master
-            # to slave because CMD_ACK is actually 0
-            self._itf_write(commandReg, CMD_READ)
-            ret = self._itf_read(receiveReg)
-            data.append(ret)
-        # The last read ends with a NACK (not acknowledge) signal and a STOP
-        # from master to slave
-        self._itf_write(commandReg, CMD_READ|CMD_NACK|CMD_STOP)
-        ret = self._itf_read(receiveReg)
-        data.append(ret)
+        data = self._run(self._read_steps(addr, length))
         if length==1:
             return data[0]
         else:
             return data
 
+    def transaction(self):
+        """ Start a sequence of I2C reads and writes that run together
+
+        .. code-block:: python
+
+            t = i2c.transaction()
+            t.write(0x40, 0x1, 0x2)
+            t.read(0x40, 0xe3, 2)
+            t.read(0x51, [0x0, 0x0], 32)
+            wr, rd1, rd2 = t.execute()
+        """
+        return I2CTransaction(self)
+
     def read(self,addr, cmd=None, length=1):
         """ I2C read
 
@@ -292,31 +375,9 @@ class I2C:
                                         # of the slave at 0x40
 
         """
-
-        if not isinstance(cmd, int) and cmd!=None and not isinstance(cmd, list):
-            raise ValueError("Invalid parameter")
-        elif isinstance(cmd, list):
-            if not all(isinstance(c,int) for c in cmd) or cmd==[]:
-                raise ValueError("Invalid parameter")
-
-        # retry a few times on failure
-        for i in range(self._retry+1):
-
-            try:
-
-                if cmd==None:
-                    return self._read(addr,length)
-                else:
-                    self._write(addr,cmd)
-                    return self._read(addr,length)
-
-            except Exception as error:
-
-                if i == self._retry:
-                    raise error
-                else:
-                    self._reset_bus()
-                    continue
+        t = self.transaction()
+        t.read(addr, cmd, length)
+        return t.execute()[0]
 
     def write(self,addr,cmd=None, data=None):
         """ 
@@ -339,46 +400,9 @@ class I2C:
             write(0x40,[0x1,0x2],[0x3,0x4]) # Write [0x3,0x4] to the internal address [0x1,0x2]
                                             # of the slave at 0x40
         """
-
-        if not isinstance(cmd, int) and cmd!=None and not isinstance(cmd,list):
-            raise ValueError("Invalid parameter")
-        elif isinstance(cmd, list):
-            if not all(isinstance(c,int) for c in cmd) or cmd==[]:
-                raise ValueError("Invalid parameter")
-        elif isinstance(cmd, int):
-            cmd = [cmd]
-
-        if not isinstance(data, int) and data!=None and not isinstance(data,list):
-            raise ValueError("Invalid parameter")
-        elif isinstance(data, list):
-            if not all(isinstance(d,int) for d in data) or data==[]:
-                raise ValueError("Invalid parameter")
-        elif isinstance(data, int):
-            data = [data]
-
-
-        # retry a few times on failure
-        for i in range(self._retry+1):
-
-            try:
-
-                if cmd==None and data!=None:
-                    self._write(addr,data)
-                elif cmd!=None and data==None:
-                    self._write(addr,cmd)
-                elif cmd!=None and data!=None:
-                    self._write(addr,cmd+data)
-                else:
-                    raise ValueError("Invalid parameter")
-                return 0
-
-            except Exception as error:
-
-                if i == self._retry:
-                    raise error
-                else:
-                    self._reset_bus()
-                    continue
+        t = self.transaction()
+        t.write(addr, cmd, data)
+        return t.execute()[0]
 
     def _probe(self,addr):
         """ Test if a device with addr is present on the I2C bus by just reading it
@@ -418,6 +442,102 @@ class I2C:
             sys.stdout.flush()
 
 
+class I2CTransaction(object):
+
+    def __init__(self, itf):
+        """ A sequence of I2C reads and writes
+
+        The reads and writes are compiled into one list of controller
+        commands when queued, and run back to back by execute().  A
+        failure anywhere resets the bus and retries the whole sequence.
+
+        itf: the I2C instance to run on
+        """
+        self.itf = itf
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def read(self, addr, cmd=None, length=1):
+        """ Queue an I2C read, with the same parameters as I2C.read """
+
+        if not isinstance(cmd, int) and cmd!=None and not isinstance(cmd, list):
+            raise ValueError("Invalid parameter")
+        elif isinstance(cmd, list):
+            if not all(isinstance(c,int) for c in cmd) or cmd==[]:
+                raise ValueError("Invalid parameter")
+
+        steps = []
+        if cmd!=None:
+            steps += self.itf._write_steps(addr, cmd)
+        steps += self.itf._read_steps(addr, length)
+        self._ops.append((steps, length))
+
+    def write(self, addr, cmd=None, data=None):
+        """ Queue an I2C write, with the same parameters as I2C.write """
+
+        if not isinstance(cmd, int) and cmd!=None and not isinstance(cmd,list):
+            raise ValueError("Invalid parameter")
+        elif isinstance(cmd, list):
+            if not all(isinstance(c,int) for c in cmd) or cmd==[]:
+                raise ValueError("Invalid parameter")
+        elif isinstance(cmd, int):
+            cmd = [cmd]
+
+        if not isinstance(data, int) and data!=None and not isinstance(data,list):
+            raise ValueError("Invalid parameter")
+        elif isinstance(data, list):
+            if not all(isinstance(d,int) for d in data) or data==[]:
+                raise ValueError("Invalid parameter")
+        elif isinstance(data, int):
+            data = [data]
+
+        if cmd==None and data!=None:
+            steps = self.itf._write_steps(addr,data)
+        elif cmd!=None and data==None:
+            steps = self.itf._write_steps(addr,cmd)
+        elif cmd!=None and data!=None:
+            steps = self.itf._write_steps(addr,cmd+data)
+        else:
+            raise ValueError("Invalid parameter")
+        self._ops.append((steps, None))
+
+    def execute(self):
+        """ Run the queued reads and writes
+
+        Return a list with one entry per queued operation: 0 for a write,
+        and for a read a byte when length==1, or a list of bytes otherwise.
+        """
+        steps = [step for op, _ in self._ops for step in op]
+
+        # retry a few times on failure
+        for i in range(self.itf._retry+1):
+
+            try:
+                data = self.itf._run(steps)
+                break
+
+            except Exception as error:
+
+                if i == self.itf._retry:
+                    raise error
+                else:
+                    self.itf._reset_bus()
+                    continue
+
+        results = []
+        for _, length in self._ops:
+            if length is None:
+                results.append(0)
+            elif length == 1:
+                results.append(data.pop(0))
+            else:
+                results.append(data[:length])
+                data = data[length:]
+        return results
+
+
 class I2C_SMBUS:
 
     def __init__(self,devid):
@@ -1,4 +1,4 @@
-import time,logging,numpy as np,struct,sys
+import time,logging,numpy as np,struct,sys,threading
 import random
 #from transforms3d.quaternions import *
 #from transforms3d.euler import *
@@ -436,7 +436,7 @@ class MPU9250:
 
     def _get(self, data, mask):
         data = data & mask
-        return data / (mask & -mask)
+        return data // (mask & -mask)
 
     def _getMask(self, dicts, name):
         for rid in dicts:
@@ -607,7 +607,7 @@ class MPU9250:
     def accel_scale(self,scale):
         if scale not in list(range(4)):
             raise ValueError("Invalid parameter")
-        self.ACCEL_SCALE = scale
+        self._accel_scale = scale
         self.setWord('ACCEL_FS_SEL', scale)
 
     @property
@@ -617,10 +617,10 @@ class MPU9250:
         return self._gyro_scale
 
     @gyro_scale.setter
-    def accel_scale(self,scale):
+    def gyro_scale(self,scale):
         if scale not in list(range(4)):
             raise ValueError("Invalid parameter")
-        self.GYRO_SCALE = scale
+        self._gyro_scale = scale
         self.setWord('GYRO_FS_SEL', scale)
 
     @property
@@ -994,6 +994,220 @@ class MPU9250:
         data = self.readFIFO({'gyro':True,'accel':True}, filename=fn,length=length)
         self.setFIFO()
 
+class FIFOStream(object):
+    """ 
+    Continuous capture of the MPU9250 FIFO
+
+    A background thread drains the FIFO in bursts of whole frames, decodes
+    them with numpy and stores them, timestamped, in a preallocated ring
+    buffer.  A FIFO overflow is counted and logged, and the FIFO is reset
+    so that frames stay aligned.
+
+    .. code-block:: python
+
+        imu.setFIFO(accel=True, gyro=True)
+        stream = FIFOStream(imu, {'accel':True,'gyro':True}, rate=50,
+                            sample_rate=1000)
+        stream.start()
+        ...
+        data = stream.read()    # frames since the previous read()
+        stream.stop()
+    """
+
+    FIFO_SIZE = 512
+    TEMP_SENSITIVITY = 333.87
+    TEMP_OFFSET = 21
+
+    def __init__(self, imu, types, depth=65536, rate=100., sample_rate=None,
+                 raw=False, on_overflow=None):
+        """ 
+        :param imu: the MPU9250 to read, with its FIFO already configured
+        :param types: the FIFO contents, as for sortFIFOData
+        :param depth: number of frames kept
+        :param rate: how often to drain the FIFO, in Hz
+        :param sample_rate: the FIFO sample rate in Hz, used to timestamp
+            the frames of a burst.  If None all frames of a burst get the
+            time of the burst.
+        :param raw: keep raw counts instead of g, dps and degrees C
+        :param on_overflow: optional function called with the stream after
+            each overflow
+        """
+        self.imu = imu
+        self.types = types
+        self.frame = imu.sortFIFOData(types)
+        self.depth = depth
+        self.rate = rate
+        self.sample_rate = sample_rate
+        self.raw = raw
+        self.on_overflow = on_overflow
+
+        self.overflows = 0
+        self.total = 0
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # byte offset and width of every field in a frame
+        self._fields = []
+        ofst = 0
+        for name, width in [('accel', 6), ('temp', 2), ('gyro', 6),
+                            ('slv0', None), ('slv1', None), ('slv2', None),
+                            ('slv3', None)]:
+            if name in types:
+                width = width or types[name]
+                self._fields.append((name, ofst, width))
+                ofst += width
+
+        self.times = np.zeros(depth)
+        self.data = {}
+        for name, ofst, width in self._fields:
+            if name in ['accel', 'gyro']:
+                shape, dtype = (depth, 3), np.int16 if raw else np.float32
+            elif name == 'temp':
+                shape, dtype = (depth,), np.int16 if raw else np.float32
+            else:
+                shape, dtype = (depth, width), np.uint8
+            self.data[name] = np.zeros(shape, dtype=dtype)
+
+        self._scale = {}
+        if not raw:
+            if 'accel' in types:
+                self._scale['accel'] = [2,4,8,16][imu.accel_scale] * 2.0 / (1<<16)
+            if 'gyro' in types:
+                self._scale['gyro'] = [250,500,1000,2000][imu.gyro_scale] * 2.0 / (1<<16)
+
+        self._rid_status, _ = imu._getMask(imu.DICT, 'INT_STATUS')
+        self._rid_count, self._mask_count = imu._getMask(imu.DICT, 'FIFO_CNT_H')
+        self._rid_fifo, _ = imu._getMask(imu.DICT, 'fifo_r_w')
+
+    def decode(self, data):
+        """ Decode a whole number of FIFO frames into a dict of arrays """
+        data = np.frombuffer(bytearray(data), dtype=np.uint8)
+        data = data.reshape(-1, self.frame)
+        results = {}
+        for name, ofst, width in self._fields:
+            field = np.ascontiguousarray(data[:, ofst:ofst+width])
+            if name in ['accel', 'gyro', 'temp']:
+                field = field.view('>i2').astype(np.int16)
+                if name == 'temp':
+                    field = field[:, 0]
+                if not self.raw and name == 'temp':
+                    field = field / self.TEMP_SENSITIVITY + self.TEMP_OFFSET
+                elif not self.raw:
+                    field = field * self._scale[name]
+            results[name] = field
+        return results
+
+    def _status(self):
+        """ Return (overflowed, bytes in the FIFO) """
+        itf = self.imu.itf
+        if hasattr(itf, 'transaction'):
+            t = itf.transaction()
+            t.read(self.imu.addr, self._rid_status)
+            t.read(self.imu.addr, self._rid_count, 2)
+            status, count = t.execute()
+        else:
+            status = self.imu.read(self._rid_status)
+            count = self.imu.read(self._rid_count, 2)
+        count = ((count[0] & self._mask_count) << 8) | count[1]
+        return bool(status & self.imu.DICT[self._rid_status]['FIFO_OFLOW_INT']), count
+
+    def poll(self):
+        """ Drain the FIFO once and return the number of frames stored """
+        overflowed, count = self._status()
+        if overflowed:
+            self.overflows += 1
+            logger.warning('MPU9250 FIFO overflow, {} so far'.format(self.overflows))
+            # the FIFO may have wrapped mid-frame, so start it afresh
+            self.imu.setWord('FIFO_RST', 0x1)
+            if self.on_overflow is not None:
+                self.on_overflow(self)
+            return 0
+
+        count = count // self.frame * self.frame
+        stored = 0
+        while count > 0:
+            burst = min(count, self.FIFO_SIZE // self.frame * self.frame)
+            data = self.imu.read(self._rid_fifo, burst)
+            if burst == 1:
+                data = [data]
+            stored += self._store(time.time(), self.decode(data))
+            count -= burst
+        return stored
+
+    def _store(self, timestamp, frames):
+        num = len(frames[self._fields[0][0]])
+        if self.sample_rate:
+            times = timestamp - np.arange(num - 1, -1, -1) / float(self.sample_rate)
+        else:
+            times = np.full(num, timestamp)
+        with self._lock:
+            idx = (self.total + np.arange(num)) % self.depth
+            self.times[idx] = times
+            for name, field in frames.items():
+                self.data[name][idx] = field
+            self.total += num
+        return num
+
+    def get(self, count=None):
+        """ Return the newest count frames kept, oldest first, as a dict of
+        arrays with the timestamps under 'time'
+        """
+        with self._lock:
+            kept = min(self.total, self.depth)
+            count = kept if count is None else min(count, kept)
+            return self._slice(self.total - count, self.total)
+
+    def read(self):
+        """ Return the frames stored since the previous read(), as for
+        get().  Frames overwritten in the meantime are lost and counted in
+        the 'lost' entry.
+        """
+        with self._lock:
+            start = max(self._cursor, self.total - self.depth)
+            results = self._slice(start, self.total)
+            results['lost'] = start - self._cursor
+            self._cursor = self.total
+            return results
+
+    def _slice(self, start, stop):
+        idx = np.arange(start, stop) % self.depth
+        results = {name: field[idx] for name, field in self.data.items()}
+        results['time'] = self.times[idx]
+        return results
+
+    def start(self):
+        """ Start draining the FIFO in a background thread """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        period = 1. / self.rate
+        due = time.time()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except IOError as error:
+                logger.warning('MPU9250 FIFO read failed: {}'.format(error))
+            due += period
+            wait = due - time.time()
+            if wait < 0:
+                # running behind, don't try to catch up
+                due = time.time()
+                wait = 0
+            self._stop.wait(wait)
+
 class AK8963:
 
     DICT = dict()
@@ -1152,7 +1366,7 @@ class AK8963:
 
     def _get(self, data, mask):
         data = data & mask
-        return data / (mask & -mask)
+        return data // (mask & -mask)
 
     def _getMask(self, dicts, name):
         for rid in dicts:
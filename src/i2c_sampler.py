@@ -0,0 +1,250 @@
+import time,logging,threading,heapq
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ReadingRing(object):
+
+    def __init__(self, depth=1024):
+        """ Fixed-size ring buffer of timestamped sensor readings
+
+        Readings are numbers or sequences of numbers, stored as rows of a
+        float array.  The row width is fixed by the first reading.
+        A failed reading (None) is stored as NaN.
+
+        depth: number of readings kept
+        """
+        self.depth = depth
+        self.times = np.zeros(depth)
+        self.values = None
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+    def append(self, timestamp, value):
+        """ Store a reading.  Raises ValueError or TypeError, storing
+        nothing, if it is not a number or a sequence of numbers of the
+        width of the first reading.
+        """
+        row = None
+        if value is not None:
+            row = np.asarray(value, dtype=float).reshape(-1)
+            if row.size == 0 or (self.values is not None and
+                                 row.size != self.values.shape[1]):
+                raise ValueError('Reading {!r} does not have the width of '
+                                 'the first reading'.format(value))
+        if self.values is None:
+            if row is None:
+                return
+            self.values = np.full((self.depth, row.size), np.nan)
+        idx = self.count % self.depth
+        self.times[idx] = timestamp
+        self.values[idx] = np.nan if row is None else row
+        self.count += 1
+
+    def latest(self):
+        """ Return (timestamp, value) of the newest reading, or (None, None)
+        """
+        if self.count == 0:
+            return None, None
+        idx = (self.count - 1) % self.depth
+        return self.times[idx], self._value(self.values[idx])
+
+    def history(self, since=None):
+        """ Return (times, values) arrays of the kept readings, oldest first,
+        optionally only those taken after since
+        """
+        if self.count == 0:
+            return np.zeros(0), np.zeros((0, 0))
+        idx = np.arange(self.count - len(self), self.count) % self.depth
+        times, values = self.times[idx], self.values[idx]
+        if since is not None:
+            keep = times > since
+            times, values = times[keep], values[keep]
+        return times, values
+
+    def _value(self, row):
+        if np.all(np.isnan(row)):
+            return None
+        elif row.size == 1:
+            return float(row[0])
+        else:
+            return tuple(row.tolist())
+
+class SensorSampler(object):
+
+    def __init__(self):
+        """ Periodic sampler for sensors sharing an I2C bus
+
+        A single background thread owns the bus and reads every registered
+        sensor at its own period, keeping timestamped readings in a ring
+        buffer per sensor.  Consumers get cached readings from read(),
+        which only touches the hardware when the newest reading is older
+        than the max_age they accept.  Other code that needs the bus
+        should hold the bus lock.
+
+        .. code-block:: python
+
+            sampler = SensorSampler()
+            sampler.add('vcc', ltc.readVolt, 1.0, args=('vcc',))
+            sampler.add('temp', si7051.readTemp, 5.0)
+            sampler.add('temp_rh', si7021.readTempRH, 5.0)
+            sampler.start()
+            sampler.read('temp', max_age=10)    # cached reading
+            with sampler.bus:
+                eeprom.read(0x0, 32)            # other bus traffic
+        """
+        self.bus = threading.RLock()
+        self._sensors = {}
+        self._schedule = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def add(self, name, function, period, args=(), kwargs=None, depth=1024):
+        """ Register a sensor
+
+        :param name: name to read the sensor back by
+        :param function: the driver method that reads the sensor, e.g.
+            Si7051.readTemp.  It must return a number, a sequence of numbers
+            or None on failure.
+        :param period: sampling period in seconds
+        :param args: positional arguments to the function
+        :param kwargs: keyword arguments to the function
+        :param depth: number of readings kept
+        """
+        if period <= 0:
+            raise ValueError("Invalid parameter")
+        with self._lock:
+            self._sensors[name] = {
+                'function': function, 'period': period, 'args': tuple(args),
+                'kwargs': kwargs or {}, 'ring': ReadingRing(depth),
+                'errors': 0,
+            }
+            # adding a name again replaces the sensor and its schedule
+            self._schedule = [s for s in self._schedule if s[1] != name]
+            heapq.heapify(self._schedule)
+            heapq.heappush(self._schedule, (time.time(), name))
+        self._wakeup.set()
+
+    def remove(self, name):
+        with self._lock:
+            self._sensors.pop(name)
+            self._schedule = [s for s in self._schedule if s[1] != name]
+            heapq.heapify(self._schedule)
+
+    def sensors(self):
+        return list(self._sensors.keys())
+
+    def sample(self, name):
+        """ Read a sensor now, store and return the reading """
+        return self._sample(name, self._sensors[name])
+
+    def _sample(self, name, sensor):
+        with self.bus:
+            try:
+                value = sensor['function'](*sensor['args'], **sensor['kwargs'])
+            except Exception as error:
+                logger.warning('Failed to read sensor {}: {}'.format(name, error))
+                sensor['errors'] += 1
+                value = None
+            timestamp = time.time()
+        with self._lock:
+            try:
+                sensor['ring'].append(timestamp, value)
+            except (TypeError, ValueError) as error:
+                logger.warning('Bad reading from sensor {}: {}'.format(name, error))
+                sensor['errors'] += 1
+                value = None
+                sensor['ring'].append(timestamp, value)
+        return value
+
+    def read(self, name, max_age=None):
+        """ Return the newest reading of a sensor
+
+        :param name: the sensor name
+        :param max_age: the oldest reading, in seconds, that is acceptable.
+            If the newest reading is older, or there is none, the sensor is
+            read now.  None accepts any cached reading.
+        """
+        timestamp, value = self.latest(name)
+        if self._fresh(timestamp, max_age):
+            return value
+        with self.bus:
+            # another reader may have sampled while we waited for the bus
+            timestamp, value = self.latest(name)
+            if self._fresh(timestamp, max_age):
+                return value
+            return self.sample(name)
+
+    def _fresh(self, timestamp, max_age):
+        return timestamp is not None and \
+            (max_age is None or time.time() - timestamp <= max_age)
+
+    def read_all(self, max_age=None):
+        """ Return a dict of the newest readings of all sensors """
+        return {name: self.read(name, max_age) for name in self.sensors()}
+
+    def latest(self, name):
+        """ Return (timestamp, value) of the newest reading of a sensor """
+        with self._lock:
+            return self._sensors[name]['ring'].latest()
+
+    def history(self, name, since=None):
+        """ Return (times, values) arrays of the kept readings of a sensor
+        """
+        with self._lock:
+            return self._sensors[name]['ring'].history(since)
+
+    def errors(self, name):
+        return self._sensors[name]['errors']
+
+    def start(self):
+        """ Start sampling in a background thread """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the background thread """
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                if self._schedule:
+                    due, name = self._schedule[0]
+                    wait = due - time.time()
+                    if wait <= 0:
+                        heapq.heappop(self._schedule)
+                else:
+                    name, wait = None, None
+                # look the sensor up here, remove() may run at any time
+                sensor = self._sensors.get(name)
+            if wait is None or wait > 0:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+                continue
+            if sensor is None:
+                continue
+            try:
+                self._sample(name, sensor)
+            except Exception:
+                # keep sampling the other sensors whatever happens
+                logger.exception('Failed to sample sensor {}'.format(name))
+            with self._lock:
+                # unless removed, or removed and added again, meanwhile
+                if self._sensors.get(name) is sensor:
+                    period = self._sensors[name]['period']
+                    # keep to the original grid, but skip missed samples
+                    due = due + period * max(1, np.ceil((time.time() - due) / period))
+                    heapq.heappush(self._schedule, (due, name))
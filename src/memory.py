@@ -5,12 +5,137 @@ busses. Normally via KATCP.
 """
 
 import logging
+import numpy as np
 from . import bitfield
-import struct
 
 LOGGER = logging.getLogger(__name__)
 
 
+def bin2fp_array(raw_words, bitwidth, bin_pt, signed):
+    """
+    Convert an array of raw numbers based on supplied characteristics.
+
+    :param raw_words: array-like of unsigned words, bits above bitwidth
+        are ignored
+    :param bitwidth: the width in bits, up to 64
+    :param bin_pt: the location of the binary point
+    :param signed: whether the numbers are signed or not
+    :return: a numpy array, integer if bin_pt is zero, else float64
+    """
+    if bitwidth > 64:
+        raise ValueError('bin2fp_array supports at most 64 bits, '
+                         'got %i' % bitwidth)
+    words = np.asarray(raw_words).astype(np.uint64, copy=False)
+    if bitwidth < 64:
+        words = words & np.uint64((2**bitwidth) - 1)
+    if signed:
+        values = words.view(np.int64)
+        if bitwidth < 64:
+            # sign-extend from bit bitwidth-1
+            sign_bit = np.int64(2**(bitwidth-1))
+            values = (values ^ sign_bit) - sign_bit
+    elif bitwidth < 64:
+        values = words.view(np.int64)
+    else:
+        values = words
+    if bin_pt == 0:
+        return values
+    return values / float(2**bin_pt)
+
+
+def fp2fixed_array(nums, bitwidth, bin_pt, signed, overflow='saturate'):
+    """
+    Quantise an array of floating point numbers to fixed point.
+
+    :param nums: array-like of numbers
+    :param bitwidth: the width in bits, up to 64
+    :param bin_pt: the location of the binary point
+    :param signed: whether the fixed point type is signed or not
+    :param overflow: what to do with out-of-range values: 'saturate'
+        clamps them to the limits, 'wrap' discards the overflowing bits
+        like the hardware does and 'error' raises a ValueError
+    :return: a float64 numpy array of the quantised values
+    """
+    _format = '%s%i.%i' % ('fix' if signed else 'ufix', bitwidth, bin_pt)
+    if bin_pt > bitwidth:
+        raise ValueError('Cannot have bin_pt > bitwidth')
+    if bin_pt < 0:
+        raise ValueError('bin_pt < 0 makes no sense')
+    if bitwidth > 64:
+        raise ValueError('fp2fixed_array supports at most 64 bits, '
+                         'got %i' % bitwidth)
+    if overflow not in ['saturate', 'wrap', 'error']:
+        raise ValueError('Unknown overflow mode %s' % overflow)
+    nums = np.asarray(nums, dtype=np.float64)
+    if (not signed) and (overflow != 'wrap') and (nums < 0).any():
+        raise ValueError('Cannot represent negative number (%f) in %s' % (
+            nums[nums < 0].flat[0], _format))
+    scaled = np.round(nums * (2**bin_pt))
+    if signed:
+        _nbits = bitwidth - 1
+        limits = [-1 * (2**_nbits), (2**_nbits) - 1]
+    else:
+        limits = [0, (2**bitwidth) - 1]
+    if overflow == 'wrap':
+        # discard the overflowing bits first, numbers past 64 bits do not
+        # fit the cast
+        scaled = scaled - np.floor(scaled / 2.0**bitwidth) * 2.0**bitwidth
+        raw = cast_fixed_array(scaled, bitwidth, 0)
+        return bin2fp_array(raw, bitwidth, bin_pt, signed).astype(np.float64)
+    out_of_range = (scaled < limits[0]) | (scaled > limits[1])
+    if (overflow == 'error') and out_of_range.any():
+        raise ValueError('Number (%f) out of range for %s' % (
+            nums[out_of_range].flat[0], _format))
+    scaled = np.clip(scaled, limits[0], limits[1])
+    return scaled / ((2**bin_pt) * 1.0)
+
+
+def cast_fixed_array(fpnums, bitwidth, bin_pt):
+    """
+    Represent an array of fixed point numbers as unsigned numbers, like the
+    Xilinx reinterpret block.
+
+    :param fpnums: array-like of fixed point numbers
+    :param bitwidth: the width in bits, up to 64
+    :param bin_pt: the location of the binary point
+    :return: a uint64 numpy array, numbers too big for bitwidth are
+        clamped to its largest value
+    """
+    fpnums = np.asarray(fpnums, dtype=np.float64)
+    vals = np.trunc(fpnums * (2**bin_pt))
+    negative = vals < 0
+    # go via int64 so negative numbers become two's complement
+    uvals = np.where(negative, vals, 0).astype(np.int64).astype(np.uint64)
+    uvals &= np.uint64((2**bitwidth) - 1)
+    # clamp as integers, 2**64 - 1 rounds up to 2**64 as a float
+    too_big = vals >= 2.0**bitwidth
+    positive = np.where(negative | too_big, 0, vals).astype(np.uint64)
+    positive = np.where(too_big, np.uint64((2**bitwidth) - 1), positive)
+    return np.where(negative, uvals, positive)
+
+
+def fp2fixed_int_array(nums, bitwidth, bin_pt, signed, overflow='saturate'):
+    """
+    Convert an array of floating point numbers to the unsigned integers that
+    must be written to hardware for the given fixed point type.
+
+    :param nums: array-like of numbers
+    :param bitwidth: the width in bits, up to 64
+    :param bin_pt: the location of the binary point
+    :param signed: whether the fixed point type is signed or not
+    :param overflow: 'saturate', 'wrap' or 'error', see fp2fixed_array
+    :return: a uint64 numpy array
+    """
+    vals = fp2fixed_array(nums, bitwidth, bin_pt, signed, overflow)
+    raw = cast_fixed_array(vals, bitwidth, bin_pt)
+    if signed and overflow != 'wrap':
+        # the largest signed value of wide types rounds up to 2**(bitwidth-1)
+        # as a float, which would cast to the most negative one
+        too_big = np.trunc(vals * (2**bin_pt)) >= 2.0**(bitwidth - 1)
+        raw = np.where(too_big, np.uint64(2**(bitwidth - 1) - 1), raw)
+    return raw
+
+
 def bin2fp(raw_word, bitwidth, bin_pt, signed):
     """
     Convert a raw number based on supplied characteristics.
@@ -21,22 +146,21 @@ def bin2fp(raw_word, bitwidth, bin_pt, signed):
     :param signed: whether it is signed or not
     :return: the formatted number, long, float or int
     """
+    if bitwidth <= 64:
+        return bin2fp_array(raw_word & ((2**bitwidth)-1), bitwidth, bin_pt,
+                            signed).item()
+    # too wide for numpy, do it with python integers
     word_masked = raw_word & ((2**bitwidth)-1)
     if signed and (word_masked >= 2**(bitwidth-1)):
         word_masked -= 2**bitwidth
     if bin_pt == 0:
-        if bitwidth <= 63:
-            return int(word_masked)
-        else:
-            return long(word_masked)
-    else:
-        quotient = word_masked // (2**bin_pt)
-        rem = word_masked - (quotient * (2**bin_pt))
-        return quotient + (float(rem) / (2**bin_pt))
-    raise RuntimeError
+        return int(word_masked)
+    quotient = word_masked // (2**bin_pt)
+    rem = word_masked - (quotient * (2**bin_pt))
+    return quotient + (float(rem) / (2**bin_pt))
 
 
-def fp2fixed(num, bitwidth, bin_pt, signed):
+def fp2fixed(num, bitwidth, bin_pt, signed, overflow='saturate'):
     """
     Convert a floating point number to its fixed point equivalent.
 
@@ -44,27 +168,44 @@ def fp2fixed(num, bitwidth, bin_pt, signed):
     :param bitwidth:
     :param bin_pt:
     :param signed:
+    :param overflow: 'saturate', 'wrap' or 'error', see fp2fixed_array
+    """
+    if bitwidth <= 64:
+        return fp2fixed_array(num, bitwidth, bin_pt, signed, overflow).item()
+    scaled = _fp2fixed_scaled(num, bitwidth, bin_pt, signed, overflow)
+    return scaled / ((2**bin_pt) * 1.0)
+
+
+def _fp2fixed_scaled(num, bitwidth, bin_pt, signed, overflow):
+    """
+    fp2fixed with python integers, for types too wide for numpy.
+
+    :return: the quantised number times 2**bin_pt, as an integer
     """
     _format = '%s%i.%i' % ('fix' if signed else 'ufix', bitwidth, bin_pt)
     if bin_pt > bitwidth:
         raise ValueError('Cannot have bin_pt > bitwidth')
     if bin_pt < 0:
         raise ValueError('bin_pt < 0 makes no sense')
-    if (not signed) and (num < 0):
+    if overflow not in ['saturate', 'wrap', 'error']:
+        raise ValueError('Unknown overflow mode %s' % overflow)
+    if (not signed) and (overflow != 'wrap') and (num < 0):
         raise ValueError('Cannot represent negative number (%f) in %s' % (
             num, _format))
-    if num == 0:
-        return 0
-    scaled = num * (2**bin_pt)
-    scaled = round(scaled)
+    scaled = int(round(num * (2**bin_pt)))
     if signed:
         _nbits = bitwidth - 1
         limits = [-1 * (2**_nbits), (2**_nbits) - 1]
     else:
         limits = [0, (2**bitwidth) - 1]
-    scaled = min(limits[1], max(limits[0], scaled))
-    unscaled = scaled / ((2**bin_pt) * 1.0)
-    return unscaled
+    if overflow == 'wrap':
+        scaled &= (2**bitwidth) - 1
+        if signed and scaled > limits[1]:
+            scaled -= 2**bitwidth
+        return scaled
+    if (overflow == 'error') and not (limits[0] <= scaled <= limits[1]):
+        raise ValueError('Number (%f) out of range for %s' % (num, _format))
+    return min(limits[1], max(limits[0], scaled))
 
 
 def cast_fixed(fpnum, bitwidth, bin_pt):
@@ -76,20 +217,25 @@ def cast_fixed(fpnum, bitwidth, bin_pt):
     :param bitwidth:
     :param bin_pt:
     """
-    if fpnum == 0:
-        return 0
+    if bitwidth <= 64:
+        return cast_fixed_array(fpnum, bitwidth, bin_pt).item()
+    # too wide for numpy, do it with python integers
     val = int(fpnum * (2**bin_pt))
-    if fpnum < 0:
-        val += 2**bitwidth
-    return val
+    if val < 0:
+        val &= (2**bitwidth) - 1
+    return min(val, (2**bitwidth) - 1)
 
 
-def fp2fixed_int(num, bitwidth, bin_pt, signed):
+def fp2fixed_int(num, bitwidth, bin_pt, signed, overflow='saturate'):
     """
     Compatability function, rather use the other functions explicitly.
     """
-    val = fp2fixed(num, bitwidth, bin_pt, signed)
-    return cast_fixed(val, bitwidth, bin_pt)
+    if bitwidth <= 64:
+        return fp2fixed_int_array(num, bitwidth, bin_pt, signed,
+                                  overflow).item()
+    # in integers throughout, the limits of the type are not floats
+    scaled = _fp2fixed_scaled(num, bitwidth, bin_pt, signed, overflow)
+    return scaled & ((2**bitwidth) - 1)
 
 
 class Memory(bitfield.Bitfield):
@@ -163,32 +309,44 @@ class Memory(bitfield.Bitfield):
     def _process_data(self, rawdata):
         """
         Process raw data according to this memory's bitfield setup.
-        Does not use construct, just struct and iterate through.
-        Faster than construct. Who knew?
+        Each field is extracted from all the words at once with numpy.
         """
         if not isinstance(rawdata, bytes):
             raise TypeError('self.read_raw returning incorrect datatype. '
                             'Must be str or buffer.')
-        fbytes = struct.unpack('%iB' % self.length_bytes, rawdata)
         width_bytes = self.width_bits // 8
-        memory_words = []
-        for wordctr in range(0, len(fbytes) // width_bytes):
-            startindex = wordctr * width_bytes
-            wordl = 0
-            for bytectr in range(0, width_bytes):
-                byte = fbytes[startindex + width_bytes - (bytectr + 1)]
-                wordl |= byte << (bytectr * 8)
-                # print('\t%d: bytel: 0x%02X, wordl: 0x%X' % (
-                #     bytectr, byte, wordl))
-            memory_words.append(wordl)
-        # now we have all the words as longs, so carry on
+        num_words = self.length_bytes // width_bytes
+        # left-pad every word to a whole number of big-endian 64-bit limbs,
+        # limb 0 being the most significant
+        num_limbs = (width_bytes + 7) // 8
+        wordbytes = np.frombuffer(rawdata, dtype=np.uint8,
+                                  count=num_words * width_bytes)
+        padded = np.zeros((num_words, num_limbs * 8), dtype=np.uint8)
+        padded[:, num_limbs * 8 - width_bytes:] = wordbytes.reshape(
+            num_words, width_bytes)
+        limbs = padded.view('>u8').astype(np.uint64)
         processed = {}
         for field in self._fields.values():
-            processed[field.name] = []
-        for ctr, word in enumerate(memory_words):
-            for field in self._fields.values():
-                word_shift = word >> field.offset
-                word_done = bin2fp(word_shift, field.width_bits,
-                                   field.binary_pt, field.numtype == 1)
-                processed[field.name].append(word_done)
+            signed = field.numtype == 1
+            if field.width_bits > 64:
+                # too wide for numpy, build python integers for this field
+                values = []
+                for limb_words in limbs.tolist():
+                    word = 0
+                    for limb in limb_words:
+                        word = (word << 64) | limb
+                    values.append(bin2fp(word >> field.offset,
+                                         field.width_bits, field.binary_pt,
+                                         signed))
+                processed[field.name] = values
+                continue
+            limb = num_limbs - 1 - (field.offset // 64)
+            shift = field.offset % 64
+            word_shift = limbs[:, limb] >> np.uint64(shift)
+            if (shift > 0) and (limb > 0) and \
+                    (shift + field.width_bits > 64):
+                word_shift |= limbs[:, limb - 1] << np.uint64(64 - shift)
+            processed[field.name] = bin2fp_array(
+                word_shift, field.width_bits, field.binary_pt,
+                signed).tolist()
         return processed
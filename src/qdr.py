@@ -7,7 +7,10 @@ Created on Fri Mar  7 07:15:45 2014
 import logging
 import numpy
 import struct
+import json
+import os
 from . import register
+from . import utils
 
 from .memory import Memory
 
@@ -126,6 +129,9 @@ class Qdr(Memory):
         self.p_bwrite = self.parent.blindwrite
         self.p_read = self.parent.read
 
+        # the delays last applied by _apply_calibration
+        self.calibration = None
+
         # print('QDR %s logger name(%s) id(%i) level(%i)' % ()
         #     self.name, LOGGER.name, id(LOGGER), LOGGER.level)
         # print('qdr logger handlers:', LOGGER.handlers)
@@ -190,6 +196,22 @@ class Qdr(Memory):
         self.p_write_int(self.control_mem, value,
                          blindwrite=True, word_offset=offset)
 
+    def _control_mem_write_many(self, writes):
+        """
+        Write a list of (value, offset) words to this QDR's control memory,
+        in order, in one batch if the parent supports it
+
+        :param writes:
+        """
+        if hasattr(self.parent, 'blindwrite_many'):
+            self.parent.blindwrite_many(
+                self.control_mem,
+                [(struct.pack('>I', value), offset * 4)
+                 for value, offset in writes])
+        else:
+            for value, offset in writes:
+                self._control_mem_write(value, offset)
+
     def _disable_fabric(self):
         """
         Disable the fabric write to the QDR.
@@ -231,11 +253,11 @@ class Qdr(Memory):
         """
         if step == 0:
             return
-        self._control_mem_write(0 if step < 0 else 0xffffffff, 7)
+        writes = [(0 if step < 0 else 0xffffffff, 7)]
         logl1('Applying clock delay: {}'.format(step))
         for _ctr in range(abs(step)):
-            self._control_mem_write(0, 5)
-            self._control_mem_write(1 << 8, 5)
+            writes += [(0, 5), (1 << 8, 5)]
+        self._control_mem_write_many(writes)
 
     def _qdr_delay_inout_step(self, inout, bitmask, step):
         """
@@ -246,7 +268,7 @@ class Qdr(Memory):
         """
         if step == 0:
             return
-        self._control_mem_write(0 if step < 0 else 0xffffffff, 7)
+        writes = [(0 if step < 0 else 0xffffffff, 7)]
         if inout == 'in':
             offset = 4
             maskval = 0xf & (bitmask >> 32)
@@ -256,10 +278,9 @@ class Qdr(Memory):
         else:
             raise ValueError('Unknown delay type: {}'.format(inout))
         for _ctr in range(abs(step)):
-            self._control_mem_write(0, offset)
-            self._control_mem_write(0, 5)
-            self._control_mem_write(0xffffffff & bitmask, offset)
-            self._control_mem_write(maskval, 5)
+            writes += [(0, offset), (0, 5),
+                       (0xffffffff & bitmask, offset), (maskval, 5)]
+        self._control_mem_write_many(writes)
 
     def _qdr_delay_out_step(self, bitmask, step):
         """
@@ -404,6 +425,13 @@ class Qdr(Memory):
         assert len(in_delays) == QDR_WORD_WIDTH
         assert len(out_delays) == QDR_WORD_WIDTH
 
+        self.calibration = {
+            'in_delays': [int(d) for d in in_delays],
+            'out_delays': [int(d) for d in out_delays],
+            'clk_delay': int(clk_delay),
+            'extra_clk': bool(extra_clk),
+        }
+
         # reset all the taps to zero
         self.qdr_reset()
 
@@ -426,12 +454,41 @@ class Qdr(Memory):
                 logl1('\tstep {} {} {:036b}'.format(delaypref, step, mask))
                 self._qdr_delay_inout_step(delaypref, mask, 1)
 
-    def qdr_cal(self, fail_hard=True):
+    def qdr_cal(self, fail_hard=True, calibration=None):
+        """
+        Calibrate the QDR.
+
+        :param fail_hard: throw an exception on cal fail if True, else
+            return False
+        :param calibration: optional delays from an earlier calibration, as
+            left in self.calibration. They are applied and given a quick
+            check first, and the full sweep only runs if that fails.
+        :return: (calibrated, failure_pattern)
+        """
+        if calibration is not None:
+            cal, failure_pattern = self.qdr_cal_apply(calibration)
+            if cal:
+                return cal, failure_pattern
+            logl1('QDR {} cached calibration failed, recalibrating'.format(
+                self.name))
         if not USE_JACK_CAL:
             return self._qdr_cal_ours(fail_hard)
         else:
             return self._qdr_cal_jacks(fail_hard)
 
+    def qdr_cal_apply(self, calibration):
+        """
+        Apply the delays of an earlier calibration and check them.
+
+        :param calibration: a dict as left in self.calibration
+        :return: (calibrated, failure_pattern)
+        """
+        self._apply_calibration(in_delays=calibration['in_delays'],
+                                out_delays=calibration['out_delays'],
+                                clk_delay=calibration['clk_delay'],
+                                extra_clk=calibration['extra_clk'])
+        return self.qdr_cal_check()
+
     def _qdr_cal_ours(self, fail_hard=True):
         """
         Calibrates a QDR controller, stepping input delays and (if that fails)
@@ -582,4 +639,48 @@ class Qdr(Memory):
             raise RuntimeError('QDR %s calibration failed.' % self.name)
         return cal, failure_pattern
 
+
+def calibrate_qdrs(fpga_list, timeout=600, cache_file=None, fail_hard=False):
+    """
+    Calibrate every QDR on many boards in parallel.
+
+    The boards run concurrently, the QDRs of one board in turn since they
+    share its transport.
+
+    :param fpga_list: list of CasperFpga objects
+    :param timeout: how long to wait for the boards
+    :param cache_file: optional JSON file of per-board, per-QDR delays.
+        QDRs found in it first try their cached delays with a quick check,
+        and the delays of every good calibration are written back.
+    :param fail_hard: raise on a failed calibration rather than returning
+        False for it
+    :return: a dictionary, keyed on hostname, of dictionaries of
+        (calibrated, failure_pattern) keyed on QDR name
+    """
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    def _calibrate(fpga):
+        results = {}
+        for name in fpga.qdrs.keys():
+            calibration = cache.get(fpga.host, {}).get(name)
+            results[name] = fpga.qdrs[name].qdr_cal(fail_hard=fail_hard,
+                                                    calibration=calibration)
+        return results
+
+    results = utils.threaded_fpga_operation(fpga_list, timeout, (_calibrate,))
+
+    if cache_file is not None:
+        qdrs = {fpga.host: fpga.qdrs for fpga in fpga_list}
+        for host, host_results in results.items():
+            for name, (cal, _) in host_results.items():
+                if cal:
+                    cache.setdefault(host, {})[name] = \
+                        qdrs[host][name].calibration
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f, indent=2)
+    return results
+
 # end
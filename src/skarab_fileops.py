@@ -3,6 +3,11 @@ import struct
 import logging
 import time
 import socket
+import select
+import contextlib
+import hashlib
+import tempfile
+import numpy as np
 
 from . import skarab_definitions as sd
 from . import progska
@@ -71,20 +76,20 @@ class FpgProcessor(ImageProcessor):
         """
         :return: the name of a produced .bin file
         """
-        fpg_file = open(self.image_file, 'r')
+        fpg_file = open(self.image_file, 'rb')
         fpg_contents = fpg_file.read()
         fpg_file.close()
 
         # scan for the end of the fpg header
-        if fpg_contents.find('?quit') == -1:
+        if fpg_contents.find(b'?quit') == -1:
             raise IOError('{} is not a valid fpg file!'.format(self.image_file))
 
         # exract the bitstream portion of the file
-        bitstream_start = fpg_contents.find('?quit') + len('?quit') + 1
+        bitstream_start = fpg_contents.find(b'?quit') + len(b'?quit') + 1
         bitstream = fpg_contents[bitstream_start:]
 
         # check if bitstream is compressed using magic number for gzip
-        if bitstream.startswith('\x1f\x8b\x08'):
+        if bitstream.startswith(b'\x1f\x8b\x08'):
             import zlib
             bitstream = zlib.decompress(bitstream, 16 + zlib.MAX_WBITS)
             LOGGER.debug('Decompressing compressed bitstream.')
@@ -158,7 +163,7 @@ class BitProcessor(ImageProcessor):
         data = fptr.read()
         data = data.rstrip()  # get rid of pesky EOF chars
         # bin file header identifier - '\xff' * 32
-        header_end_index = data.find('\xff' * 32)
+        header_end_index = data.find(b'\xff' * 32)
         data = data[header_end_index:]
         fptr.close()
 
@@ -169,16 +174,9 @@ class BitProcessor(ImageProcessor):
         # i.e. given 09DC in .bit, require B039 in .bin
         # this equates to reversing the bits in each byte in the file
 
-        # for unpacking data from bit file and repacking
-        data_format = struct.Struct('!B')
-        bitstream = ''
-        for bytectr in range(len(data)):
-            # reverse bits each byte
-            byte = data_format.unpack(data[bytectr])[0]
-            bits = '{:08b}'.format(byte)
-            bits_flipped = bits[::-1]
-            byte_to_pack = int(bits_flipped, 2)
-            bitstream += data_format.pack(byte_to_pack)
+        # unpacking LSB first and packing MSB first mirrors every byte
+        bitstream = np.packbits(np.unpackbits(
+            np.frombuffer(data, dtype=np.uint8), bitorder='little')).tobytes()
         if not self.extract:
             return bitstream, None
         self.write_bin(bitstream)
@@ -197,8 +195,8 @@ class BinProcessor(ImageProcessor):
         bitstream = fptr.read()
         fptr.close()
         # check if the valid header substring exists
-        valid_string = '\xff\xff\x00\x00\x00\xdd\x88\x44\x00\x22\xff\xff'
-        swapped_string = '\xff\xff\x00\x00\xdd\x00\x44\x88\x22\x00'
+        valid_string = b'\xff\xff\x00\x00\x00\xdd\x88\x44\x00\x22\xff\xff'
+        swapped_string = b'\xff\xff\x00\x00\xdd\x00\x44\x88\x22\x00'
         if bitstream.find(valid_string) == 30:
             if not self.extract:
                 return bitstream, None
@@ -230,26 +228,174 @@ class BinProcessor(ImageProcessor):
         :param bitstream: binary bitstream to reorder
         :return: reordered_bitstream
         """
-        num_words = len(bitstream) / 2
-        data_format_pack = '<' + str(num_words) + 'H'
-        data_format_unpack = '>' + str(num_words) + 'H'
-        unpacked_format = struct.unpack(data_format_unpack, bitstream)
-        reordered_bitstream = struct.pack(data_format_pack, *unpacked_format)
-        return reordered_bitstream
+        return np.frombuffer(bitstream, dtype='>u2').astype('<u2').tobytes()
 
 
-def upload_to_ram_progska(filename, fpga_list, chunk_size=1988):
+class BitstreamCache(object):
+    """
+    A content-addressed, size-bounded cache of bitstreams converted to
+    .bin format, so that programming the same image again does not redo
+    the conversion.
+
+    Converted bitstreams are kept as files in a cache directory, named by
+    the hash of the source file, and the least recently used ones are
+    removed once the cache grows beyond max_bytes. Cached files are
+    programmed into boards as they are, so the directory must belong to
+    the user and be writable by no one else.
+    """
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        """
+
+        :param cache_dir: where to keep the converted bitstreams, by default
+            casperfpga/bitstreams in the user's cache directory
+        :param max_bytes: the size the cache is trimmed to
+        """
+        if cache_dir is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or \
+                os.path.join(os.path.expanduser('~'), '.cache')
+            cache_dir = os.path.join(cache_home, 'casperfpga', 'bitstreams')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _check_dir(self):
+        """
+        Create the cache directory if need be, and make sure no one else
+        can have put files in it.
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, mode=0o700)
+        stat = os.stat(self.cache_dir)
+        if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+            raise RuntimeError('Bitstream cache %s belongs to another '
+                               'user' % self.cache_dir)
+        if stat.st_mode & 0o022:
+            raise RuntimeError('Bitstream cache %s is writable by other '
+                               'users' % self.cache_dir)
+
+    @staticmethod
+    def file_hash(filename):
+        """
+        The SHA-256 hash of a file's contents, as a hex string
+        """
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as fptr:
+            for block in iter(lambda: fptr.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def bin_file(self, filename):
+        """
+        Return the name of the .bin file converted from filename, converting
+        it only if it is not already in the cache.
+
+        :param filename: the .fpg, .bit, .hex or .bin file
+        :return: the name of the cached .bin file
+        """
+        processor = choose_processor(filename)
+        self._check_dir()
+        bin_name = os.path.join(self.cache_dir, '%s_%s.bin' % (
+            self.file_hash(filename), processor.__name__))
+        if os.path.exists(bin_name):
+            LOGGER.debug('Using cached bitstream {}'.format(bin_name))
+            # mark it as recently used
+            os.utime(bin_name, None)
+            return bin_name
+        bitstream = processor(filename, extract_to_disk=False).make_bin()[0]
+        # write under a temporary name so that other processes never see a
+        # partial file
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fptr:
+                fptr.write(bitstream)
+            os.rename(tmp_name, bin_name)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self.trim(keep=bin_name)
+        return bin_name
+
+    def read(self, filename):
+        """
+        Return the converted bitstream of filename, via the cache
+        """
+        with open(self.bin_file(filename), 'rb') as fptr:
+            return fptr.read()
+
+    def trim(self, keep=None):
+        """
+        Remove the least recently used bitstreams until the cache is no
+        larger than max_bytes.
+
+        :param keep: the name of a file never to remove
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove all the cached bitstreams
+        """
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.bin'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+BITSTREAM_CACHE = BitstreamCache()
+
+
+def upload_to_ram_progska(filename, fpga_list, chunk_size=1988,
+                          cache=BITSTREAM_CACHE, progress=None,
+                          progress_interval=1.0, adaptive=True,
+                          max_rate=0):
     """
     Use the progska C extension to upload an image to a list of skarabs
 
+    The telemetry of each board, a dictionary with the chunks acked,
+    packets sent, retransmits, round trip times, completion time and
+    failure reason, is left in fpga.transport.upload_stats.
+
     :param filename: the fpg to upload
     :param fpga_list: a list of the CasperFpga objects
+    :param cache: the BitstreamCache holding the converted image, which
+        progska maps directly. If None, the image is converted in memory
+        and handed to progska as a buffer.
+    :param progress: called as progress(boards) at most every
+        progress_interval seconds while uploading, with a list of the
+        telemetry dictionaries of the boards
+    :param progress_interval: seconds between progress calls
+    :param adaptive: pace each board by its round trip time and back off
+        the whole upload on loss, rather than retransmitting on a fixed
+        20 ms timeout
+    :param max_rate: cap on the total send rate of the upload, in Mb/s,
+        e.g. to share a 1GbE control link. 0 for no cap.
     """
     upload_start_time = time.time()
-    binname = '/tmp/fpgstream_' + str(os.getpid()) + '.bin'
-    processor = choose_processor(filename)
-    processor = processor(filename, binname)
-    binname = processor.make_bin()[1]
+    if cache is not None:
+        image = cache.bin_file(filename)
+    else:
+        processor = choose_processor(filename)
+        image = processor(filename, extract_to_disk=False).make_bin()[0]
     fpga_hosts = [fpga.host for fpga in fpga_list]
 
     # clear sdram of all fpgas before uploading
@@ -260,15 +406,27 @@ def upload_to_ram_progska(filename, fpga_list, chunk_size=1988):
            'chunk_size can only be 1988, 3976 or 7952')
         return 0
     try:
-        retval = progska.upload(binname, fpga_hosts, str(chunk_size))
+        retval, boards = progska.upload(
+            image, fpga_hosts, str(chunk_size), progress=progress,
+            interval=progress_interval, adaptive=adaptive,
+            max_rate=max_rate)
     except RuntimeError as exc:
-        os.remove(binname)
         raise sd.SkarabProgrammingError(
-            'progska returned error: %s' % exc.message)
-    os.remove(binname)
+            'progska returned error: %s' % exc)
+    for fpga, board in zip(fpga_list, boards):
+        fpga.transport.upload_stats = board
+        LOGGER.debug('%s: %i of %i chunks, %i sent, %i retransmits, '
+                     'rtt %.2f ms (%.2f-%.2f ms)' % (
+                         board['host'], board['chunks'],
+                         board['total_chunks'], board['sent'],
+                         board['retransmits'], board['rtt'] * 1e3,
+                         board['rtt_min'] * 1e3, board['rtt_max'] * 1e3))
     if retval != 0:
+        failed = ['%s: %s' % (board['host'], board['reason'])
+                  for board in boards if not board['completed']]
         raise sd.SkarabProgrammingError(
-            'progska returned nonzero exit code: %i' % retval)
+            'progska returned nonzero exit code: %i - %s' % (
+                retval, '; '.join(failed)))
     upload_time = time.time() - upload_start_time
     LOGGER.debug('Uploaded bitstream to %s in %.1f seconds.' % (
         fpga_hosts, upload_time))
@@ -296,9 +454,9 @@ def check_ufp_bitstream(filename):
     # else: Continue
 
     # Remove all CR and LF in .ufp file
-    escape_chars = ['\r', '\n']
+    escape_chars = [b'\r', b'\n']
     for value in escape_chars:
-        contents = contents.replace(value, '')
+        contents = contents.replace(value, b'')
 
     return True, contents
 
@@ -312,13 +470,13 @@ def analyse_ufp_bitstream(bitstream):
     :return: Tuple - (num_pages, num_sectors)
     """
     # Number of Bytes in input .ufp file
-    num_bytes = len(bitstream) / 2
+    num_bytes = len(bitstream) // 2
     # 1 Page = 264 bytes
-    num_pages = num_bytes / 264
+    num_pages = num_bytes // 264
     if num_bytes % 264 != 0:
         num_pages += 1
     # 256 Pages/sector
-    num_sectors = num_pages / 256
+    num_sectors = num_pages // 256
     if num_pages % 256 != 0:
         num_sectors += 1
     debugmsg = 'Returning num_pages: {} - num_sectors: {}'.format(
@@ -562,124 +720,131 @@ def analyse_file_virtex_flash(filename=None, bitstream=None):
 #     return flash_write_checksum
 
 
-def wait_after_reboot(fpgas, timeout=200, upload_time=-1):
+def watch_reboot(fpgas, timeout=200, upload_time=-1, min_interval=0.05,
+                 max_interval=2.0):
     """
-
-    :param fpgas:
-    :param timeout:
-    :param upload_time:
+    Watch a list of rebooting skarabs and yield each one as it comes up.
+
+    Every board is probed with a read of its firmware version register,
+    all probes going out of one shared socket so that all boards are
+    checked at once. A board that does not answer is probed again after
+    an interval that doubles, from min_interval up to max_interval, so
+    that boards still booting are not hammered.
+
+    Yields (fpga, timeline) as each board comes up, fails to come up
+    with a toolflow image, or times out. The timeline is a dictionary
+    with the upload time, the time of the first response (in seconds
+    after the watch started, None if there was none), the number of
+    probes sent, the firmware version, the board's IP address and an
+    error string, None for a board that came up correctly. The first
+    response carries the firmware version, so a board without an error
+    had its firmware verified at the time of its first response.
+
+    :param fpgas: list of CasperFpga objects
+    :param timeout: seconds to wait for all boards
+    :param upload_time: time taken to upload the image, for the timeline
+    :param min_interval: seconds before the first retry of a probe
+    :param max_interval: longest time between probes of a board
     """
-    # now wait for the last one to come up
-    # last_fpga = fpgas[-1]
-    timeout = timeout + time.time()
     reboot_start_time = time.time()
-    # last_fpga_okay = False
-    # last_fpga_connected = False
-    missing = [f for f in fpgas]
-    fpga_error = []
-    results = {}
-    loopctr = 0
-    while len(missing) > 0 and timeout > time.time():
-        # print(loopctr)
-        to_remove = []
-        for fpga in missing:
-            status_str = 'checking ' + fpga.host + ':'
-            if fpga.transport.is_connected(retries=1, timeout=0.01):
-                status_str += ' up, checking firmware'
-                result, firmware_version = \
-                    fpga.transport.check_running_firmware(retries=1)
-                if result:
-                    # board came back with expected version
-                    this_reboot_time = time.time() - reboot_start_time
-                    LOGGER.info(
-                        '%s back up, in %.1f seconds (%.1f + %.1f) with FW ver '
-                        '%s' % (fpga.host, upload_time + this_reboot_time,
-                                upload_time, this_reboot_time,
-                                firmware_version))
-                    results[fpga.host] = (
-                        upload_time, this_reboot_time,
-                        IpAddress(socket.gethostbyname(fpga.host))
-                    )
-                    to_remove.append(fpga)
-                elif not result and firmware_version == '0.0':
-                    # board unreachable when trying to read firmware version
-                    # continue, leaving the board in the missing list giving it another chance later
-                    pass
-                else:
-                    # board came with with unexpected firmware version
-                    print(fpga.host, 'came back with ERROR')
-                    to_remove.append(fpga)
-                    fpga_error.append(fpga)
+    deadline = reboot_start_time + timeout
+    request = sd.ReadRegReq(sd.BOARD_REG, sd.C_RD_VERSION_ADDR)
+    # board ip -> [fpga, timeline, sequence numbers sent, interval,
+    #              next probe time]
+    watching = {}
+    for fpga in fpgas:
+        ip = IpAddress(socket.gethostbyname(fpga.host))
+        timeline = {'upload': upload_time, 'first_response': None,
+                    'probes': 0, 'firmware_version': None, 'ip': ip,
+                    'error': None}
+        watching[str(ip)] = [fpga, timeline, set(), min_interval,
+                             reboot_start_time]
+    with contextlib.closing(
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) as sock:
+        sock.setblocking(0)
+        while len(watching) > 0:
+            now = time.time()
+            if now >= deadline:
+                break
+            for ip, board in watching.items():
+                if board[4] > now:
+                    continue
+                seq_num = board[0].transport._next_seq_num()
+                try:
+                    sock.sendto(request.create_payload(seq_num),
+                                (ip, sd.ETHERNET_CONTROL_PORT_ADDRESS))
+                except socket.error as exc:
+                    # e.g. no ARP entry yet while the board boots
+                    LOGGER.debug('%s: probe not sent: %s' % (
+                        board[0].host, exc))
+                board[1]['probes'] += 1
+                board[2].add(seq_num)
+                board[4] = now + board[3]
+                board[3] = min(board[3] * 2, max_interval)
+            next_probe = min(board[4] for board in watching.values())
+            wait = max(min(next_probe, deadline) - time.time(), 0)
+            if not select.select([sock], [], [], wait)[0]:
+                continue
+            response_payload, addr = sock.recvfrom(4096)
+            board = watching.get(addr[0])
+            if board is None or \
+                    len(response_payload) // 2 != request.num_response_words:
+                continue
+            response = request.response.from_raw_data(
+                response_payload, request.num_response_words,
+                request.pad_words)
+            if response.type != request.type + 1 or \
+                    response.seq_num not in board[2]:
+                continue
+            fpga, timeline = board[0], board[1]
+            this_reboot_time = time.time() - reboot_start_time
+            timeline['first_response'] = this_reboot_time
+            golden_image, multiboot, firmware_version = \
+                fpga.transport.decode_virtex7_firmware_version(
+                    fpga.transport.data_unpack_and_merge(
+                        response.packet['reg_data_high'],
+                        response.packet['reg_data_low']))
+            timeline['firmware_version'] = firmware_version
+            if golden_image == 0 and multiboot == 0:
+                LOGGER.info(
+                    '%s back up, in %.1f seconds (%.1f + %.1f) with FW ver '
+                    '%s' % (fpga.host, upload_time + this_reboot_time,
+                            upload_time, this_reboot_time, firmware_version))
             else:
-                status_str += ' not yet ready'
-            # print(status_str)
-            # sys.stdout.flush()
-        for remove in to_remove:
-            # print('removed', remove.host)
-            missing.pop(missing.index(remove))
-        loopctr += 1
-    if len(fpga_error) > 0 or len(missing) > 0:
-        error_str = str([f.host for f in fpga_error])
-        error_str += str([f.host for f in missing])
-        # print('ERROR', error_str)
+                timeline['error'] = 'came back with the %s image, firmware ' \
+                                    'version %s' % (
+                    'golden' if golden_image else 'multiboot',
+                    firmware_version)
+                LOGGER.error('%s %s' % (fpga.host, timeline['error']))
+            del watching[addr[0]]
+            yield fpga, timeline
+    for fpga, timeline, _, _, _ in watching.values():
+        timeline['error'] = 'no response after %i probes' % timeline['probes']
+        yield fpga, timeline
+
+
+def wait_after_reboot(fpgas, timeout=200, upload_time=-1):
+    """
+    Wait for a list of skarabs to come back up after a reboot. See
+    watch_reboot, which this drives, to handle boards as they come up.
+
+    :param fpgas: list of CasperFpga objects
+    :param timeout: seconds to wait for all boards
+    :param upload_time: time taken to upload the image, for the timeline
+    :return: a dictionary of the watch_reboot timeline of each board, by
+        host
+    """
+    results = {}
+    for fpga, timeline in watch_reboot(fpgas, timeout, upload_time):
+        results[fpga.host] = timeline
+    failed = ['%s: %s' % (host, timeline['error'])
+              for host, timeline in results.items()
+              if timeline['error'] is not None]
+    if len(failed) > 0:
         raise sd.SkarabProgrammingError('These FPGAs never came up correctly '
                                         'after programming: '
-                                        '%s' % str(error_str))
-    reboot_time = time.time() - reboot_start_time
-    min_time = 1000
-    max_time = -1
-    for fhost, times in results.items():
-        max_time = max(times[1], max_time)
-        min_time = min(times[1], min_time)
-    # print('MIN MAX:', min_time, max_time)
-
-    # times_by_ip = [(int(res[2]), res) for res in results.values()]
-    # times_by_ip.sort(key=lambda val: val[0])
-    # for t in times_by_ip:
-    #     print(str(t[1][2]), t)
-    #
-    # print('&^%&^&^%&%&%&^%&^%&%&%&%&^%&^%&^%&^%&^%&^%&^%&^%&^%&^%&%')
-    #
-    # times_by_ip = [(int(res[2]), res) for res in results.values()]
-    # times_by_ip.sort(key=lambda val: val[1][1])
-    # for t in times_by_ip:
-    #     print(str(t[1][2]), t)
-
-    # while timeout > time.time():
-    #     if last_fpga.transport.is_connected():
-    #         last_fpga_connected = True
-    #         result, firmware_version = last_fpga.transport.check_running_firmware(retries=1)
-    #         if result:
-    #             reboot_time = time.time() - reboot_start_time
-    #             LOGGER.info(
-    #                 '%s back up, in %.1f seconds (%.1f + %.1f) with FW ver '
-    #                 '%s' % (last_fpga.host, upload_time + reboot_time,
-    #                         upload_time, reboot_time, firmware_version))
-    #             last_fpga_okay = True
-    #         break
-    #     time.sleep(0.1)
-    # if not last_fpga_connected:
-    #     raise sd.SkarabProgrammingError(
-    #         'Last FPGA never connected')
-    # if not last_fpga_okay:
-    #     raise sd.SkarabProgrammingError(
-    #         'Last FPGA was not ready before timeout')
-    # # now check all of them
-    # failed = []
-    # check_start = time.time()
-    # for fpga in fpgas[0:-2]:
-    #     result, firmware_version = fpga.transport.check_running_firmware(
-    #         retries=1)
-    #     if result:
-    #         LOGGER.info('%s back up with FW ver %s' % (fpga.host,
-    #                                                    firmware_version))
-    #     else:
-    #         failed.append(fpga.host)
-    # check_time = time.time() - check_start
-    # if len(failed) > 0:
-    #     raise sd.SkarabProgrammingError('These FPGAs never came up correctly '
-    #                                     'after programming: %s' % str(failed))
-    # print(upload_time, reboot_time)
+                                        '%s' % '; '.join(failed))
+    return results
 
 
 def reboot_skarabs_from_sdram(fpgas):
@@ -1,6 +1,7 @@
 from __future__ import print_function
 import logging
 import time
+import struct
 from .memory import Memory
 from . import bitfield
 from .register import Register
@@ -282,7 +283,21 @@ class Snap(Memory):
             addr = self.length_bytes
         bram_dmp = {'extra_value': None, 'data': [],
                     'length': addr & 0x7fffffff, 'offset': 0}
-        status_val = self.control_registers['status']['register'].read_uint()
+        # the status check, capture offset, data and extra value do not
+        # depend on each other, so read them in one batch
+        status_reg = self.control_registers['status']['register']
+        reads = [(status_reg.name, 4, 0)]
+        if snapsetup['circular_capture']:
+            reads.append(
+                (self.control_registers['tr_en_cnt']['register'].name, 4, 0))
+        if bram_dmp['length'] > 0:
+            reads.append((self.name + '_bram', bram_dmp['length'], 0))
+        ev_reg = self.control_registers['extra_value']['register']
+        if ev_reg is not None:
+            reads.append((ev_reg.name, 4, 0))
+        rawdata = self.parent.read_many(reads)
+        datatime = time.time()
+        status_val = struct.unpack('>I', rawdata.pop(0))[0]
         now_status = bool(status_val & 0x80000000)
         now_addr = status_val & 0x7fffffff
         if (not snapsetup['read_nowait']) and \
@@ -304,7 +319,7 @@ class Snap(Memory):
                 raise RuntimeError('Snap %s error: %s' % (
                     self.name, error_info))
         if snapsetup['circular_capture']:
-            val = self.control_registers['tr_en_cnt']['register'].read_uint()
+            val = struct.unpack('>I', rawdata.pop(0))[0]
             bram_dmp['offset'] = val - bram_dmp['length']
         else:
             bram_dmp['offset'] = 0
@@ -312,9 +327,7 @@ class Snap(Memory):
             bram_dmp['data'] = []
             datatime = -1
         else:
-            bram_dmp['data'] = self.parent.read(self.name + '_bram',
-                                                bram_dmp['length'])
-            datatime = time.time()
+            bram_dmp['data'] = rawdata.pop(0)
         bram_dmp['offset'] += snapsetup['offset']
         if bram_dmp['offset'] < 0:
             bram_dmp['offset'] = 0
@@ -322,10 +335,13 @@ class Snap(Memory):
             raise RuntimeError('%s.read_uint() - expected %i bytes, got %i' % (
                 self.name, self.length_bytes,
                 bram_dmp['length'] / (self.width_bits / 8)))
-        # read the extra value
-        ev_reg = self.control_registers['extra_value']['register']
+        # the extra value
         if ev_reg is not None:
-            bram_dmp['extra_value'] = ev_reg.read()
+            values = dict((field, value[0]) for field, value in
+                          ev_reg._process_data(rawdata.pop(0)).items())
+            ev_reg.last_values = values
+            bram_dmp['extra_value'] = {'data': values,
+                                       'timestamp': datatime}
         return bram_dmp, datatime
 
     def __str__(self):
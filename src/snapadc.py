@@ -1,8 +1,11 @@
 import numpy as np
+import json
+import os
 from .synth import *
 from .adc import *
 from .clockswitch import *
 from .wishbonedevice import WishBoneDevice
+from . import utils
 import logging
 
 logger = logging.getLogger(__name__)
@@ -107,7 +110,7 @@ class SnapAdc(object):
             logger.error("Invalid resolution parameter")
             raise ValueError("Invalid resolution parameter")
         
-        self.curDelay = [[0]*len(self.laneList)]*len(self.adcList)
+        self.curDelay = [[0]*len(self.laneList) for _ in self.adcList]
 
         # check if the design uses the on-board synthesizer -- can read from fpg 'SNAP' dict
         if parent.devices['SNAP']['clk_src'] == 'sys_clk':
@@ -217,17 +220,9 @@ class SnapAdc(object):
             logger.error('MMCM not locked.')
             return self.ERROR_MMCM
 
-        if not self.align_line_clock():
-            logger.error('Line clock alignment failed!')
-            return self.ERROR_LINE
-        if not self.align_frame_clock():
-            logger.error('Frame clock alignment failed!')
-            return self.ERROR_FRAME
-
-        errs = self.test_patterns(mode='ramp')
-        if not np.all(np.array([adc.values() for adc in errs.values()])==0):
-            logger.error('ADCs failed on ramp test.')
-            return self.ERROR_RAMP
+        status = self.calibrate()['status']
+        if status != self.SUCCESS:
+            return status
 
         # Finally place ADC in "correct" mode
         self.set_demux(numChannel=num_channel)
@@ -317,10 +312,13 @@ class SnapAdc(object):
     def snapshot(self):
         """ Save 1024 consecutive samples of each ADC into its corresponding bram """
         # No way to snapshot a single ADC because the HDL code is designed so.
+        self.controller._write_words(self._snapshot_words())
+
+    def _snapshot_words(self):
         val = self._set(0x0, 0x1,   self.M_WB_W_SNAP_REQ)
-        self.controller._write(0x0, self.A_WB_W_CTRL)
-        self.controller._write(val, self.A_WB_W_CTRL)
-        self.controller._write(0x0, self.A_WB_W_CTRL)
+        return [(0x0, self.A_WB_W_CTRL),
+                (val, self.A_WB_W_CTRL),
+                (0x0, self.A_WB_W_CTRL)]
 
     def calibrate_adc_offset(self):
 
@@ -389,22 +387,56 @@ class SnapAdc(object):
             return self.read_ram(self.adcList, signed)
         elif isinstance(ram, list) and all(r in self.adcList for r in ram):
                                     # read a list of RAMs
-            data = [self.read_ram(r, signed) for r in ram if r in self.adcList]
+            data = self.read_ram_array(ram, signed).astype(int)
             return dict(zip(ram,data))
         elif ram in self.adcList:               # read one RAM      
-            if self.resolution>8:       # ADC_DATA_WIDTH == 16
-                fmt = '!1024' + ('h' if signed else 'H')
-                length = 2048
-            else:               # ADC_DATA_WIDTH == 8
-                fmt = '!1024' + ('b' if signed else 'B')
-                length = 1024
-            vals = self.ram[ram]._read(addr=0, size=length)
-            vals = np.array(struct.unpack(fmt,vals)).reshape(-1,8)
-
-            return vals
+            return self.read_ram_array([ram], signed)[0].astype(int)
         else:
             raise ValueError("Invalid parameter")
 
+    def read_ram_array(self, chipSel=None, signed=True, mode=None):
+        """ Read RAM(s) with one batched read and return a single array
+
+        Return a chips by 128 by lanes array of the RAM width, or a chips
+        by samples by channels array if mode, the number of channels as
+        for interleave(), is given.
+
+        E.g.
+            read_ram_array()            # all RAMs, a 3X128X8 array
+            read_ram_array([0,1], mode=2)   # two RAMs, a 2X512X2 array
+        """
+        if chipSel==None:
+            chipSel = self.adcList
+        elif chipSel in self.adcList:
+            chipSel = [chipSel]
+        if not isinstance(chipSel,list) or any(cs not in self.adcList for cs in chipSel):
+            raise ValueError("Invalid parameter")
+        if mode not in [None, 1, 2, 4]:
+            raise ValueError("Invalid parameter")
+
+        if self.resolution>8:       # ADC_DATA_WIDTH == 16
+            dtype = '>i2' if signed else '>u2'
+            length = 2048
+        else:               # ADC_DATA_WIDTH == 8
+            dtype = 'i1' if signed else 'u1'
+            length = 1024
+        reads = [(self.ramList[cs], length, 0) for cs in chipSel]
+        if hasattr(self.parent, 'read_many'):
+            raw = self.parent.read_many(reads)
+        else:
+            raw = [self.ram[cs]._read(addr=0, size=length) for cs in chipSel]
+        data = np.frombuffer(b''.join(raw), dtype=dtype)
+        data = data.astype(data.dtype.newbyteorder('='))
+        data = data.reshape(len(chipSel), -1, len(self.laneList))
+
+        if mode is not None:
+            # vectorised interleave() of all chips at once
+            chips, rows, lanes = data.shape
+            data = data.reshape(chips, rows, mode, lanes // mode)
+            data = data.transpose(0, 2, 1, 3).reshape(chips, mode, -1)
+            data = data.transpose(0, 2, 1)
+        return data
+
     # A lane in this method actually corresponds to a "branch" in HMCAD1511 datasheet.
     # But I have to follow the naming convention of signals in casper repo.
     def bitslip(self, chipSel=None, laneSel=None):
@@ -456,18 +488,23 @@ class SnapAdc(object):
 
         logger.debug('Bitslip lane {0} of chip {1}'.format(str(laneSel),str(chipSel)))
 
+        words = []
         for cs in chipSel:
             for ls in laneSel:
-                val = self._set(0x0, 0b1 << cs, self.M_WB_W_ISERDES_BITSLIP_CHIP_SEL)
-                val = self._set(val, ls, self.M_WB_W_ISERDES_BITSLIP_LANE_SEL)
-        
-                # The registers related to reset, request, bitslip, and other
-                # commands after being set will not be automatically cleared.  
-                # Therefore we have to clear them by ourselves.
-        
-                self.controller._write(0x0, self.A_WB_W_CTRL)
-                self.controller._write(val, self.A_WB_W_CTRL)
-                self.controller._write(0x0, self.A_WB_W_CTRL)
+                words += self._bitslip_words(0b1 << cs, ls)
+        self.controller._write_words(words)
+
+    def _bitslip_words(self, chipMask, lane):
+        val = self._set(0x0, chipMask, self.M_WB_W_ISERDES_BITSLIP_CHIP_SEL)
+        val = self._set(val, lane, self.M_WB_W_ISERDES_BITSLIP_LANE_SEL)
+
+        # The registers related to reset, request, bitslip, and other
+        # commands after being set will not be automatically cleared.
+        # Therefore we have to clear them by ourselves.
+
+        return [(0x0, self.A_WB_W_CTRL),
+                (val, self.A_WB_W_CTRL),
+                (0x0, self.A_WB_W_CTRL)]
 
 
     # The ADC16 controller word (the offset in write_int method) 2 and 3 are for delaying 
@@ -505,46 +542,61 @@ class SnapAdc(object):
         if not isinstance(tap, int):
             raise ValueError("Invalid parameter")
 
-        strl = ','.join([str(c) for c in laneSel])
-        strc = ','.join([str(c) for c in chipSel])
         logger.debug('Set DelayTap of lane {0} of chip {1} to {2}'
                 .format(str(laneSel),str(chipSel),tap))
 
-        matc = np.array([(cs*4) for cs in chipSel])
+        pairs = [(cs, ls) for cs in chipSel for ls in laneSel]
+        self.controller._write_words(self._delay_words(tap, pairs))
 
-        matla = np.array([int(l/2) for l in laneSel if l%2==0])
-        if matla.size:
-            mata =  np.repeat(matc.reshape(-1,1),matla.size,1) + \
-                np.repeat(matla.reshape(1,-1),matc.size,0)
-            vala = np.bitwise_or.reduce([0b1 << s for s in mata.flat])
-        else:
-            vala = 0
-        
-        matlb = np.array([int(l/2) for l in laneSel if l%2==1])
-        if matlb.size:
-            matb =  np.repeat(matc.reshape(-1,1),matlb.size,1) + \
-                np.repeat(matlb.reshape(1,-1),matc.size,0)
-            valb = np.bitwise_or.reduce([0b1 << s for s in matb.flat])
-        else:
-            valb = 0
+        for cs, ls in pairs:
+            self.curDelay[cs][ls] = tap
 
-        valt = self._set(0x0, tap, self.M_WB_W_DELAY_TAP)
+    def _delay_words(self, tap, pairs):
+        """ Controller words that set the delay tap of the given (chip, lane)
+        pairs.  Lanes sharing a tap setting are strobed together.
+        """
+        # Even lanes are strobed by DELAY_STROBE_L, odd lanes by DELAY_STROBE_H,
+        # four bits per chip.
+        vala, valb = 0, 0
+        for cs, ls in pairs:
+            if ls % 2 == 0:
+                vala |= 0b1 << (cs*4 + ls//2)
+            else:
+                valb |= 0b1 << (cs*4 + ls//2)
+
+        valt = self._set(0x0, int(tap), self.M_WB_W_DELAY_TAP)
 
         # Don't be misled by the naming - "DELAY_STROBE" in casper repo.  It doesn't 
         # generate strobe at all.  You have to manually clear the bits that you set.
-        self.controller._write(0x00, self.A_WB_W_CTRL)
-        self.controller._write(0x00, self.A_WB_W_DELAY_STROBE_L)
-        self.controller._write(0x00, self.A_WB_W_DELAY_STROBE_H)
-        self.controller._write(valt, self.A_WB_W_CTRL)
-        self.controller._write(vala, self.A_WB_W_DELAY_STROBE_L)
-        self.controller._write(valb, self.A_WB_W_DELAY_STROBE_H)
-        self.controller._write(0x00, self.A_WB_W_CTRL)
-        self.controller._write(0x00, self.A_WB_W_DELAY_STROBE_L)
-        self.controller._write(0x00, self.A_WB_W_DELAY_STROBE_H)
+        return [(0x00, self.A_WB_W_CTRL),
+                (0x00, self.A_WB_W_DELAY_STROBE_L),
+                (0x00, self.A_WB_W_DELAY_STROBE_H),
+                (valt, self.A_WB_W_CTRL),
+                (vala, self.A_WB_W_DELAY_STROBE_L),
+                (valb, self.A_WB_W_DELAY_STROBE_H),
+                (0x00, self.A_WB_W_CTRL),
+                (0x00, self.A_WB_W_DELAY_STROBE_L),
+                (0x00, self.A_WB_W_DELAY_STROBE_H)]
+
+    def set_delays(self, taps):
+        """ Set the delay taps of all lanes of all ADCs at once
+
+        taps is a chips by lanes array of tap settings, e.g. the result of
+        find_eye().  Lanes sharing a tap setting are set with a single strobe,
+        and all writes go to the controller in one batch.
+        """
+        taps = np.asarray(taps, dtype=int).reshape(len(self.adcList),
+                                                   len(self.laneList))
+        words = []
+        for tap in np.unique(taps):
+            pairs = [(cs, ls) for i, cs in enumerate(self.adcList)
+                     for j, ls in enumerate(self.laneList) if taps[i, j] == tap]
+            words += self._delay_words(tap, pairs)
+        self.controller._write_words(words)
 
-        for cs in chipSel:
-            for ls in laneSel:
-                self.curDelay[cs][ls] = tap
+        for i, cs in enumerate(self.adcList):
+            for j, ls in enumerate(self.laneList):
+                self.curDelay[cs][ls] = int(taps[i, j])
 
 
     def test_patterns(self, chipSel=None, taps=None, mode='std', pattern1=None, pattern2=None):
@@ -720,7 +772,7 @@ class SnapAdc(object):
 
         if taps == None:
             self.snapshot()
-            results = [_check(self.read_ram(cs)) for cs in chipSel]
+            results = [_check(d) for d in self.read_ram_array(chipSel).astype(int)]
             results = np.array(results).reshape(len(chipSel),len(self.laneList)).tolist()
             results = dict(zip(chipSel,results))
             for cs in chipSel:
@@ -729,7 +781,7 @@ class SnapAdc(object):
             for tap in taps:
                 self.delay(tap, chipSel)
                 self.snapshot()
-                results += [_check(self.read_ram(cs)) for cs in chipSel]
+                results += [_check(d) for d in self.read_ram_array(chipSel).astype(int)]
             results = np.array(results).reshape(-1,len(chipSel),len(self.laneList))
             results = np.einsum('ijk->jik',results).tolist()
             results = dict(zip(chipSel,results))
@@ -906,3 +958,237 @@ class SnapAdc(object):
         else:
             logger.error('Frame clock NOT aligned.\n{0}'.format(str(errs)))
             return False
+
+    def _dual_pattern_mode(self, pattern1, pattern2):
+        """ Put the ADCs in dual custom pattern test mode and return the
+        patterns as they appear in the RAMs
+        """
+        if type(self.controller) is HMCAD1520:
+            # test patterns of HMCAD1520 need special cares
+            ofst = 16 - self.resolution
+            self.controller.test('dual_custom_pat', pattern1 << ofst,
+                                 pattern2 << ofst)
+        else:
+            self.controller.test('dual_custom_pat', pattern1, pattern2)
+        return (self._signed(pattern1, self.resolution),
+                self._signed(pattern2, self.resolution))
+
+    def _capture(self, words=None):
+        """ Send the given controller words together with a snapshot
+        request, then return the data of all RAMs as a chips by samples
+        by lanes array
+        """
+        self.controller._write_words((words or []) + self._snapshot_words())
+        return self.read_ram_array()
+
+    @staticmethod
+    def line_errors(data):
+        """ Lane-wise count of samples that are not one of the two most
+        common values of that lane
+
+        The vectorised equivalent of test_patterns(mode='std') with dual
+        patterns.  data is a chips by samples by lanes array, the result
+        is a chips by lanes array.
+        """
+        data = np.asarray(data)
+        chips, samples, lanes = data.shape
+        vals, inv = np.unique(data, return_inverse=True)
+        inv = inv.reshape(data.shape)
+        # histogram every (chip, lane) column in one bincount
+        cols = np.arange(chips * lanes).reshape(chips, 1, lanes)
+        counts = np.bincount((cols * vals.size + inv).ravel(),
+                             minlength=chips * lanes * vals.size)
+        counts = np.sort(counts.reshape(chips, lanes, vals.size), axis=-1)
+        return samples - counts[..., -2:].sum(-1)
+
+    @staticmethod
+    def frame_errors(data, pattern1, pattern2):
+        """ Lane-wise count of samples that do not match the alternating
+        test patterns, whichever comes first
+
+        The vectorised equivalent of test_patterns(mode='err') with dual
+        patterns.  data is a chips by samples by lanes array, the result
+        is a chips by lanes array.
+        """
+        data = np.asarray(data)
+        even, odd = data[:, 0::2, :], data[:, 1::2, :]
+        e1 = np.sum(even != pattern1, 1) + np.sum(odd != pattern2, 1)
+        e2 = np.sum(even != pattern2, 1) + np.sum(odd != pattern1, 1)
+        return np.minimum(e1, e2)
+
+    @staticmethod
+    def find_eye(errs):
+        """ Find the centre of the widest error-free window of every lane
+
+        The vectorised equivalent of decide_delay.  errs is a taps by ...
+        array of error counts, e.g. the result of sweep_delays().  Returns
+        (taps, margins): the chosen tap and its distance to the nearest
+        failing tap or border for every lane.  A margin of zero means
+        there was no error-free tap.
+        """
+        bad = np.asarray(errs) != 0
+        n = bad.shape[0]
+        idx = np.arange(n).reshape((-1,) + (1,) * (bad.ndim - 1))
+        last_bad = np.maximum.accumulate(np.where(bad, idx, -1), axis=0)
+        next_bad = np.minimum.accumulate(np.where(bad, idx, n)[::-1],
+                                         axis=0)[::-1]
+        dist = np.minimum(idx - last_bad, next_bad - idx)
+        return np.argmax(dist, 0), np.max(dist, 0)
+
+    def sweep_delays(self, taps=None):
+        """ Sweep the delay taps of all lanes under dual pattern test mode
+
+        Every step sets the tap and requests a snapshot in one batch of
+        controller writes, then reads all RAMs.  Returns a taps by chips by
+        lanes array of line_errors().
+        """
+        taps = list(range(32)) if taps is None else list(taps)
+        pairs = [(cs, ls) for cs in self.adcList for ls in self.laneList]
+        self.select_adc()
+        self._dual_pattern_mode(self.p1, self.p2)
+        errs = np.zeros((len(taps), len(self.adcList), len(self.laneList)),
+                        dtype=int)
+        for i, tap in enumerate(taps):
+            data = self._capture(self._delay_words(tap, pairs))
+            errs[i] = self.line_errors(data)
+        self.controller.test('off')
+        for cs, ls in pairs:
+            self.curDelay[cs][ls] = taps[-1]
+        return errs
+
+    def fast_align_line_clock(self, delays=None):
+        """ Align the line clock of all lanes with a single tap sweep
+
+        If delays, a chips by lanes array of tap settings from an earlier
+        calibration, is given it is tried first and the sweep is skipped
+        if all lanes are error-free with it.  Returns (aligned, taps,
+        margins), margins being None if the sweep was skipped.
+        """
+        if delays is not None:
+            delays = np.asarray(delays, dtype=int)
+            self.set_delays(delays)
+            self.select_adc()
+            self._dual_pattern_mode(self.p1, self.p2)
+            errs = self.line_errors(self._capture())
+            self.controller.test('off')
+            if np.all(errs == 0):
+                logger.info('Line clock of all ADCs aligned with cached delays.')
+                return True, delays, None
+            logger.info('Cached delays failed, sweeping delay taps.')
+
+        taps = np.arange(32)
+        errs = self.sweep_delays(taps)
+        best, margins = self.find_eye(errs)
+        delays = taps[best]
+        for cs, ls in zip(*np.nonzero(margins == 0)):
+            logger.error("ADC{0} lane{1} delay decision failed".format(
+                self.adcList[cs], self.laneList[ls]))
+        self.set_delays(delays)
+
+        self.select_adc()
+        self._dual_pattern_mode(self.p1, self.p2)
+        errs = self.line_errors(self._capture())
+        self.controller.test('off')
+        if np.all(errs == 0):
+            logger.info('Line clock of all ADCs aligned.')
+            return True, delays, margins
+        else:
+            logger.error('Line clock NOT aligned.\n{0}'.format(str(errs)))
+            return False, delays, margins
+
+    def fast_align_frame_clock(self):
+        """ Align the frame clock of all lanes
+
+        Each round bitslips every misaligned lane of every ADC in one batch
+        of controller writes.
+        """
+        self.select_adc()
+        pattern1, pattern2 = self._dual_pattern_mode(self.p1, self.p2)
+        words = []
+        for u in range(self.resolution * 2 + 1):
+            errs = self.frame_errors(self._capture(words), pattern1, pattern2)
+            if np.all(errs == 0):
+                break
+            words = []
+            for j, ls in enumerate(self.laneList):
+                chips = [cs for i, cs in enumerate(self.adcList) if errs[i, j]]
+                if chips:
+                    mask = np.bitwise_or.reduce([0b1 << cs for cs in chips])
+                    words += self._bitslip_words(int(mask), ls)
+        self.controller.test('off')
+
+        if np.all(errs == 0):
+            logger.info('Frame clock of all ADCs aligned.')
+            return True
+        else:
+            logger.error('Frame clock NOT aligned.\n{0}'.format(str(errs)))
+            return False
+
+    def calibrate(self, delays=None):
+        """ Align line and frame clocks and run the ramp test
+
+        Uses the vectorised calibration engine, optionally warm-started
+        from the delays of an earlier run.  Returns a dict with the status
+        code, the chips by lanes delay taps and their eye margins.
+        """
+        result = {'status': self.SUCCESS, 'delays': None, 'margins': None,
+                  'warm_start': False}
+        aligned, taps, margins = self.fast_align_line_clock(delays)
+        result['delays'] = np.asarray(taps).tolist()
+        if margins is not None:
+            result['margins'] = margins.tolist()
+        else:
+            result['warm_start'] = True
+        if not aligned:
+            logger.error('Line clock alignment failed!')
+            result['status'] = self.ERROR_LINE
+            return result
+        if not self.fast_align_frame_clock():
+            logger.error('Frame clock alignment failed!')
+            result['status'] = self.ERROR_FRAME
+            return result
+
+        errs = self.test_patterns(mode='ramp')
+        if any(v != 0 for adc in errs.values() for v in adc.values()):
+            logger.error('ADCs failed on ramp test.')
+            result['status'] = self.ERROR_RAMP
+        return result
+
+
+def calibrate_snapadcs(fpga_list, timeout=120, cache_file=None):
+    """
+    Calibrate the SNAP ADCs of many boards in parallel.
+
+    :param fpga_list: list of CasperFpga objects with SnapAdc devices
+    :param timeout: how long to wait for the boards
+    :param cache_file: optional JSON file of per-board delay taps. Boards
+        found in it are warm-started from their cached delays, and the
+        delays of every successful calibration are written back.
+    :return: a dictionary, keyed on hostname, of dictionaries of
+        SnapAdc.calibrate results keyed on ADC name
+    """
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    def _calibrate(fpga):
+        results = {}
+        for name in fpga.adcs.keys():
+            adc = fpga.adcs[name]
+            if not isinstance(adc, SnapAdc):
+                continue
+            delays = cache.get(fpga.host, {}).get(name)
+            results[name] = adc.calibrate(delays=delays)
+        return results
+
+    results = utils.threaded_fpga_operation(fpga_list, timeout, (_calibrate,))
+
+    if cache_file is not None:
+        for host, adcs in results.items():
+            for name, result in adcs.items():
+                if result['status'] == SnapAdc.SUCCESS:
+                    cache.setdefault(host, {})[name] = result['delays']
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f, indent=2)
+    return results
@@ -2,6 +2,7 @@
 SPEAD operations - unpack and use spead data, usually from Snap blocks.
 """
 import logging
+import numpy as np
 
 LOGGER = logging.getLogger(__name__)
 
@@ -223,6 +224,152 @@ class SpeadPacket(object):
             print(string)
 
 
+class SpeadPacketBatch(object):
+    """
+    A batch of equally-sized SPEAD packets, decoded column-wise.
+
+    The headers are kept as one numpy array per header ID and the payload
+    is a view into the original 2-D word array, so nothing is copied per
+    packet.
+    """
+
+    def __init__(self, main_header, headers, data, packet_length):
+        """
+        Create a new SpeadPacketBatch.
+
+        :param main_header: the decoded magic word, shared by all packets
+        :param headers: a dictionary of header ID to a numpy array with
+            one value per packet
+        :param data: a 2-D numpy view of the payload, packets x words
+        :param packet_length: numpy array of the packet length header, in
+            64-bit words
+        """
+        self.main_header = main_header
+        self.headers = headers
+        self.data = data
+        self.packet_length = packet_length
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def packet(self, index):
+        """
+        Build a SpeadPacket for a single packet in the batch.
+
+        :param index: the index of the packet in the batch
+        :return: a SpeadPacket
+        """
+        headers = {0x0000: self.main_header}
+        for hdr_id, hdr_values in self.headers.items():
+            headers[hdr_id] = int(hdr_values[index])
+        pktlen = int(self.packet_length[index])
+        pktdata = [int(word) for word in self.data[index, :pktlen]]
+        return SpeadPacket(headers, pktdata)
+
+    def to_packets(self):
+        """
+        Convert the whole batch to a list of SpeadPacket objects.
+        """
+        return [self.packet(ctr) for ctr in range(len(self))]
+
+    @classmethod
+    def from_data(cls, data64, expected_version=None, expected_flavour=None,
+                  expected_hdrs=None, expected_length=None):
+        """
+        Decode a 2-D array of 64-bit words, one packet per row. Each row
+        must start at the SPEAD magic word and all packets must have the
+        same number of headers.
+
+        :param data64: a 2-D array-like of 64-bit words, packets x words
+        :param expected_version: an explicit version, if required
+        :param expected_flavour: an explicit flavour, if required
+        :param expected_hdrs: explicit number of hdrs, if required
+        :param expected_length: explicit payload length, in 64-bit words
+        :return: a SpeadPacketBatch
+        """
+        data64 = np.asarray(data64, dtype=np.uint64)
+        if data64.ndim != 2:
+            raise SpeadPacket.SpeadPacketError(
+                'Batch data must be 2-D (packets x words), got shape '
+                '{}'.format(data64.shape))
+        num_packets, num_words = data64.shape
+        if num_packets == 0:
+            raise SpeadPacket.SpeadPacketError('Batch contains no packets.')
+        magic = data64[:, 0]
+        mismatched = np.nonzero(magic != magic[0])[0]
+        if len(mismatched) > 0:
+            raise SpeadPacket.SpeadPacketError(
+                'SPEAD magic word of packet {} (0x{:016x}) differs from '
+                'packet 0 (0x{:016x})'.format(
+                    mismatched[0], int(magic[mismatched[0]]), int(magic[0])))
+        main_header = SpeadPacket.decode_spead_magic_word(
+            int(magic[0]), required_version=expected_version,
+            required_flavour=expected_flavour,
+            required_numheaders=expected_hdrs)
+        num_headers = main_header['num_headers']
+        if num_words < num_headers + 1:
+            raise SpeadPacket.SpeadPacketError(
+                'Packets are {} words long, too short for {} '
+                'headers.'.format(num_words, num_headers))
+        id_bits = main_header['id_bits']
+        address_bits = main_header['address_bits']
+        items = data64[:, 1:num_headers + 1]
+        # clear the immediate-addressing bit, as decode_item_pointer does
+        hdr_ids = (items >> np.uint64(address_bits)) & \
+            np.uint64((1 << (id_bits - 1)) - 1)
+        hdr_data = items & np.uint64((1 << address_bits) - 1)
+        headers = {}
+        if (hdr_ids == hdr_ids[0]).all():
+            # the common case, every packet has the same header layout
+            for ctr, hdr_id in enumerate(hdr_ids[0]):
+                hdr_id = int(hdr_id)
+                if (hdr_id in headers) and (hdr_id != 0x00):
+                    raise SpeadPacket.SpeadPacketError(
+                        'Header ID 0x%04x already in packet '
+                        'headers.' % hdr_id)
+                headers[hdr_id] = hdr_data[:, ctr]
+        else:
+            for hdr_id in np.unique(hdr_ids):
+                hdr_id = int(hdr_id)
+                mask = hdr_ids == hdr_id
+                if hdr_id != 0x00:
+                    dupes = np.nonzero(mask.sum(axis=1) > 1)[0]
+                    if len(dupes) > 0:
+                        raise SpeadPacket.SpeadPacketError(
+                            'Header ID 0x%04x appears more than once in '
+                            'packet %i.' % (hdr_id, dupes[0]))
+                values = np.zeros(num_packets, dtype=np.uint64)
+                rows, cols = np.nonzero(mask)
+                values[rows] = hdr_data[rows, cols]
+                headers[hdr_id] = values
+        # the padded 0x0000 headers are dropped, as in decode_headers
+        headers.pop(0x0000, None)
+        missing = np.nonzero((hdr_ids == 0x0004).sum(axis=1) == 0)[0]
+        if len(missing) > 0:
+            raise SpeadPacket.SpeadPacketError(
+                'After processing headers there is no packet length '
+                'header in packet %i! 0x0004 is missing.' % missing[0])
+        payload = data64[:, num_headers + 1:]
+        pktlen = payload.shape[1]
+        if (expected_length is not None) and (pktlen != expected_length):
+            raise SpeadPacket.SpeadPacketError(
+                'Packet is not the expected length, given_expected(%i bytes) '
+                'packet(%i bytes)' % (expected_length * 8, pktlen * 8))
+        hdr_pkt_len = headers[0x0004] // np.uint64(8)
+        short = np.nonzero(hdr_pkt_len > pktlen)[0]
+        if len(short) > 0:
+            raise SpeadPacket.SpeadPacketError(
+                'Packet %i contains less data than indicated in the SPEAD '
+                'header: hdr(%i bytes) packet(%i bytes)\nCheck the magic '
+                'header, number of headers and headers 2 and 4.' % (
+                    short[0], int(headers[0x0004][short[0]]), pktlen * 8))
+        num_long = np.count_nonzero(hdr_pkt_len < pktlen)
+        if num_long > 0:
+            LOGGER.warning('%i packets seemed to have more data in them than '
+                           'the SPEAD headers describe.' % num_long)
+        return cls(main_header, headers, payload, hdr_pkt_len)
+
+
 class SpeadProcessor(object):
     """
     Set up a SPEAD processor with version, flavour, etc. Then call methods 
@@ -269,6 +416,19 @@ class SpeadProcessor(object):
                 spead_pkt.ip = pkt_ip
             self.packets.append(spead_pkt)
 
+    def process_batch(self, data64):
+        """
+        Decode a 2-D array of equally-sized packets, packets x 64-bit words,
+        in one go. Much faster than process_data for large captures.
+
+        :param data64: a 2-D array-like of 64-bit words
+        :return: a SpeadPacketBatch, the packets are not added to
+            self.packets
+        """
+        return SpeadPacketBatch.from_data(
+            data64, self.version, self.flavour,
+            self.expected_num_headers, self.expected_packet_length)
+
 # def process_spead_word(current_spead_info, data, pkt_counter):
 #
 #     if pkt_counter == 1:
@@ -1,5 +1,6 @@
 import logging
 import struct
+import time
 import numpy as np
 from pkg_resources import resource_filename
 
@@ -36,6 +37,33 @@ def read_memory_map_definition(filename):
         mmap[k] = {'offset': mmap_offsets[ii], 'size': mmap_size[ii], 'rwflag': mmap_rw[ii]}
     return mmap
 
+
+def memory_map_decoder(mmap):
+    """ Build a table to decode every scalar register in a memory map
+    from one bulk read of the core.
+
+    Returns a tuple (span, table):
+        span:  the number of bytes, from offset zero, that must be read to
+               cover all the scalar registers, rounded up to whole words
+        table: [(REGISTER_NAME, offset, struct.Struct), ...]
+
+    Notes:
+        Arrays such as ARP_CACHE and the CPU buffers are not included,
+        nor is anything that is not 1, 2, 4 or 8 bytes long.
+    """
+    table = []
+    span = 0
+    for register, info in mmap.items():
+        bytesize = info['size']
+        if bytesize not in STRUCT_CTYPES:
+            continue
+        table.append((register, info['offset'],
+                      struct.Struct('>%s' % STRUCT_CTYPES[bytesize])))
+        span = max(span, info['offset'] + bytesize)
+    span += (4 - span % 4) % 4
+    return span, table
+
+
 class TenGbe(Memory, Gbe):
     """
     To do with the CASPER ten GBE yellow block implemented on FPGAs,
@@ -57,6 +85,8 @@ class TenGbe(Memory, Gbe):
             self.memmap = read_memory_map_definition(TENGBE_UNIFIED_MMAP_TXT)
         else:
             self.memmap = read_memory_map_definition(TENGBE_MMAP_LEGACY_TXT)
+        self.memmap_span, self.memmap_table = memory_map_decoder(self.memmap)
+        self._memmap_snapshot = None
 
     @property
     def mac(self):
@@ -146,6 +176,7 @@ class TenGbe(Memory, Gbe):
                 packed = struct.pack('>%s' % ctype, value)
         else:
             raise RuntimeError("Can only write 1,2,4,8 Byte registers with this function.")
+        self._memmap_snapshot = None
         self.parent.blindwrite(self.name, packed, offset=rw_addr)
 
     def _memmap_read(self, register):
@@ -209,8 +240,34 @@ class TenGbe(Memory, Gbe):
             packed = value
         else:
             packed = struct.pack('>%i%s' % (n_elem, ctype), *value)
+        self._memmap_snapshot = None
         self.parent.blindwrite(self.name, packed, offset=offset)
 
+    def _memmap_read_all(self, size=None, max_age=None):
+        """ Read the core's memory map in a single transaction and decode
+        every scalar register in it.
+
+        :param size: number of bytes to read, from offset zero. Defaults to
+            the span of the scalar registers, pass more to also get arrays
+            such as ARP_CACHE from the same read.
+        :param max_age: reuse the previous read if it is no older than this,
+            in seconds, and covers size. None always reads the hardware.
+        :return: (dictionary of register values, raw bytes read)
+        """
+        size = max(size or 0, self.memmap_span)
+        snapshot = self._memmap_snapshot
+        if (max_age is not None) and (snapshot is not None) and \
+                (len(snapshot[1]) >= size) and \
+                (time.time() - snapshot[0] <= max_age):
+            data = snapshot[1]
+        else:
+            data = self.parent.read(self.name, size=size, offset=0)
+            self._memmap_snapshot = (time.time(), data)
+        values = {}
+        for register, offset, decoder in self.memmap_table:
+            values[register] = decoder.unpack_from(data, offset)[0]
+        return values, data
+
     def configure_core(self):
         """
         Setup the interface by writing to the fabric directly, bypassing tap.
@@ -441,43 +498,53 @@ class TenGbe(Memory, Gbe):
         FLAGS_OFFSET = self.memmap['FLAGS']['offset']
         FLAGS_SIZE   = self.memmap['FLAGS']['size']
 
-    def get_gbe_core_details(self, read_arp=False, read_cpu=False, read_multicast=False):
+    def get_gbe_core_details(self, read_arp=False, read_cpu=False, read_multicast=False,
+                             max_age=None):
         """
-        Get 10GbE core details.
+        Get 10GbE core details. The core's memory map is fetched in a single
+        read and decoded in one go.
 
         :param read_arp (bool): Get ARP table details (default False)
         :param read_cpu (bool): Get CPU details (default False)
         :param read_multicast (bool): Get multicast address table (default False)
+        :param max_age (float): Reuse the last memory map read if it is no
+            older than this many seconds (default None, always read)
 
         :returns: dictionary of core details (IP address, subnet mask, MAC address, port, etc).
         """
-        IP_ADDR   = self._memmap_read('IP_ADDR')
+        read_size = self.memmap_span
+        if read_arp:
+            arp = self.memmap['ARP_CACHE']
+            read_size = max(read_size, arp['offset'] + arp['size'])
+        if read_cpu:
+            read_size = max(read_size, 16384)
+        regs, data = self._memmap_read_all(size=read_size, max_age=max_age)
+        IP_ADDR   = regs['IP_ADDR']
         IP_PREFIX = '.'.join(IpAddress(IP_ADDR).ip_str.split('.')[:3])
 
         returnval = {
             'ip_prefix': IP_PREFIX,
             'ip': IpAddress(IP_ADDR),
-            'subnet_mask': IpAddress(self._memmap_read('NETMASK')),
-            'mac': Mac(self._memmap_read('MAC_ADDR')),
-            'gateway_ip': IpAddress(self._memmap_read('GW_ADDR')),
-            'fabric_port': self._memmap_read('PORT'),
-            'fabric_en': self._memmap_read('ENABLE'),
-            'multicast': {'base_ip': IpAddress(self._memmap_read('MC_IP')),
-                          'ip_mask': IpAddress(self._memmap_read('MC_MASK')),
+            'subnet_mask': IpAddress(regs['NETMASK']),
+            'mac': Mac(regs['MAC_ADDR']),
+            'gateway_ip': IpAddress(regs['GW_ADDR']),
+            'fabric_port': regs['PORT'],
+            'fabric_en': regs['ENABLE'],
+            'multicast': {'base_ip': IpAddress(regs['MC_IP']),
+                          'ip_mask': IpAddress(regs['MC_MASK']),
                           'rx_ips': []}
         }
 
         if not self.memmap_compliant:
-            data = self.parent.read(self.name, 16384)
-            data = list(struct.unpack('>16384B', data))
+            xaui = bytearray(data[0x24:0x2c])
 
             returnval_legacy_dict = {
-                'xaui_lane_sync': [bool(data[0x27] & 4), bool(data[0x27] & 8),
-                                   bool(data[0x27] & 16), bool(data[0x27] & 32)],
-                'xaui_status': [data[0x24], data[0x25], data[0x26], data[0x27]],
-                'xaui_chan_bond': bool(data[0x27] & 64),
-                'xaui_phy': {'rx_eq_mix': data[0x28], 'rx_eq_pol': data[0x29],
-                             'tx_preemph': data[0x2a], 'tx_swing': data[0x2b]},
+                'xaui_lane_sync': [bool(xaui[3] & 4), bool(xaui[3] & 8),
+                                   bool(xaui[3] & 16), bool(xaui[3] & 32)],
+                'xaui_status': [xaui[0], xaui[1], xaui[2], xaui[3]],
+                'xaui_chan_bond': bool(xaui[3] & 64),
+                'xaui_phy': {'rx_eq_mix': xaui[4], 'rx_eq_pol': xaui[5],
+                             'tx_preemph': xaui[6], 'tx_swing': xaui[7]},
             }
             returnval.update(returnval_legacy_dict)
 
@@ -497,9 +564,13 @@ class TenGbe(Memory, Gbe):
                 returnval['multicast']['rx_ips'].append(IpAddress(ip))
 
         if read_arp:
-            returnval['arp'] = self.get_arp_details()
+            arp = self.memmap['ARP_CACHE']
+            arp_table = struct.unpack_from(
+                '>%iQ' % (arp['size'] // 8), data, arp['offset'])
+            returnval['arp'] = list(map(Mac, arp_table[:256]))
         if read_cpu:
-            returnval.update(self.get_cpu_details())
+            returnval.update(self.get_cpu_details(
+                list(struct.unpack_from('>16384B', data))))
 
         self.core_details = returnval
         return returnval
@@ -544,6 +615,7 @@ class TenGbe(Memory, Gbe):
         arp_addr = self.memmap['ARP_CACHE']['offset']
         arp_addr += 8*int(ip.split('.')[-1])
         mac_pack = struct.pack('>Q', mac)
+        self._memmap_snapshot = None
         self.parent.write(self.name, mac_pack, offset=arp_addr)
 
     def set_arp_table(self, macs):
@@ -556,6 +628,7 @@ class TenGbe(Memory, Gbe):
         if isinstance(macs[0], Mac):
             macs = [m.mac_int for m in macs]
         macs_packed = struct.pack('>%dQ' % (len(macs)), *macs)
+        self._memmap_snapshot = None
         self.parent.write(self.name, macs_packed, offset=arp_addr)
 
 # end
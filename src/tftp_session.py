@@ -0,0 +1,429 @@
+"""
+A TFTP client for TAPCP boards that keeps what it learns about a board,
+its round trip time and whether it takes TFTP options, across transfers.
+Each transfer asks for a larger block size (RFC 2348) and a
+window of blocks per acknowledgement (RFC 7440), and falls back to plain
+512-byte lock-step TFTP if the board ignores or refuses the options.
+Lost packets are recovered by acknowledging the last block received in
+order as soon as a gap shows, and by retransmitting after a timeout that
+follows the measured round trip time.
+
+Every transfer runs from a fresh client port. A board answers all
+transfers from the same port, so packets it retransmits after a transfer
+has ended, e.g. the last DATA block of a read whose final ACK was lost,
+could otherwise be taken for the start of the next transfer.
+"""
+import logging
+import select
+import socket
+import struct
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+TFTP_PORT = 69
+
+OPCODE_RRQ = 1
+OPCODE_WRQ = 2
+OPCODE_DATA = 3
+OPCODE_ACK = 4
+OPCODE_ERROR = 5
+OPCODE_OACK = 6
+
+ERROR_NOT_DEFINED = 0
+ERROR_FILE_NOT_FOUND = 1
+ERROR_ILLEGAL_OPERATION = 4
+ERROR_OPTIONS_REFUSED = 8
+
+DEFAULT_BLKSIZE = 512
+# the most payload that fits a 1500-byte Ethernet frame, with room to spare
+# for tunnels
+BLKSIZE = 1428
+WINDOWSIZE = 8
+
+MIN_RTO = 0.02
+INITIAL_RTO = 1.0
+
+
+class TftpError(RuntimeError):
+    pass
+
+
+class TftpFileNotFoundError(TftpError):
+    pass
+
+
+class TftpTimeoutError(TftpError):
+    pass
+
+
+def _unwrap_block(block, reference):
+    """
+    The absolute block number nearest to reference with the given 16-bit
+    block number, so transfers of more than 65535 blocks work.
+    """
+    diff = (block - reference) & 0xffff
+    if diff >= 0x8000:
+        diff -= 0x10000
+    return reference + diff
+
+
+class TftpSession(object):
+    """
+    A TFTP client bound to one host. Transfers run one at a time.
+    """
+    def __init__(self, host, port=TFTP_PORT, timeout=3.0, retries=5,
+                 blksize=BLKSIZE, windowsize=WINDOWSIZE):
+        """
+        :param host: the board to talk to
+        :param port: the TFTP port on the board
+        :param timeout: the longest to wait for a reply before
+            retransmitting, in seconds
+        :param retries: retransmits without progress before a transfer
+            fails
+        :param blksize: the block size to ask for, 512 to not ask
+        :param windowsize: the blocks per acknowledgement to ask for,
+            1 to not ask
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.blksize = blksize
+        self.windowsize = windowsize
+        # cleared once the board shows it does not do TFTP options
+        self.negotiate = blksize != DEFAULT_BLKSIZE or windowsize > 1
+        self.srtt = None
+        self.rttvar = None
+        self.rto = min(INITIAL_RTO, timeout)
+        self.transfer_stats = None
+        self._address = None
+        self._sock = None
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except Exception:
+                pass
+            self._sock = None
+
+    def _open(self):
+        """
+        Open a socket on a new ephemeral port for one transfer.
+        """
+        self.close()
+        if self._address is None:
+            self._address = socket.gethostbyname(self.host)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        return self._sock
+
+    def _sample_rtt(self, rtt):
+        """
+        Update the retransmit timeout with a round trip time, as RFC 6298.
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = max(MIN_RTO, self.srtt + 4 * self.rttvar)
+
+    def _backoff(self, timeout):
+        self.rto = min(2 * self.rto, timeout)
+
+    def _recv(self, tid, wait):
+        """
+        Wait for a packet from the board.
+
+        :param tid: the (ip, port) the packet must come from, or None for
+            any port on the board
+        :param wait: the longest to wait, in seconds
+        :return: (opcode, block or error code, payload, source), or None
+            on timeout
+        """
+        deadline = time.time() + wait
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            if not select.select([self._sock], [], [], remaining)[0]:
+                return None
+            try:
+                packet, source = self._sock.recvfrom(65536)
+            except (BlockingIOError, ConnectionRefusedError):
+                continue
+            if source[0] != self._address or len(packet) < 4:
+                continue
+            if tid is not None and source != tid:
+                continue
+            if packet[:2] == struct.pack('>H', OPCODE_OACK):
+                return OPCODE_OACK, None, packet[2:], source
+            opcode, block = struct.unpack('>HH', packet[:4])
+            return opcode, block, packet[4:], source
+
+    def _options(self):
+        options = {}
+        if self.blksize != DEFAULT_BLKSIZE:
+            options['blksize'] = self.blksize
+        if self.windowsize > 1:
+            options['windowsize'] = self.windowsize
+        return options
+
+    @staticmethod
+    def _request_packet(opcode, filename, options):
+        if not isinstance(filename, bytes):
+            filename = filename.encode()
+        packet = struct.pack('>H', opcode) + filename + b'\x00octet\x00'
+        for key, value in options.items():
+            packet += ('%s\x00%d\x00' % (key, value)).encode()
+        return packet
+
+    @staticmethod
+    def _parse_oack(payload):
+        fields = payload.split(b'\x00')
+        options = {}
+        for key, value in zip(fields[0::2], fields[1::2]):
+            try:
+                options[key.decode().lower()] = int(value)
+            except ValueError:
+                pass
+        return options
+
+    def _error(self, filename, code, payload):
+        message = payload.split(b'\x00')[0].decode(errors='replace')
+        errmsg = '%s: TFTP error %i on %s: %s' % (
+            self.host, code, filename, message)
+        if code == ERROR_FILE_NOT_FOUND:
+            return TftpFileNotFoundError(errmsg)
+        return TftpError(errmsg)
+
+    def _start(self, opcode, filename, timeout, negotiate=True):
+        """
+        Send a read or write request and wait for the board to take it up.
+
+        :return: (tid, blksize, windowsize, first), where first is the
+            first DATA packet of a read if the board ignored the options
+        """
+        options = self._options() if negotiate and self.negotiate else {}
+        request = self._request_packet(opcode, filename, options)
+        refused = None
+        tries = 0
+        while True:
+            sent = time.time()
+            self._sock.sendto(request, (self._address, self.port))
+            reply = self._recv(None, self.rto)
+            if reply is None:
+                tries += 1
+                if tries > self.retries:
+                    raise TftpTimeoutError('%s: no reply to request for %s' % (
+                        self.host, filename))
+                self._backoff(timeout)
+                continue
+            if tries == 0:
+                self._sample_rtt(time.time() - sent)
+            rx_opcode, block, payload, tid = reply
+            if rx_opcode == OPCODE_ERROR:
+                if options and block in (ERROR_NOT_DEFINED,
+                                         ERROR_ILLEGAL_OPERATION,
+                                         ERROR_OPTIONS_REFUSED):
+                    # ask again without options; only stop asking for
+                    # them if that works
+                    LOGGER.debug('%s: TFTP options refused, retrying '
+                                 'without.' % self.host)
+                    refused = self._error(filename, block, payload)
+                    options = {}
+                    request = self._request_packet(opcode, filename, options)
+                    tries = 0
+                    continue
+                raise self._error(filename, block, payload)
+            if rx_opcode == OPCODE_OACK:
+                agreed = self._parse_oack(payload)
+                blksize = agreed.get('blksize', DEFAULT_BLKSIZE)
+                windowsize = agreed.get('windowsize', 1)
+                if not 8 <= blksize <= options.get('blksize', DEFAULT_BLKSIZE) \
+                        or not 1 <= windowsize <= options.get('windowsize', 1):
+                    raise TftpError('%s: board answered with bad TFTP '
+                                    'options %s' % (self.host, agreed))
+                return tid, blksize, windowsize, None
+            if (opcode == OPCODE_RRQ and rx_opcode == OPCODE_DATA and
+                    block == 1) or \
+                    (opcode == OPCODE_WRQ and rx_opcode == OPCODE_ACK and
+                     block == 0):
+                if options or refused is not None:
+                    LOGGER.debug('%s: TFTP options not supported, using '
+                                 '%i-byte blocks.' % (self.host,
+                                                      DEFAULT_BLKSIZE))
+                    self.negotiate = False
+                first = reply if rx_opcode == OPCODE_DATA else None
+                return tid, DEFAULT_BLKSIZE, 1, first
+
+    def download(self, filename, timeout=None, size=None):
+        """
+        Read a file from the board.
+
+        :param filename: the file to read
+        :param timeout: the longest to wait for a reply before
+            retransmitting, in seconds; defaults to the session timeout
+        :param size: the file size, if known. Files that fit in one plain
+            block are read without options, which would cost a round trip.
+        :return: the file contents as bytes
+        """
+        timeout = self.timeout if timeout is None else timeout
+        negotiate = size is None or size >= DEFAULT_BLKSIZE
+        sock = self._open()
+        try:
+            return self._download(sock, filename, timeout, negotiate)
+        finally:
+            self.close()
+
+    def _download(self, sock, filename, timeout, negotiate):
+        stime = time.time()
+        tid, blksize, windowsize, first = self._start(
+            OPCODE_RRQ, filename, timeout, negotiate)
+        chunks = []
+        block = 0
+        acked = 0
+        retransmits = 0
+        tries = 0
+        if first is None:
+            sock.sendto(struct.pack('>HH', OPCODE_ACK, 0), tid)
+        while True:
+            if first is not None:
+                reply, first = first, None
+            else:
+                reply = self._recv(tid, self.rto)
+            if reply is None:
+                tries += 1
+                if tries > self.retries:
+                    raise TftpTimeoutError('%s: read of %s stalled at block '
+                                           '%i' % (self.host, filename, block))
+                self._backoff(timeout)
+                sock.sendto(struct.pack('>HH', OPCODE_ACK, block & 0xffff),
+                            tid)
+                acked = block
+                retransmits += 1
+                continue
+            rx_opcode, rx_block, payload, _ = reply
+            if rx_opcode == OPCODE_ERROR:
+                raise self._error(filename, rx_block, payload)
+            if rx_opcode == OPCODE_OACK and block == 0:
+                # our acknowledgement of the options was lost
+                sock.sendto(struct.pack('>HH', OPCODE_ACK, 0), tid)
+                continue
+            if rx_opcode != OPCODE_DATA:
+                continue
+            rx_block = _unwrap_block(rx_block, block + 1)
+            if rx_block == block + 1:
+                block = rx_block
+                tries = 0
+                chunks.append(payload)
+                last = len(payload) < blksize
+                if last or block - acked >= windowsize:
+                    sock.sendto(struct.pack('>HH', OPCODE_ACK,
+                                            block & 0xffff), tid)
+                    acked = block
+                if last:
+                    break
+            elif rx_block > block + 1:
+                # a gap: ask for the rest of the window again, once
+                if acked != block:
+                    sock.sendto(struct.pack('>HH', OPCODE_ACK,
+                                            block & 0xffff), tid)
+                    acked = block
+                    retransmits += 1
+            elif rx_block == block:
+                # our acknowledgement was lost
+                sock.sendto(struct.pack('>HH', OPCODE_ACK, block & 0xffff),
+                            tid)
+        data = b''.join(chunks)
+        self._set_stats(len(data), time.time() - stime, blksize, windowsize,
+                        retransmits)
+        return data
+
+    def upload(self, filename, data, timeout=None):
+        """
+        Write a file to the board.
+
+        :param filename: the file to write
+        :param data: the contents, bytes
+        :param timeout: the longest to wait for a reply before
+            retransmitting, in seconds; defaults to the session timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        sock = self._open()
+        try:
+            self._upload(sock, filename, data, timeout)
+        finally:
+            self.close()
+
+    def _upload(self, sock, filename, data, timeout):
+        stime = time.time()
+        tid, blksize, windowsize, _ = self._start(
+            OPCODE_WRQ, filename, timeout)
+        data = memoryview(data)
+        # the last block is short, empty if the data fills whole blocks
+        num_blocks = len(data) // blksize + 1
+        acked = 0
+        retransmits = 0
+        tries = 0
+        resend = False
+        while acked < num_blocks:
+            last = min(acked + windowsize, num_blocks)
+            sent = time.time()
+            for block in range(acked + 1, last + 1):
+                sock.sendto(struct.pack('>HH', OPCODE_DATA, block & 0xffff) +
+                            data[(block - 1) * blksize:block * blksize], tid)
+            if resend:
+                retransmits += last - acked
+            resend = True
+            while True:
+                reply = self._recv(tid, self.rto)
+                if reply is None:
+                    tries += 1
+                    if tries > self.retries:
+                        raise TftpTimeoutError(
+                            '%s: write of %s stalled at block %i' % (
+                                self.host, filename, acked))
+                    self._backoff(timeout)
+                    break
+                rx_opcode, rx_block, payload, _ = reply
+                if rx_opcode == OPCODE_ERROR:
+                    raise self._error(filename, rx_block, payload)
+                if rx_opcode != OPCODE_ACK:
+                    continue
+                rx_block = _unwrap_block(rx_block, acked)
+                if rx_block < acked or rx_block > last:
+                    continue
+                if rx_block == acked:
+                    # a duplicate: the board lost the start of the window
+                    break
+                if rx_block == last and tries == 0:
+                    self._sample_rtt(time.time() - sent)
+                tries = 0
+                # short of the window, the board lost the block after
+                resend = rx_block < last
+                acked = rx_block
+                break
+        self._set_stats(len(data), time.time() - stime, blksize, windowsize,
+                        retransmits)
+
+    def _set_stats(self, size, elapsed, blksize, windowsize, retransmits):
+        self.transfer_stats = {
+            'bytes': size, 'seconds': elapsed,
+            'rate': size / elapsed if elapsed > 0 else float('inf'),
+            'blksize': blksize, 'windowsize': windowsize,
+            'retransmits': retransmits}
+
+# end
@@ -1,3 +1,5 @@
+import struct
+
 from .utils import get_hostname
 
 
@@ -95,6 +97,36 @@ class Transport(object):
         """
         raise NotImplementedError
 
+    def read_many(self, reads):
+        """
+        Do a sequence of reads, possibly from different devices.
+        Transports that can put several reads in flight at once, or into
+        one packet, should override this.
+
+        :param reads: (device_name, size, offset) tuples, as for read
+        :type reads: List of tuples
+
+        :return: List of big-endian binary strings, one per read
+        """
+        return [self.read(device_name, size, offset)
+                for device_name, size, offset in reads]
+
+    def blindwrite_many(self, device_name, writes):
+        """
+        Do a sequence of blind writes to `device_name`, in order.
+        Transports that can put several writes in flight at once, or into
+        one packet, should override this.
+
+        :param device_name: Name of device to be written
+        :type device_name: String
+        :param writes: (data, offset) pairs, as for blindwrite
+        :type writes: List of tuples
+
+        :return: None
+        """
+        for data, offset in writes:
+            self.blindwrite(device_name, data, offset)
+
     def listdev(self):
         """
         Get a list of the memory bus items in this design.
@@ -131,6 +163,43 @@ class Transport(object):
         """
         raise NotImplementedError
 
+    def get_running_fingerprint(self, expected=None):
+        """
+        Identify the design the FPGA is running, for comparison with
+        utils.get_fpg_fingerprint.
+
+            - Implemented in the child, where the platform can tell
+
+        :param expected: the fingerprint of the fpg file it will be
+            compared with, which gives platforms that cannot list the
+            running design's devices the address of sys_rev_rcs
+        :return: a dictionary with any of 'md5' (of the fpg file), 'git'
+            (the 77777_git meta information), 'rcs' (the sys_rev_rcs word)
+            and 'devices' (the names of the memory devices), or None if it
+            cannot be told
+        """
+        return None
+
+    def _get_rcs_fingerprint(self, expected, read_word):
+        """
+        Read the sys_rev_rcs register of the running design at the address
+        the fpg file gives it.
+
+        :param expected: the fingerprint of the fpg file
+        :param read_word: function returning the four bytes at an address
+            in the fpg file's memory map
+        :return: a dictionary with 'rcs', or None if the file has no
+            sys_rev_rcs register
+        """
+        if expected is None or \
+                'sys_rev_rcs' not in expected.get('memory', {}):
+            return None
+        data = read_word(expected['memory']['sys_rev_rcs']['address'])
+        parent = getattr(self, 'parent', None)
+        if getattr(parent, 'is_little_endian', False):
+            data = data[::-1]
+        return {'rcs': struct.unpack('>I', data)[0]}
+
     def upload_to_flash(self, binary_file, port=-1, force_upload=False,
                         timeout=30, wait_complete=True):
         """
@@ -8,12 +8,36 @@ import random
 import socket
 import struct
 import contextlib
+import errno
+import mmap
+import select
+import copy
+import collections
 
 from .transport import Transport
+from .async_requester import AsyncRequester
 from .utils import create_meta_dictionary, get_hostname, get_kwarg, socket_closer
+from .utils import threaded_fpga_operation
 
 LOGGER = logging.getLogger(__name__)
 
+# reads of at least this many bytes use the bulkread request
+BULKREAD_THRESHOLD = 4096
+
+# design information read from hosts, keyed by the identity of the design
+# they run, so boards running the same image only download it once
+DESIGN_INFO_CACHE_SIZE = 16
+_design_info_cache = collections.OrderedDict()
+_design_info_lock = threading.Lock()
+
+
+def clear_design_info_cache():
+    """
+    Forget the design information read from KATCP hosts.
+    """
+    with _design_info_lock:
+        _design_info_cache.clear()
+
 # monkey-patch the maximum katcp message size
 if hasattr(katcp.CallbackClient, 'MAX_MSG_SIZE'):
     setattr(katcp.CallbackClient, 'MAX_MSG_SIZE',
@@ -75,6 +99,158 @@ class KatcpRequestFail(RuntimeError):
 #                         (targethost, time.time()))
 
 
+class UploadFile(object):
+    """
+    A file opened and mapped once, to be sent to many hosts at once. The
+    kernel sends it straight from the page cache where it can, and from
+    the shared map otherwise, so the file is not read per host.
+
+    Each upload holds the file between acquire and release, which also
+    limit how many hosts are uploading at once. Closing the file waits
+    for the uploads still holding it, so they may outlive the caller.
+    """
+    def __init__(self, filename, max_concurrent=None):
+        """
+        :param filename: the file to send
+        :param max_concurrent: the most hosts to upload to at once, None
+            for no limit
+        """
+        self.filename = filename
+        self._fptr = open(filename, 'rb')
+        self.size = os.fstat(self._fptr.fileno()).st_size
+        self._map = None
+        if self.size > 0:
+            self._map = mmap.mmap(self._fptr.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._slots = None
+        if max_concurrent is not None:
+            self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._users = 0
+        self._closing = False
+
+    def acquire(self):
+        """
+        Wait for an upload slot, and keep the file open until release.
+        """
+        with self._lock:
+            if self._closing:
+                raise RuntimeError('%s is closed' % self.filename)
+            self._users += 1
+        if self._slots is not None:
+            self._slots.acquire()
+        if self._closing:
+            # the caller gave up while we waited, don't start another upload
+            self.release()
+            raise RuntimeError('upload of %s abandoned' % self.filename)
+
+    def release(self):
+        """
+        Give up the upload slot, and close the file if it is closing and
+        this was the last upload.
+        """
+        if self._slots is not None:
+            self._slots.release()
+        with self._lock:
+            self._users -= 1
+            if self._closing and self._users == 0:
+                self._close()
+
+    def send(self, upload_socket, timeout=None):
+        """
+        Send the whole file on a connected socket.
+
+        :param upload_socket: the socket
+        :param timeout: longest wait, in seconds, for the socket to accept
+            more data, None to wait forever
+        :return: the number of bytes sent
+        """
+        offset = 0
+        if hasattr(os, 'sendfile'):
+            upload_socket.setblocking(False)
+            try:
+                while offset < self.size:
+                    try:
+                        # explicit offsets, so the file is shareable
+                        sent = os.sendfile(upload_socket.fileno(),
+                                           self._fptr.fileno(), offset,
+                                           self.size - offset)
+                    except (BlockingIOError, InterruptedError):
+                        if not select.select([], [upload_socket], [],
+                                             timeout)[1]:
+                            raise socket.timeout('upload stalled')
+                        continue
+                    if sent == 0:
+                        raise socket.error('connection closed')
+                    offset += sent
+                return offset
+            except OSError as exc:
+                # not a socket the kernel can sendfile to, fall back
+                if offset > 0 or exc.errno not in (errno.EINVAL,
+                                                   errno.ENOSYS,
+                                                   errno.ENOTSOCK):
+                    raise
+            finally:
+                upload_socket.setblocking(True)
+        upload_socket.settimeout(timeout)
+        if self._map is not None:
+            upload_socket.sendall(memoryview(self._map))
+        return self.size
+
+    def close(self):
+        """
+        Close the file now, or when the last upload holding it releases it.
+        """
+        with self._lock:
+            self._closing = True
+            if self._users == 0:
+                self._close()
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._fptr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def upload_to_ram_and_program_fpgas(fpga_list, filename, max_concurrent=8,
+                                    timeout=600, **kwargs):
+    """
+    Program many KATCP FPGAs with the same fpg file, sharing one mapped
+    copy of it between the uploads, with at most max_concurrent uploads
+    running at once so as not to swamp the control network.
+
+    :param fpga_list: list of CasperFpga objects
+    :param filename: the fpg file
+    :param max_concurrent: the most uploads to run at once
+    :param timeout: how long to wait for all the FPGAs, in seconds
+    :param kwargs: passed to CasperFpga.upload_to_ram_and_program
+    :return: a dictionary, keyed on hostname, of the upload statistics
+        of each FPGA (bytes, seconds, MB/s)
+    """
+    def program(fpga, image):
+        fpga.upload_to_ram_and_program(filename, image=image, **kwargs)
+        return fpga.transport.upload_stats
+
+    stime = time.time()
+    with UploadFile(filename, max_concurrent) as image:
+        results = threaded_fpga_operation(fpga_list, timeout,
+                                          (program, (image, ), {}))
+    for host in sorted(results):
+        stats = results[host]
+        LOGGER.info('%s: uploaded %i bytes in %.2fs, %.1f MB/s' % (
+            host, stats['bytes'], stats['seconds'], stats['rate']))
+    LOGGER.info('Programming %d FPGAs took %.3f seconds.' % (
+        len(fpga_list), time.time() - stime))
+    return results
+
+
 class KatcpTransport(Transport, katcp.CallbackClient):
     """
     A katcp transport client for a casperfpga object
@@ -86,9 +262,13 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         :param port:
         :param timeout:
         :param connect:
+        :param bulkread_threshold: reads of at least this many bytes use
+            the bulkread request, None to never use it
         """
         port = get_kwarg('port', kwargs, 7147)
         timeout = get_kwarg('timeout', kwargs, 10)
+        self.bulkread_threshold = get_kwarg('bulkread_threshold', kwargs,
+                                            BULKREAD_THRESHOLD)
         Transport.__init__(self, **kwargs)
 
         # Create instance of self.logger
@@ -113,6 +293,11 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         self.system_info = {}
         self.unhandled_inform_handler = None
         self._timeout = timeout
+        # bytes, seconds and MB/s of the last file upload
+        self.upload_stats = None
+        # bytes, seconds and MB/s of the last bulkread
+        self.bulkread_stats = None
+        self._requester = AsyncRequester(self.host, self.callback_request)
         self.connect()
         self.logger.info('%s: port(%s) created and connected.' % (self.host, port))
 
@@ -166,11 +351,13 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         Send a file to a host using sockets. Place the result of the
         action in a Queue.Queue
 
-        :param filename: the file to send
+        :param filename: the file to send, or an UploadFile shared with
+            other uploads
         :param targethost: the host to which it must be sent
         :param port: the port the host should open
         :param result_queue: the result of the upload, nothing '' indicates success
-        :param timeout:
+        :param timeout: how long to try to connect, and how long the host
+            may stall the upload, in seconds
         """
         with contextlib.closing(socket.socket()) as upload_socket:
             stime = time.time()
@@ -183,8 +370,18 @@ class KatcpTransport(Transport, katcp.CallbackClient):
                     time.sleep(0.1)
             if not connected:
                 result_queue.put('Could not connect to upload port.')
+                return
             try:
-                upload_socket.send(open(filename, 'rb').read())
+                if isinstance(filename, UploadFile):
+                    stime = time.time()
+                    sent = filename.send(upload_socket, timeout)
+                else:
+                    with UploadFile(filename) as image:
+                        stime = time.time()
+                        sent = image.send(upload_socket, timeout)
+                elapsed = max(time.time() - stime, 1e-6)
+                self.upload_stats = {'bytes': sent, 'seconds': elapsed,
+                                     'rate': sent / elapsed / 1e6}
                 result_queue.put('')
             except Exception as e:
                 result_queue.put('Could not send file to upload port({}): {}'.format(
@@ -275,7 +472,100 @@ class KatcpTransport(Transport, katcp.CallbackClient):
             request_timeout = self._timeout
         request = katcp.Message.request(name, *request_args)
         reply, informs = self.blocking_request(request, timeout=request_timeout)
-        if (reply.arguments[0] != katcp.Message.OK) and require_ok:
+        if require_ok:
+            self._check_reply(request, reply)
+        return reply, informs
+
+    def katcprequests(self, requests, request_timeout=-1.0, require_ok=True,
+                      window=32):
+        """
+        Make many requests to the KATCP server, with up to window of them
+        in flight at once, told apart by their message ids, rather than
+        waiting a round trip for each. Servers that do not support message
+        ids get the requests one at a time.
+
+        :param requests: list of (name, request_args) tuples
+        :param request_timeout: number of seconds after which each request
+            must time out
+        :param require_ok: will we raise an exception on a response != ok
+        :param window: the most requests in flight at once
+        :return: list of (reply, informs) tuples, in the order of requests
+        """
+        if request_timeout == -1:
+            request_timeout = self._timeout
+        if not getattr(self, '_server_supports_ids', False):
+            return [self.katcprequest(name, request_timeout, require_ok,
+                                      request_args)
+                    for name, request_args in requests]
+        messages = [katcp.Message.request(name, *request_args)
+                    for name, request_args in requests]
+        replies = [None] * len(messages)
+        informs = [[] for _ in messages]
+        finished = threading.Condition()
+        state = {'inflight': 0}
+
+        def reply_cb(reply, index):
+            with finished:
+                replies[index] = reply
+                state['inflight'] -= 1
+                finished.notify()
+
+        def inform_cb(inform, index):
+            informs[index].append(inform)
+
+        for index, request in enumerate(messages):
+            with finished:
+                while state['inflight'] >= window:
+                    finished.wait()
+                state['inflight'] += 1
+            try:
+                self.callback_request(request, reply_cb=reply_cb,
+                                      inform_cb=inform_cb, user_data=(index, ),
+                                      timeout=request_timeout, use_mid=True)
+            except Exception:
+                with finished:
+                    state['inflight'] -= 1
+                raise
+        with finished:
+            # the client replies to a timed-out request with a failure
+            while state['inflight'] > 0:
+                finished.wait()
+        if require_ok:
+            for request, reply in zip(messages, replies):
+                self._check_reply(request, reply)
+        return list(zip(replies, informs))
+
+    def katcprequest_async(self, name, request_timeout=-1.0, request_args=(),
+                           inform_cb=None):
+        """
+        Make a request to the KATCP server without waiting for the reply.
+        asyncio code can await the result through asyncio.wrap_future.
+
+        :param name: request message to send.
+        :param request_timeout: number of seconds after which the request
+            gets a failure reply
+        :param request_args: request arguments.
+        :param inform_cb: called as inform_cb(host, request_id, inform) as
+            each inform arrives
+        :return: a concurrent.futures.Future of the (reply, informs) tuple
+        """
+        if request_timeout == -1:
+            request_timeout = self._timeout
+        req = self._requester.nb_request(name, inform_cb, None,
+                                         *request_args,
+                                         timeout=request_timeout)
+        req['future'].add_done_callback(
+            lambda _: self._requester.nb_pop_request_by_id(req['id']))
+        return req['future']
+
+    def _check_reply(self, request, reply):
+        """
+        Raise an error if the reply indicates a request failure.
+
+        :param request: the request message
+        :param reply: the reply message
+        """
+        if reply.arguments[0] != katcp.Message.OK:
             if reply.arguments[0] == katcp.Message.FAIL:
                 raise KatcpRequestFail(
                     'Request %s on host %s failed.\n\t'
@@ -291,7 +581,6 @@ class KatcpTransport(Transport, katcp.CallbackClient):
                     'Unknown error processing request %s on host '
                     '%s.\n\tRequest: %s\n\tReply: %s' %
                     (request.name, self.host, request, reply))
-        return reply, informs
 
     def listdev(self, getsize=False, getaddress=False):
         """
@@ -378,11 +667,42 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         :param offset: start at this offset
         :return: binary data string
         """
+        if self.bulkread_threshold is not None and \
+                size >= self.bulkread_threshold:
+            try:
+                return self.bulkread(device_name, size, offset)
+            except KatcpRequestInvalid:
+                self.logger.info('%s: no bulkread request, using read for '
+                                 'large reads' % self.host)
+                self.bulkread_threshold = None
         reply, _ = self.katcprequest(
             name='read', request_timeout=self._timeout, require_ok=True,
             request_args=(device_name, str(offset), str(size)))
         return reply.arguments[1]
 
+    def read_many(self, reads):
+        """
+        Do a sequence of reads, possibly from different devices, with the
+        requests pipelined over the one connection. Reads big enough for
+        bulkread are done by read.
+
+        :param reads: (device_name, size, offset) tuples, as for read
+        :return: list of binary data strings, one per read
+        """
+        threshold = self.bulkread_threshold
+        small = [ctr for ctr, (_, size, _) in enumerate(reads)
+                 if threshold is None or size < threshold]
+        results = self.katcprequests(
+            [('read', (reads[ctr][0], str(reads[ctr][2]), str(reads[ctr][1])))
+             for ctr in small])
+        data = [None] * len(reads)
+        for ctr, (reply, _) in zip(small, results):
+            data[ctr] = reply.arguments[1]
+        for ctr, read in enumerate(reads):
+            if data[ctr] is None:
+                data[ctr] = self.read(*read)
+        return data
+
     def wordread(self, device_name, size=1, word_offset=0, bit_offset=0):
         """
 
@@ -415,6 +735,21 @@ class KatcpTransport(Transport, katcp.CallbackClient):
                           require_ok=True,
                           request_args=(device_name, str(offset), data))
 
+    def blindwrite_many(self, device_name, writes):
+        """
+        Do a sequence of blind writes to device_name, with the requests
+        pipelined over the one connection. The server handles requests
+        on a connection in order, so the writes land in order.
+
+        :param device_name: the memory device to which to write
+        :param writes: (data, offset) pairs, as for blindwrite
+        """
+        for data, offset in writes:
+            assert(len(data) % 4) == 0, 'You must write 32-bit-bounded words!'
+            assert((offset % 4) == 0), 'You must write 32-bit-bounded words!'
+        self.katcprequests([('write', (device_name, str(offset), data))
+                            for data, offset in writes])
+
     def bulkread(self, device_name, size, offset=0):
         """
         Read size-bytes of binary data with carriage-return escape-sequenced.
@@ -427,10 +762,40 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         :param offset: the offset at which to read
         :return: binary data string
         """
-        _, informs = self.katcprequest(
-            name='bulkread', request_timeout=self._timeout, require_ok=True,
-            request_args=(device_name, str(offset), str(size)))
-        return ''.join([i.arguments[0] for i in informs])
+        # copy each page into place as it arrives
+        data = bytearray(size)
+        received = [0]
+        finished = threading.Event()
+        result = []
+
+        def inform_cb(inform):
+            page = inform.arguments[0]
+            start = received[0]
+            data[start:start + len(page)] = page
+            received[0] = start + len(page)
+
+        def reply_cb(reply):
+            result.append(reply)
+            finished.set()
+
+        request = katcp.Message.request('bulkread', device_name, str(offset),
+                                        str(size))
+        stime = time.time()
+        self.callback_request(request, reply_cb=reply_cb, inform_cb=inform_cb,
+                              timeout=self._timeout)
+        # the client replies to a timed-out request with a failure
+        finished.wait()
+        elapsed = max(time.time() - stime, 1e-6)
+        self._check_reply(request, result[0])
+        if received[0] != size:
+            raise KatcpRequestError('%s: bulkread of %s returned %i bytes, '
+                                    'expected %i' % (self.host, device_name,
+                                                     received[0], size))
+        self.bulkread_stats = {'bytes': size, 'seconds': elapsed,
+                               'rate': size / elapsed / 1e6}
+        self.logger.debug('%s: bulkread %i bytes of %s at %.1f MB/s' % (
+            self.host, size, device_name, self.bulkread_stats['rate']))
+        return bytes(data)
 
     def program(self, filename=None):
         """
@@ -546,7 +911,8 @@ class KatcpTransport(Transport, katcp.CallbackClient):
 
     def upload_to_ram_and_program(self, filename, port=-1, timeout=10,
                                   wait_complete=True,
-                                  skip_verification=False, **kwargs):
+                                  skip_verification=False, image=None,
+                                  **kwargs):
         """
         Upload an FPG file to RAM and then program the FPGA.
 
@@ -556,6 +922,7 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         :param wait_complete: wait for the transaction to complete, return
             after upload if False
         :param skip_verification: do not verify the uploaded file before reboot
+        :param image: an UploadFile of filename, shared with other uploads
         """
         self.logger.info('%s: uploading %s, programming when done' % (
             self.host, filename))
@@ -578,28 +945,47 @@ class KatcpTransport(Transport, katcp.CallbackClient):
             finally:
                 self.logger.debug('progremote thread done')
 
+        # function to upload the file, giving back the shared image after
+        def upload(result_queue):
+            try:
+                self.sendfile(image or filename, self.host, port,
+                              result_queue, timeout)
+            finally:
+                if image is not None:
+                    image.release()
+
         if port == -1:
             port = random.randint(2000, 2500)
-        # start the request thread and join
-        request_queue = queue.Queue()
-        request_thread = threading.Thread(target=makerequest,
-                                          args=(request_queue, ))
+        # a shared image limits the concurrent uploads, so hold a slot from
+        # the progremote request until the upload is done
+        if image is not None:
+            image.acquire()
         old_timeout = self._timeout
-        self._timeout = timeout
-        request_thread.start()
-        request_thread.join()
-        request_result = request_queue.get()
-        if request_result != '':
-            raise RuntimeError('progremote request(%s) on host %s failed' %
-                               (request_result, self.host))
-        # start the upload thread and join
-        upload_queue = queue.Queue()
-        unhandled_informs_queue = queue.Queue()
-        upload_thread = threading.Thread(target=self.sendfile, args=(
-            filename, self.host, port, upload_queue, ))
-        self.unhandled_inform_handler = \
-            lambda msg: unhandled_informs_queue.put(msg)
-        upload_thread.start()
+        try:
+            # start the request thread and join
+            request_queue = queue.Queue()
+            request_thread = threading.Thread(target=makerequest,
+                                              args=(request_queue, ))
+            self._timeout = timeout
+            request_thread.start()
+            request_thread.join()
+            request_result = request_queue.get()
+            if request_result != '':
+                raise RuntimeError('progremote request(%s) on host %s '
+                                   'failed' % (request_result, self.host))
+            # start the upload thread and join
+            upload_queue = queue.Queue()
+            unhandled_informs_queue = queue.Queue()
+            upload_thread = threading.Thread(target=upload,
+                                             args=(upload_queue, ))
+            self.unhandled_inform_handler = \
+                lambda msg: unhandled_informs_queue.put(msg)
+            upload_thread.start()
+        except BaseException:
+            self._timeout = old_timeout
+            if image is not None:
+                image.release()
+            raise
         if not wait_complete:
             self.unhandled_inform_handler = None
             self._timeout = old_timeout
@@ -753,6 +1139,17 @@ class KatcpTransport(Transport, katcp.CallbackClient):
         :return: a dictionary of metadata
         """
         self.logger.debug('%s: reading designinfo' % self.host)
+        metalist = self._read_meta_from_host(device)
+        self._process_git_info(metalist)
+        return create_meta_dictionary(metalist)
+
+    def _read_meta_from_host(self, device=None):
+        """
+        The raw meta information list of the running design.
+
+        :param device: can specify a device name if you don't want everything
+        :return: a list of (name, tag, param, value) tuples
+        """
         if device is None:
             reply, informs = self.katcprequest(
                 name='meta', request_timeout=10.0, require_ok=True)
@@ -785,46 +1182,100 @@ class KatcpTransport(Transport, katcp.CallbackClient):
                 value = value[0]
             name = name.replace('/', '_')
             metalist.append((name, tag, param, value))
-        self._process_git_info(metalist)
-        return create_meta_dictionary(metalist)
+        return metalist
+
+    def get_running_fingerprint(self, expected=None):
+        """
+        The git information embedded in the running design.
 
-    def _read_coreinfo_from_host(self):
+        :return: a dictionary with 'git', or None if no design is running
+        """
+        if not self.is_running():
+            return None
+        meta = create_meta_dictionary(self._read_meta_from_host())
+        return {'git': meta.get('77777_git')}
+
+    def _read_coreinfo_from_host(self, listdev_size=None,
+                                 listdev_address=None):
         """
         Get the equivalent of coreinfo.tab from the host using
         KATCP listdev commands.
+
+        :param listdev_size: the listdev(getsize=True) list, if already read
+        :param listdev_address: the listdev(getaddress=True) list, if
+            already read
         """
         self.logger.debug('%s: reading coreinfo' % self.host)
-        memorymap_dict = {}
-        listdev_size = self.listdev(getsize=True)
-        listdev_address = self.listdev(getaddress=True)
+        if listdev_size is None:
+            listdev_size = self.listdev(getsize=True)
+        if listdev_address is None:
+            listdev_address = self.listdev(getaddress=True)
         if len(listdev_address) != len(listdev_size):
             raise RuntimeError('Different length listdev(size) and '
                                'listdev(detail)')
+        addresses = dict(listdev_address)
+        memorymap_dict = {}
         for byte_dev, byte_size in listdev_size:
-            matched = False
-            for addrdev, address in listdev_address:
-                if addrdev == byte_dev:
-                    byte_size = int(byte_size.split(':')[0])
-                    address = int(address.split(':')[0], 16)
-                    memorymap_dict[byte_dev] = {
-                        'address': address, 'bytes': byte_size
-                    }
-                    matched = True
-                    continue
-            if not matched:
+            try:
+                address = addresses[byte_dev]
+            except KeyError:
                 raise RuntimeError('No matching listdev address for '
                                    'device %s' % byte_dev)
+            memorymap_dict[byte_dev] = {
+                'address': int(address.split(':')[0], 16),
+                'bytes': int(byte_size.split(':')[0])
+            }
         return memorymap_dict
 
     def get_system_information_from_transport(self):
         """
-
+        The design information of the running design. It is cached, keyed
+        by the memory map and the system and git meta information of the
+        design, which are only a few requests, so the full meta download
+        happens once per design rather than once per board or connection.
+        Designs with neither system nor git meta information are not
+        cached.
         """
         if not self.is_running():
             return self.bitstream, None
-        device_dict = self._read_design_info_from_host()
-        memorymap_dict = self._read_coreinfo_from_host()
-        return self.bitstream, (device_dict, memorymap_dict)
+        replies = self.katcprequests([
+            ('listdev', ('size', )), ('listdev', ('detail', )),
+            ('meta', ('77777', )), ('meta', ('77777_git', ))],
+            require_ok=False)
+        (size_reply, size_informs), (addr_reply, addr_informs) = replies[:2]
+        if size_reply.arguments[0] != katcp.Message.OK or \
+                addr_reply.arguments[0] != katcp.Message.OK:
+            raise RuntimeError('%s: could not list the design\'s memory '
+                               'devices' % self.host)
+        listdev_size = [(i.arguments[0].decode(), i.arguments[1].decode())
+                        for i in size_informs]
+        listdev_address = [(i.arguments[0].decode(), i.arguments[1].decode())
+                           for i in addr_informs]
+        memorymap_dict = self._read_coreinfo_from_host(listdev_size,
+                                                       listdev_address)
+        meta = tuple(tuple(i.arguments) for reply, informs in replies[2:]
+                     if reply.arguments[0] == katcp.Message.OK
+                     for i in informs)
+        if len(meta) == 0:
+            return self.bitstream, (self._read_design_info_from_host(),
+                                    memorymap_dict)
+        key = (tuple(sorted(listdev_size)), tuple(sorted(listdev_address)),
+               meta)
+        with _design_info_lock:
+            device_dict = _design_info_cache.get(key)
+            if device_dict is not None:
+                _design_info_cache.pop(key)
+                _design_info_cache[key] = device_dict
+        if device_dict is None:
+            device_dict = self._read_design_info_from_host()
+            with _design_info_lock:
+                _design_info_cache[key] = device_dict
+                while len(_design_info_cache) > DESIGN_INFO_CACHE_SIZE:
+                    _design_info_cache.popitem(last=False)
+        else:
+            self.logger.debug('%s: using cached design info' % self.host)
+        # the caller, and the devices made from it, change the dictionary
+        return self.bitstream, (copy.deepcopy(device_dict), memorymap_dict)
 
     def unhandled_inform(self, msg):
         """
@@ -106,6 +106,20 @@ class LocalPcieTransport(Transport):
         """
         return True
 
+    def get_running_fingerprint(self, expected=None):
+        """
+        The sys_rev_rcs word of the running design, which holds the git
+        commit it was built from, read at the address the fpg file gives it.
+
+        :param expected: the fingerprint of the fpg file
+        :return: a dictionary with 'rcs', or None if the file has no
+            sys_rev_rcs register
+        """
+        def read_word(address):
+            addr = address - AXIL_PCI_ADDR_TRANSLATION
+            return self.axil_mm[addr : addr + 4]
+        return self._get_rcs_fingerprint(expected, read_word)
+
     def _get_device_address(self, device_name):
         # map device name to address, if can't find, bail
         if self.memory_devices and (device_name in self.memory_devices):
@@ -7,6 +7,10 @@ import time
 import os
 import random
 import contextlib
+import binascii
+import json
+import hashlib
+import numpy as np
 
 from threading import Lock
 
@@ -14,7 +18,7 @@ from . import skarab_definitions as sd
 from . import skarab_fileops as skfops
 from .transport import Transport
 from .network import IpAddress
-from .utils import socket_closer
+from .utils import socket_closer, threaded_fpga_operation
 
 __author__ = 'tyronevb'
 __date__ = 'April 2016'
@@ -156,6 +160,9 @@ class SkarabTransport(Transport):
         # flag for keeping track of SDRAM state
         self._sdram_programmed = False
 
+        # progska telemetry of the last upload to SDRAM
+        self.upload_stats = None
+
         # dict for sensor data, empty at initialization
         self.sensor_data = {}
 
@@ -248,6 +255,28 @@ class SkarabTransport(Transport):
             return True
         return False
 
+    def get_running_fingerprint(self, expected=None):
+        """
+        The sys_rev_rcs word of the running design, which holds the git
+        commit it was built from. The SKARAB cannot list the devices of
+        the running design, so the register is read at the address the fpg
+        file gives it.
+
+        :param expected: the fingerprint of the fpg file
+        :return: a dictionary with 'rcs', or None if the board is running
+            the golden image or the file has no sys_rev_rcs register
+        """
+        if not self.is_running():
+            return None
+
+        def read_word(address):
+            # the fpg addresses carry a most significant bit the wishbone
+            # bus does not use, see post_get_system_information
+            response = self._rd_wishbone(wb_address=address & 0x7fffffff)
+            return struct.pack('!HH', response.packet['read_data_high'],
+                               response.packet['read_data_low'])
+        return self._get_rcs_fingerprint(expected, read_word)
+
     def loopbacktest(self, iface, timeout=None,
                      retries=None):
         """
@@ -386,7 +415,7 @@ class SkarabTransport(Transport):
         num_reads = int(math.ceil(num_words_to_read / maxreadwords))
         # self.logger.info('words_to_read(0x%06x) loops(%i)' % (num_words_to_read,
         #                                                  num_reads))
-        data = ''
+        data = b''
         data_left = num_words_to_read
         for rdctr in range(num_reads):
             to_read = (sd.MAX_READ_32WORDS if data_left > sd.MAX_READ_32WORDS
@@ -828,15 +857,99 @@ class SkarabTransport(Transport):
             retries = self.retries
 
         with Lock():
-            if self._seq_num >= 0xffff:
-                self._seq_num = 0
-            else:
-                self._seq_num += 1
             return self._send_packet(
-                request_object, self._seq_num, addr=self.skarab_eth_ctrl_addr,
+                request_object, self._next_seq_num(),
+                addr=self.skarab_eth_ctrl_addr,
                 timeout=timeout, retries=retries, hostname=self.host
             )
 
+    def _next_seq_num(self):
+        if self._seq_num >= 0xffff:
+            self._seq_num = 0
+        else:
+            self._seq_num += 1
+        return self._seq_num
+
+    def send_packets(self, requests, window=4, timeout=None, retries=None,
+                     callback=None):
+        """
+        Send many requests with up to window of them outstanding at once,
+        matching the responses to the requests by sequence number. Requests
+        whose responses time out are retransmitted, as in send_packet.
+
+        :param requests: list of request objects, all expecting a response
+        :param window: maximum number of requests in flight
+        :param timeout: how long to wait for each response
+        :param retries: how many times to transmit each request
+        :param callback: called as callback(index, response) as each
+            response arrives
+        :return: list of response objects, in the order of the requests
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        sock = self._skarab_control_sock
+        responses = [None] * len(requests)
+        # seq_num -> [request index, payload, times sent, time last sent]
+        pending = {}
+        next_request = 0
+        num_done = 0
+        self._lock.acquire()
+        try:
+            while num_done < len(requests):
+                while next_request < len(requests) and len(pending) < window:
+                    seq_num = self._next_seq_num()
+                    payload = requests[next_request].create_payload(seq_num)
+                    sock.send(payload)
+                    pending[seq_num] = [next_request, payload, 1, time.time()]
+                    next_request += 1
+                oldest = min(entry[3] for entry in pending.values())
+                wait = max(oldest + timeout - time.time(), 0)
+                if not select.select([sock], [], [], wait)[0]:
+                    now = time.time()
+                    for seq_num, entry in pending.items():
+                        if now - entry[3] < timeout:
+                            continue
+                        if entry[2] >= retries:
+                            errmsg = '{}: retransmit count exceeded for seq ' \
+                                     '{}. Giving up.'.format(self.host, seq_num)
+                            self.logger.debug(errmsg)
+                            raise SkarabSendPacketError(errmsg)
+                        self.logger.debug('{}: timeout, retransmitting seq '
+                                          '{}'.format(self.host, seq_num))
+                        sock.send(entry[1])
+                        entry[2] += 1
+                        entry[3] = now
+                    continue
+                response_payload = sock.recvfrom(4096)[0]
+                if len(response_payload) < 4:
+                    continue
+                seq_num = struct.unpack('!H', response_payload[2:4])[0]
+                entry = pending.get(seq_num)
+                if entry is None:
+                    # late response to a retransmitted request
+                    continue
+                request = requests[entry[0]]
+                if len(response_payload) // 2 != request.num_response_words:
+                    self.logger.debug('{}: incorrect response packet size for '
+                                      'seq {}. Discarding response'.format(
+                                          self.host, seq_num))
+                    continue
+                response = request.response.from_raw_data(
+                    response_payload, request.num_response_words,
+                    request.pad_words)
+                if response.type != request.type + 1:
+                    continue
+                del pending[seq_num]
+                responses[entry[0]] = response
+                num_done += 1
+                if callback is not None:
+                    callback(entry[0], response)
+        finally:
+            self._lock.release()
+        return responses
+
     def _send_packet(self, request_object, sequence_number, addr,
                      timeout=sd.CONTROL_RESPONSE_TIMEOUT,
                      retries=sd.CONTROL_RESPONSE_RETRIES,
@@ -1246,6 +1359,24 @@ class SkarabTransport(Transport):
             response.packet['read_data_high'],
             response.packet['read_data_low'])
 
+    def read_wishbone_words(self, wb_address, num_words):
+        """
+        Read a block of consecutive 32-bit words from the wishbone bus
+        using as few bulk read transactions as possible.
+
+        :param wb_address: address of the first word to read
+        :param num_words: number of 32-bit words to read
+        :return: list of the words read, as integers
+        """
+        words = []
+        while num_words > 0:
+            to_read = min(num_words, sd.MAX_READ_32WORDS)
+            data = self._bulk_read_req(wb_address, to_read)
+            words.extend(struct.unpack('>%iI' % to_read, data))
+            num_words -= to_read
+            wb_address += to_read * 4
+        return words
+
     def write_i2c(self, interface, slave_address, *bytes_to_write):
         """
         Perform i2c write on a selected i2c interface.
@@ -1560,7 +1691,8 @@ class SkarabTransport(Transport):
             # Check for padding BEFORE we convert to integer words
             if len(chunk) % 512 != 0:
                 self.logger.debug('Padding chunk')
-                chunk += '\xff' * (512 - (len(chunk) % 512))
+                padding_byte = b'\xff' if isinstance(chunk, bytes) else '\xff'
+                chunk += padding_byte * (512 - (len(chunk) % 512))
             # else: Continue
 
             # Convert the 512 (string) bytes to 256 (integer) words
@@ -1579,6 +1711,27 @@ class SkarabTransport(Transport):
             chunk_counter += 1
         return True     # Words have been verified successfully
 
+    def find_flash_mismatch(self, words, flash_address):
+        """
+        Read back a span of the flash in maximum-size (384-word) requests and
+        compare it with the expected words, stopping at the first request
+        that differs.
+
+        :param words: numpy array of the 16-bit words expected in the flash
+        :param flash_address: 32-bit Address in the NOR flash of words[0]
+        :return: index into words of the first mismatch, or -1 if the flash
+            holds exactly these words
+        """
+        for offset in range(0, len(words), 384):
+            expected = words[offset:offset + 384]
+            words_read = np.asarray(
+                self.read_flash_words(flash_address + offset, len(expected)),
+                dtype=np.uint16)
+            mismatch = np.flatnonzero(words_read != expected)
+            if len(mismatch) > 0:
+                return offset + int(mismatch[0])
+        return -1
+
     # endregion
 
     # region === Program Command ===
@@ -1697,7 +1850,7 @@ class SkarabTransport(Transport):
         image_chunks = [bitstream[i:i + 1024] for i in range(0, size, 1024)]
 
         # padding_word = 0xffff
-        padding_byte = '\xff'
+        padding_byte = b'\xff' if isinstance(bitstream, bytes) else '\xff'
 
         # Needs to be calculated on each 512 word chunk
         for chunk in image_chunks:
@@ -1826,10 +1979,7 @@ class SkarabTransport(Transport):
 
         # Need to change file-handler to use skarab_fileops.choose_processor(filename)
         #binname = '/tmp/fpgstream_' + str(self.parent) + '.bin'
-        processor = skfops.choose_processor(filename)
-        processor = processor(filename, extract_to_disk=False)
-        #image_to_program, binname = processor.make_bin()
-        image_to_program, _none = processor.make_bin()
+        image_to_program = skfops.BITSTREAM_CACHE.read(filename)
 
         self.logger.debug('VIRTEX FLASH RECONFIG: Analysing Words')
         # Can still analyse the filename, as the file size should still
@@ -1853,7 +2003,9 @@ class SkarabTransport(Transport):
                               num_words=None,
                               num_memory_blocks=None,
                               flash_address=sd.DEFAULT_START_ADDRESS,
-                              blind_reconfig=False):
+                              blind_reconfig=False,
+                              incremental=False,
+                              progress_file=None):
         """
         This is the entire function that makes the necessary calls to
         reconfigure the Virtex7's Flash Memory. Either specify a filename
@@ -1875,6 +2027,12 @@ class SkarabTransport(Transport):
             - flash_address = 0x0 is for programming the Golden Image
         :param blind_reconfig: Reconfigure the board and don't wait to
         verify what has been written
+        :param incremental: Read back each flash block and only erase,
+        program and verify the blocks that differ from the new image
+        :param progress_file: With incremental, a file in which the blocks
+        already done are recorded, so that an interrupted update can be
+        rerun without reading those blocks back again. Use one file per
+        board. It is removed once the update completes.
         :return: Success/Fail - 0/1
         """
         if filename:
@@ -1891,6 +2049,11 @@ class SkarabTransport(Transport):
             self.logger.error(errmsg)
             raise sd.SkarabInvalidBitstream(errmsg)
 
+        if incremental:
+            return self._virtex_flash_incremental(
+                image_to_program, num_memory_blocks, flash_address,
+                blind_reconfig, progress_file)
+
         self.logger.debug('VIRTEX FLASH RECONFIG: Erasing Flash Memory Blocks')
         if not self.erase_blocks(num_memory_blocks, flash_address):
             # Problem
@@ -1918,6 +2081,78 @@ class SkarabTransport(Transport):
             # else: Continue
         return True
 
+    def _virtex_flash_incremental(self, image_to_program, num_memory_blocks,
+                                  flash_address, blind_reconfig,
+                                  progress_file):
+        """
+        Rewrite only the flash blocks whose contents differ from the image.
+        See virtex_flash_reconfig.
+        """
+        if not isinstance(image_to_program, bytes):
+            image_to_program = image_to_program.encode('latin-1')
+        block_size = int(sd.DEFAULT_BLOCK_SIZE)
+        # the image as 16-bit words, padded to a 512-word boundary as
+        # program_words would
+        words = np.frombuffer(image_to_program[:len(image_to_program) & ~1],
+                              dtype='>u2').astype(np.uint16)
+        words = np.concatenate((words, np.full(
+            -len(words) % 512, 0xffff, dtype=np.uint16)))
+
+        progress = {'image': hashlib.sha1(image_to_program).hexdigest(),
+                    'flash_address': flash_address, 'blocks_done': []}
+        if progress_file is not None and os.path.exists(progress_file):
+            with open(progress_file) as fh:
+                previous = json.load(fh)
+            if previous.get('image') == progress['image'] and \
+                    previous.get('flash_address') == flash_address:
+                progress = previous
+                self.logger.info('VIRTEX FLASH RECONFIG: Resuming, %d of %d '
+                                 'blocks already done' % (
+                                     len(progress['blocks_done']),
+                                     num_memory_blocks))
+
+        if not self.sdram_reconfigure(output_mode=sd.FLASH_MODE):
+            errmsg = 'Unable to put SDRAM into FLASH Mode'
+            self.logger.error(errmsg)
+            raise sd.SkarabProgrammingError(errmsg)
+
+        rewritten = 0
+        for block in range(num_memory_blocks):
+            if block in progress['blocks_done']:
+                continue
+            block_words = words[block * block_size:(block + 1) * block_size]
+            block_address = flash_address + block * block_size
+            # past the end of the image, the flash must read back erased,
+            # as the full path erases whole blocks
+            expected = np.concatenate((block_words, np.full(
+                block_size - len(block_words), 0xffff, dtype=np.uint16)))
+            if self.find_flash_mismatch(expected, block_address) >= 0:
+                self.logger.debug('VIRTEX FLASH RECONFIG: Rewriting block '
+                                  '%d at 0x%X' % (block, block_address))
+                self.erase_flash_block(block_address)
+                if len(block_words) > 0:
+                    self.program_words(block_words.astype('>u2').tobytes(),
+                                       block_address)
+                if not blind_reconfig:
+                    index = self.find_flash_mismatch(expected,
+                                                     block_address)
+                    if index >= 0:
+                        errmsg = 'Flash_Word mismatch at word %d of ' \
+                                 'flash block %d' % (index, block)
+                        self.logger.error(errmsg)
+                        raise SkarabReadFailed(errmsg)
+                rewritten += 1
+            progress['blocks_done'].append(block)
+            if progress_file is not None:
+                with open(progress_file, 'w') as fh:
+                    json.dump(progress, fh)
+
+        self.logger.info('VIRTEX FLASH RECONFIG: Rewrote %d of %d flash '
+                         'blocks' % (rewritten, num_memory_blocks))
+        if progress_file is not None and os.path.exists(progress_file):
+            os.remove(progress_file)
+        return True
+
     # endregion
 
     # endregion
@@ -1971,63 +2206,38 @@ class SkarabTransport(Transport):
             the Spartan 3AN FPGA
         :return: Boolean - True/False - Success/Fail - 1/0
         """
+        return self.verify_spi_pages(self.ufp_to_pages(bitstream), window=1)
 
-        # We need to read as many sectors as there are 264-byte pages
-        # in the bitstream
-        # - Easier to manipulate the bitstream here on the fly
-
-        pages = [bitstream[i:i + 528] for i in range(0, len(bitstream), 528)]
-
-        page_counter = 0
-        # It's a list this time because read_spi_page returns an integer list
-        raw_data = []
-        for page in pages:
-
-            if len(page) % 528 != 0:
-                # Needs to be padded to a 264-byte boundary
-                page += (528 - (len(page) % 528)) * 'f'
-            # else: Continue
-
-            for byte_counter in range(0, len(page), 2):
-                one_byte = int(page[byte_counter: byte_counter+2], 16)
-                raw_data.append(self.reverse_byte(one_byte))
-
-            # Define the sector address from where we will be reading data
-            page_address = (page_counter << 9)
-            debugmsg = 'Now reading from SPI Address 0x{:02X}'.format(
-                page_address)
-            self.logger.debug(debugmsg)
-
-            # Reading one full page at a time
-            # - Returns an list of integers
-            read_bytes = self.read_spi_page(page_address, 264)
-
-            for byte_counter in range(len(read_bytes)):
-                # Compare byte by byte
-                # debugmsg = 'Comparing Raw_Data: 0x{:02X} - Read_Data: ' \
-                #            '0x{:02X}'.format(raw_data[byte_counter],
-                #                              read_bytes[byte_counter])
-                # self.logger.debug(debugmsg)
-
-                if raw_data[byte_counter] != read_bytes[byte_counter]:
-                    # Problem
-                    debugmsg = 'Comparing Raw_Data: 0x{:02X} - Read_Data: ' \
-                               '0x{:02X}'.format(raw_data[byte_counter],
-                                                 read_bytes[byte_counter])
-                    self.logger.debug(debugmsg)
-
-                    errmsg = 'Byte mismatch at index: {}. Failed to ' \
-                             'reconfigure Spartan Flash successfully.'.format(
-                                byte_counter)
-                    self.logger.error(errmsg)
-                    raise sd.SkarabProgrammingError(errmsg)
-                # else: Continue
-
-            # Increment the page-count
-            page_counter += 1
-            # clear the raw_data buffer for the next page conversion
-            raw_data = []
+    def verify_spi_pages(self, pages, window=4):
+        """
+        Read back the SPI flash pages, with up to window reads in flight,
+        and compare them with the pages that were programmed.
 
+        :param pages: num_pages x 264 array of raw (bit-reversed) page
+            bytes, as returned by ufp_to_pages
+        :param window: maximum number of read requests in flight
+        :return: True, or raise SkarabProgrammingError on a mismatch
+        """
+        requests = []
+        for page_counter in range(len(pages)):
+            spi_address_high, spi_address_low = \
+                self.data_split_and_pack(page_counter << 9)
+            requests.append(sd.ReadSpiPageReq(spi_address_high,
+                                              spi_address_low, 264))
+        responses = self.send_packets(requests, window=window)
+        for page_counter, response in enumerate(responses):
+            if not response.packet['read_spi_page_success']:
+                self.logger.error('SPI Read FAILED')
+                raise SkarabReadFailed('Attempt to perform SPI Read Failed')
+        read_pages = np.array([response.packet['read_bytes'][:264]
+                               for response in responses], dtype=np.uint8)
+        mismatch = np.argwhere(read_pages != pages)
+        if len(mismatch) > 0:
+            errmsg = 'Byte mismatch at index: {} of page {}. Failed to ' \
+                     'reconfigure Spartan Flash successfully.'.format(
+                        mismatch[0][1], mismatch[0][0])
+            self.logger.error(errmsg)
+            raise sd.SkarabProgrammingError(errmsg)
         return True
 
     # endregion
@@ -2143,9 +2353,7 @@ class SkarabTransport(Transport):
         :param num_pages: Total Number of Pages to be written to the SPI Sectors
         :return: Boolean - Success/Fail - 1/0
         """
-
-        # Need to break up the bitstream in (up to) 264-byte chunks
-        pages = [bitstream[i:i+528] for i in range(0, len(bitstream), 528)]
+        pages = self.ufp_to_pages(bitstream)
 
         # Sanity check
         if len(pages) != num_pages:
@@ -2158,39 +2366,41 @@ class SkarabTransport(Transport):
             raise sd.SkarabProgrammingError(errmsg)
         # else: Continue
 
-        page_counter = 0
-        raw_page_data = ''
-        for page in pages:
-            if len(page) % 528 != 0:
-                # Needs to be padded to a 264-byte boundary
-                page += (528 - (len(page) % 528)) * 'f'
-            # else: Continue
-
-            # Before program_spi_page, need to swap the bits in each byte
-            # so that the UFP file format matches the raw data format
-            for char_counter in range(0, len(page), 2):
-                one_byte = int(page[char_counter: char_counter+2], 16)
-                reversed_byte = self.reverse_byte(one_byte)
-                raw_page_data += struct.pack('!H', reversed_byte)
+        return self.program_spi_pages(pages, window=1)
 
-            # Need to program_spi_page with a maximum of 264 bytes
-            # - First, define the address where the page will be written to
-            page_address = (page_counter << 9)
+    def program_spi_pages(self, pages, window=4, progress=None):
+        """
+        Program pages to the SPI flash, with up to window pages in flight.
 
-            if not self.program_spi_page(spi_address=page_address,
-                                         num_bytes=len(raw_page_data)/2,
-                                         write_bytes=raw_page_data):
-                # Problem
+        :param pages: num_pages x 264 array of raw (bit-reversed) page
+            bytes, as returned by ufp_to_pages
+        :param window: maximum number of program requests in flight
+        :param progress: called as progress(pages_done, num_pages) as each
+            page is programmed
+        :return: Boolean - Success/Fail - 1/0
+        """
+        # each byte goes out in a 16-bit word
+        words = pages.astype('>u2')
+        requests = []
+        for page_counter in range(len(pages)):
+            spi_addr_high, spi_addr_low = \
+                self.data_split_and_pack(page_counter << 9)
+            requests.append(sd.ProgramSpiPageReq(
+                spi_addr_high, spi_addr_low, num_bytes=264,
+                write_bytes=words[page_counter].tobytes()))
+        pages_done = [0]
+
+        def page_done(index, response):
+            if not response.packet['program_spi_page_success']:
                 errmsg = 'Failed to program page-{} to address: 0x{:02X}'\
-                            .format(page_counter, page_address)
+                            .format(index, index << 9)
                 self.logger.error(errmsg)
-            # else: Continue
-
-            # Increment page_counter
-            page_counter += 1
-            # Clear raw_page_data buffer
-            raw_page_data = ''
+                raise sd.SkarabProgrammingError(errmsg)
+            pages_done[0] += 1
+            if progress is not None:
+                progress(pages_done[0], len(pages))
 
+        self.send_packets(requests, window=window, callback=page_done)
         return True
 
     # endregion
@@ -2321,6 +2531,24 @@ class SkarabTransport(Transport):
 
     # endregion
 
+    @staticmethod
+    def ufp_to_pages(bitstream):
+        """
+        Convert a hex-encoded .ufp bitstream to the raw data format of the
+        Spartan flash, i.e. with the bits in each byte reversed
+        (see reverse_byte), padded with 0xff to whole 264-byte pages.
+
+        :param bitstream: Of the input .ufp file, without \\r and \\n
+        :return: num_pages x 264 numpy array of bytes
+        """
+        if not isinstance(bitstream, bytes):
+            bitstream = bitstream.encode('ascii')
+        bitstream += b'f' * (-len(bitstream) % 528)
+        data = np.frombuffer(binascii.unhexlify(bitstream), dtype=np.uint8)
+        # unpacking LSB first and packing MSB first mirrors every byte
+        data = np.packbits(np.unpackbits(data, bitorder='little'))
+        return data.reshape(-1, 264)
+
     @staticmethod
     def reverse_byte(input_byte):
         """
@@ -2382,7 +2610,8 @@ class SkarabTransport(Transport):
 
     # region === SpartanFlashReconfig ===
 
-    def spartan_flash_reconfig(self, filename, blind_reconfig=False):
+    def spartan_flash_reconfig(self, filename, blind_reconfig=False,
+                               window=4, progress=None):
         """
         This is the entire function that makes the necessary function calls
         to reconfigure the Spartan's Flash
@@ -2391,6 +2620,10 @@ class SkarabTransport(Transport):
             the Spartan FPGA
         :param blind_reconfig: Reconfigure the board and don't wait to verify
             what has been written
+        :param window: number of page requests to keep in flight while
+            programming and verifying
+        :param progress: called as progress(pages_done, num_pages) as each
+            page is programmed
         :return: Boolean - Success/Fail - 1/0
         """
         # TODO: Figure out how we can use get_spartan_firmware_version in
@@ -2439,10 +2672,15 @@ class SkarabTransport(Transport):
         self.logger.debug('SPARTAN FLASH RECONFIG: Programming Words to SPI Sectors')
         self.enable_isp_flash()
 
-        # For Debug purposes
-        # (result, returned_data) = self.program_pages(
-        #     image_to_program, num_pages)
-        if not self.program_pages(image_to_program, num_pages):
+        pages = self.ufp_to_pages(image_to_program)
+        if len(pages) != num_pages:
+            errmsg = 'Error in breaking down bitstream to program...\n' \
+                     'Pages_calculated = {}, Number of 264-byte pages = {}'\
+                        .format(num_pages, len(pages))
+            self.logger.error(errmsg)
+            raise sd.SkarabProgrammingError(errmsg)
+
+        if not self.program_spi_pages(pages, window, progress):
             # Problem
             errmsg = 'Failed to Program SPI Sectors'
             self.logger.error(errmsg)
@@ -2455,7 +2693,7 @@ class SkarabTransport(Transport):
             self.logger.debug('VIRTEX FLASH RECONFIG: Verifying words that '
                          'were written to Flash Memory')
             self.enable_isp_flash()
-            if not self.verify_bytes(image_to_program):
+            if not self.verify_spi_pages(pages, window):
                 # Problem
                 errmsg = 'Failed to Verify data programmed SPI Sectors'
                 self.logger.error(errmsg)
@@ -2624,12 +2862,21 @@ class SkarabTransport(Transport):
         reg_data = self.read_board_reg(sd.C_RD_VERSION_ADDR, timeout=timeout,
                                        retries=retries)
         if reg_data:
-            firmware_major_version = (reg_data >> 16) & 0x3fff
-            firmware_minor_version = reg_data & 0xffff
-            return reg_data >> 31, reg_data >> 30 & 0x1, '{}.{}'.format(
-                firmware_major_version, firmware_minor_version)
+            return self.decode_virtex7_firmware_version(reg_data)
         return None, None, None
 
+    @staticmethod
+    def decode_virtex7_firmware_version(reg_data):
+        """
+        Split the C_RD_VERSION_ADDR board register into its fields
+
+        :return: golden_image, multiboot, firmware_version (string)
+        """
+        firmware_major_version = (reg_data >> 16) & 0x3fff
+        firmware_minor_version = reg_data & 0xffff
+        return reg_data >> 31, reg_data >> 30 & 0x1, '{}.{}'.format(
+            firmware_major_version, firmware_minor_version)
+
     def get_microblaze_hardware_version(self):
         """
         Read the version of the microblaze hardware (SoC) implementation
@@ -4567,4 +4814,34 @@ class SkarabTransport(Transport):
             # if it's set, return true, else return false
 
         return True
+
+
+def spartan_flash_reconfig_skarabs(fpga_list, filename, blind_reconfig=False,
+                                   window=4, progress=None, timeout=600):
+    """
+    Reconfigure the Spartan flash of many SKARABs in parallel.
+
+    :param fpga_list: list of CasperFpga objects using SkarabTransports
+    :param filename: the .ufp file to write to the Spartan flashes
+    :param blind_reconfig: don't verify what has been written
+    :param window: number of page requests each board keeps in flight
+    :param progress: called as progress(host, pages_done, num_pages) as
+        each page is programmed on each board
+    :param timeout: how long to wait for all the boards, in seconds
+    :return: a dictionary, keyed on hostname, of True or the exception that
+        stopped the reconfiguration of that board
+    """
+    def reconfig(fpga):
+        board_progress = None
+        if progress is not None:
+            def board_progress(pages_done, num_pages):
+                progress(fpga.host, pages_done, num_pages)
+        try:
+            return fpga.transport.spartan_flash_reconfig(
+                filename, blind_reconfig, window, board_progress)
+        except Exception as exc:
+            fpga.transport.logger.error(
+                'Spartan flash reconfig failed: {}'.format(exc))
+            return exc
+    return threaded_fpga_operation(fpga_list, timeout, (reconfig,))
 # end
@@ -1,11 +1,12 @@
 import logging
 import struct
-from io import BytesIO as BytesIO
 import zlib
 import hashlib
 import time
 
 from .transport import Transport
+from .tftp_session import TftpSession, TftpError, TftpFileNotFoundError
+from .tftp_session import BLKSIZE, WINDOWSIZE
 
 __author__ = 'jackh'
 __date__ = 'June 2017'
@@ -76,17 +77,11 @@ class TapcpTransport(Transport):
         Initialized Tapcp FPGA object
 
         :param host: IP Address of the targeted Board
+        :param blksize: the TFTP block size to ask the board for
+        :param windowsize: the TFTP blocks per acknowledgement to ask the
+            board for
         """
-        try:
-            import tftpy
-            global TFTPY
-            TFTPY = tftpy
-        except ImportError:
-            raise ImportError('You need to install tftpy to use TapcpTransport')
-        
         Transport.__init__(self, **kwargs)
-        self.t = tftpy.TftpClient(kwargs['host'], 69)
-	    
         try:
             self.parent = kwargs['parent_fpga']
             self.logger = self.parent.logger
@@ -99,12 +94,42 @@ class TapcpTransport(Transport):
         self.timeout = kwargs.get('timeout', 3)
         self.server_timeout = 0.1 # Microblaze timeout period. So that if a command fails we can wait for the microblaze to terminate the connection before retrying
         self.retries = kwargs.get('retries', 8) # These are retries of a complete transaction (each of which has it's ofw TFTP retries).
+        # keeps the round trip time and what the board takes across
+        # transfers, and asks for larger blocks and windows if it can
+        self.t = TftpSession(self.host, timeout=self.timeout,
+                             blksize=kwargs.get('blksize', BLKSIZE),
+                             windowsize=kwargs.get('windowsize', WINDOWSIZE))
 
     def __del__(self):
         try:
-            self.t.context.end()
+            self.t.close()
         except:
             pass
+
+    def disconnect(self):
+        self.t.close()
+
+    def _transfer(self, func, *args, **kwargs):
+        """
+        Run a TFTP transfer, retrying the whole transaction if the session
+        gives up on it. Lost packets are retransmitted within the session,
+        so this only happens if the board stops answering for a while.
+
+        :param func: self.t.download or self.t.upload
+        :param args: the file name, and the data for an upload
+        :param kwargs: passed on to func
+        """
+        for retry in range(self.retries):
+            try:
+                return func(*args, timeout=self.timeout, **kwargs)
+            except TftpFileNotFoundError:
+                raise
+            except TftpError as e:
+                if retry == self.retries - 1:
+                    raise
+                # wait for the server to time out the half-done transfer
+                self.logger.info('Tftp error -- retrying: %s' % e)
+                time.sleep(self.server_timeout)
     
     @staticmethod
     def test_host_type(host_ip):
@@ -139,39 +164,26 @@ class TapcpTransport(Transport):
         :param host_ip:
         """
         try:
-            import tftpy
-            board = tftpy.TftpClient(host_ip, 69)
-            buf = BytesIO()
-            board.download('%s.%x.%x' % ('sys_clkcounter', 0, 1),
-                           buf, timeout=3)
-            try:
-                board.context.end()
-            except:
-                pass
+            with TftpSession(host_ip, timeout=3) as board:
+                board.download('%s.%x.%x' % ('sys_clkcounter', 0, 1))
             return True
         except Exception:
-            try:
-                board.context.end()
-            except:
-                pass
             return False
 
     def listdev(self):
-        buf = BytesIO()
-        self.t.download('/listdev'.encode(), buf, timeout=self.timeout)
-        return [v.decode() for v in decode_csl(buf.getvalue())]
+        buf = self._transfer(self.t.download, '/listdev')
+        return [v.decode() for v in decode_csl(buf)]
 
     def listdev_pl(self):
-        buf = BytesIO()
-        self.t.download('/listdev'.encode(), buf, timeout=self.timeout)
-        return [v.decode() for v in decode_csl_pl(buf.getvalue())]
+        buf = self._transfer(self.t.download, '/listdev')
+        return [v.decode() for v in decode_csl_pl(buf)]
 
     def progdev(self, addr=0):
         # address shifts down because we operate in 32-bit addressing mode
         # see xilinx docs. Todo, fix this microblaze side
-        buf = BytesIO(struct.pack('>L', addr >> 8))
         try:
-            self.t.upload('/progdev', buf, timeout=self.timeout)
+            self.t.upload('/progdev', struct.pack('>L', addr >> 8),
+                          timeout=self.timeout)
         except:
             # the progdev command kills the host, so things will start erroring
             # TODO: verify programming actually worked!
@@ -186,9 +198,8 @@ class TapcpTransport(Transport):
         self.progdev(addr=addr)
 
     def get_temp(self):
-        buf = BytesIO()
-        self.t.download('/temp', buf, timeout=self.timeout)
-        return struct.unpack('>f', buf.getvalue())[0]
+        buf = self._transfer(self.t.download, '/temp')
+        return struct.unpack('>f', buf)[0]
 
     def is_connected(self):
         try:
@@ -255,13 +266,31 @@ class TapcpTransport(Transport):
         return metadict
 
 
-    def _update_metadata(self,filename,hlen,plen,md5):
+    def get_running_fingerprint(self, expected=None):
+        """
+        The md5 of the fpg file in user flash, from which the board boots,
+        and the memory devices of the running design, which tell the user
+        image from the golden one.
+
+        :return: a dictionary with 'md5' and 'devices', or None if the
+            board is not responding
+        """
+        if not self.is_running():
+            return None
+        meta = self.get_metadata()
+        return {'md5': None if meta is None else meta.get('md5sum'),
+                'devices': set(self.listdev())}
+
+    def _update_metadata(self,filename,hlen,plen,md5,write=True):
         """
         Update the meta data at user_flash_loc. Metadata is written 
         as 5  32bit integers in the following order:
         header-location, length of header (in bytes), 
         program-location, length of the program bitstream (B),
         md5sum of the fpg file
+
+        :param write: write the metadata to flash, else only work out
+            where the header and bitstream go
         """
         USER_FLASH_LOC = 0x800000
         SECTOR_SIZE = 0x10000
@@ -280,10 +309,21 @@ class TapcpTransport(Transport):
         meta += '?end'.encode()
         meta += b'0'*(1024-len(meta)%1024)
 
-        self.blindwrite('/flash', meta, offset=USER_FLASH_LOC)
+        if write:
+            self.blindwrite('/flash', meta, offset=USER_FLASH_LOC)
 
         return head_loc, prog_loc
 
+    def _clear_metadata(self):
+        """
+        Overwrite the meta data at user_flash_loc with an empty entry, so
+        that get_metadata finds no fields, e.g. while the image it
+        describes is being replaced.
+        """
+        USER_FLASH_LOC = 0x800000
+        meta = '?end'.encode()
+        self.blindwrite('/flash', meta + b'0'*(1024-len(meta)), offset=USER_FLASH_LOC)
+
     def upload_to_ram_and_program(self, filename, port=None, timeout=None, wait_complete=True, force=False):
         if self.platform == "snap":
             USER_FLASH_LOC = 0x800000
@@ -309,7 +349,11 @@ class TapcpTransport(Transport):
             else:
                 self.logger.info("Bitstream is not in flash. Writing new bitstream.")
                 self.logger.debug("Generating new header information")
-                HEAD_LOC, PROG_LOC = self._update_metadata(filename,len(header),len(prog),md5)
+                HEAD_LOC, PROG_LOC = self._update_metadata(filename,len(header),len(prog),md5,write=False)
+                # The metadata md5 says which image is in flash. Clear it
+                # while the image is written and write it last, so that an
+                # interrupted write leaves none rather than a wrong one.
+                self._clear_metadata()
                 payload = header + prog
                 complete_blocks = len(payload) // sector_size
                 trailing_bytes = len(payload) % sector_size
@@ -334,6 +378,7 @@ class TapcpTransport(Transport):
                     readback = self.read('/flash', len(payload[last_offset :]), offset=HEAD_LOC+last_offset)
                     if payload[last_offset :] != readback:
                         raise RuntimeError("Readback of flash failed!")
+                self._update_metadata(filename,len(header),len(prog),md5)
 
                 self.logger.debug("Returning timeout to %f" % old_timeout)
                 self.timeout = old_timeout
@@ -424,47 +469,12 @@ class TapcpTransport(Transport):
         :param use_bulk: Does nothing. Kept for API compatibility
         :return: binary data string
         """
-        for retry in range(self.retries - 1):
-            try:
-                buf = BytesIO()
-                self.t.download('%s.%x.%x' % (device_name, offset//4, size//4), buf, timeout=self.timeout)
-                try:
-                    self.t.context.end()
-                except:
-                    pass
-                return buf.getvalue()
-            except TFTPY.TftpShared.TftpFileNotFoundError:
-                self.logger.error('Device {0} not found'.format(device_name))
-                # If the file's not there, don't bother retrying
-                try:
-                    self.t.context.end()
-                except:
-                    pass
-                break
-            except:
-                # if we fail to get a response after a bunch of packet re-sends, wait for the
-                # server to timeout and restart the whole transaction.
-                try:
-                    self.t.context.end()
-                except:
-                    pass
-                time.sleep(self.server_timeout)
-                self.logger.info('Tftp error on read -- retrying.')
-        self.logger.warning('Several Tftp errors on read -- final retry.')
         try:
-            buf = BytesIO()
-            self.t.download('%s.%x.%x' % (device_name, offset//4, size//4), buf, timeout=self.timeout)
-            try:
-                self.t.context.end()
-            except:
-                pass
-            return buf.getvalue()
-        except:
-            try:
-                self.t.context.end()
-            except:
-                pass
-        raise RuntimeError
+            return self._transfer(self.t.download, '%s.%x.%x' % (
+                device_name, offset//4, size//4), size=size)
+        except TftpFileNotFoundError:
+            self.logger.error('Device {0} not found'.format(device_name))
+            raise
 
     def blindwrite(self, device_name, data, offset=0, use_bulk=True):
         """
@@ -478,38 +488,8 @@ class TapcpTransport(Transport):
         assert (type(data) == str or type(data) == bytes), 'Must supply binary packed string data'
         assert (len(data) % 4 == 0), 'Must write 32-bit-bounded words'
         assert (offset % 4 == 0), 'Must write 32-bit-bounded words'
-        for retry in range(self.retries - 1):
-            try:
-                buf = BytesIO(data)
-                self.t.upload('%s.%x.0' % (device_name, offset//4), buf, timeout=self.timeout)
-                try:
-                    self.t.context.end()
-                except:
-                    pass
-                return
-            except:
-                # if we fail to get a response after a bunch of packet re-sends, wait for the
-                # server to timeout and restart the whole transaction.
-                try:
-                    self.t.context.end()
-                except:
-                    pass
-                time.sleep(self.server_timeout)
-                self.logger.info('Tftp error on write -- retrying')
-        self.logger.warning('Several Tftp errors on write-- final retry.')
-        try:
-            buf = BytesIO(data)
-            self.t.upload('%s.%x.0' % (device_name, offset//4), buf, timeout=self.timeout)
-            try:
-                self.t.context.end()
-            except:
-                pass
-        except:
-            try:
-                self.t.context.end()
-            except:
-                pass
-        raise RuntimeError
+        self._transfer(self.t.upload, '%s.%x.0' % (device_name, offset//4),
+                       data)
 
     def deprogram(self):
         """
@@ -5,6 +5,9 @@ import time
 import logging
 import sys
 import socket
+import hashlib
+import re
+import concurrent.futures
 
 LOGGER = logging.getLogger(__name__)
 
@@ -173,10 +176,123 @@ def get_git_info_from_fpg(fpg_file):
     try:
         git_info_dict.pop('tag')
         return git_info_dict
-    except KeyError:
-        # tag: rcs entry isn't there, no worries
+    except (KeyError, AttributeError):
+        # tag: rcs entry isn't there, or no git info at all, no worries
         return git_info_dict
 
+
+def get_fpg_fingerprint(fpg_file):
+    """
+    Identify the design in an fpg file, for comparison with
+    Transport.get_running_fingerprint.
+
+    :param fpg_file: filename as string
+    :return: dictionary with the md5 of the file, the git info from its
+             header, the names of its memory devices and its memory map
+    """
+    chksum = hashlib.md5()
+    with open(fpg_file, 'rb') as fptr:
+        for block in iter(lambda: fptr.read(1024 * 1024), b''):
+            chksum.update(block)
+    memorydict = parse_fpg(fpg_file)[1]
+    return {'md5': chksum.hexdigest(),
+            'git': get_git_info_from_fpg(fpg_file),
+            'devices': set(memorydict.keys()),
+            'memory': memorydict}
+
+
+def decode_rcs_word(word):
+    """
+    Decode the sys_rev_rcs register of a toolflow design. Bit 31 set means
+    bits 30:0 are a build timestamp. Otherwise bit 30 tells svn (1) from
+    git (0), bit 28 is set if the tree was dirty and bits 27:0 are the
+    revision, for git the first seven hex digits of the commit.
+
+    :param word: the 32-bit register value
+    :return: dictionary with 'type' ('timestamp', 'svn' or 'git'), 'dirty'
+             and 'revision'
+    """
+    if word & 0x80000000:
+        return {'type': 'timestamp', 'dirty': False,
+                'revision': word & 0x7fffffff}
+    return {'type': 'svn' if word & 0x40000000 else 'git',
+            'dirty': bool(word & 0x10000000),
+            'revision': word & 0x0fffffff}
+
+
+def _git_info_has_commit(git_info, revision):
+    """
+    Is there a commit starting with the seven hex digit revision among the
+    git info from an fpg header?
+    """
+    prefix = '%07x' % revision
+    for value in _normalise_git_info(git_info).values():
+        for commit in re.findall(r'[0-9a-f]{7,40}', value.lower()):
+            if commit.startswith(prefix):
+                return True
+    return False
+
+
+def _normalise_git_info(git_info):
+    """
+    Git info values from an fpg header are joined with spaces, those read
+    over KATCP are lists that may still hold escaped spaces.
+    """
+    normalised = {}
+    for param, value in git_info.items():
+        if param == 'tag':
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(value)
+        normalised[param] = ' '.join(value.replace('\\_', ' ').split())
+    return normalised
+
+
+def fingerprint_matches(expected, running, trust_rcs=False):
+    """
+    Does the fingerprint of a running design match that of an fpg file?
+    Every piece of information the running design reports must agree, and
+    it must report at least an md5 or git info.
+
+    A sys_rev_rcs word that disagrees rules the file out, but one that
+    agrees is only a best-effort match: it holds just the commit, which
+    every model and parameter set built from that commit shares. It only
+    identifies the design if trust_rcs is set, and then only for a clean
+    git tree whose commit the file's git info lists.
+
+    :param expected: the fingerprint of the file, from get_fpg_fingerprint
+    :param running: the fingerprint of the running design, from
+                    Transport.get_running_fingerprint
+    :param trust_rcs: take a matching sys_rev_rcs commit as identifying
+                      the design
+    :return: True or False
+    """
+    if not running:
+        return False
+    identified = False
+    if running.get('md5') is not None:
+        if running['md5'] != expected['md5']:
+            return False
+        identified = True
+    if running.get('git') is not None:
+        if not expected['git'] or _normalise_git_info(running['git']) != \
+                _normalise_git_info(expected['git']):
+            return False
+        identified = True
+    if running.get('rcs') is not None:
+        rcs = decode_rcs_word(running['rcs'])
+        if rcs['type'] != 'git' or rcs['dirty'] or rcs['revision'] == 0:
+            return False
+        if not expected['git'] or \
+                not _git_info_has_commit(expected['git'], rcs['revision']):
+            return False
+        identified = identified or trust_rcs
+    if running.get('devices') is not None:
+        # the running design may list system devices the header does not
+        if not expected['devices'].issubset(running['devices']):
+            return False
+    return identified
+
 def pull_info_from_fpg(fpg_file, parameter):
     """
     Pull available parameters about x-engine or f-engine from .fpg file.
@@ -283,13 +399,17 @@ def check_changing_status(counters, data_function, wait_time, num_checks):
     return True, ''
 
 
-def program_fpgas(fpga_list, progfile, timeout=10):
+def program_fpgas(fpga_list, progfile, timeout=10, skip_if_running=False,
+                  trust_rcs=False):
     """
     Program more than one FPGA at the same time.
     
     :param fpga_list: a list of objects for the FPGAs to be programmed
     :param progfile: string, the file used to program the FPGAs
     :param timeout: how long to wait for a response, in seconds
+    :param skip_if_running: leave alone the FPGAs already running progfile,
+        see CasperFpga.is_programmed_with
+    :param trust_rcs: see CasperFpga.is_programmed_with
     """
     stime = time.time()
     if progfile is None:
@@ -302,11 +422,29 @@ def program_fpgas(fpga_list, progfile, timeout=10):
     else:
         for fpga in fpga_list:
             fpga.bitstream = progfile
-    threaded_fpga_function(fpga_list, 60, 'upload_to_ram_and_program')
+    threaded_fpga_function(fpga_list, 60, (
+        'upload_to_ram_and_program', (), {'skip_if_running': skip_if_running,
+                                          'trust_rcs': trust_rcs}))
     LOGGER.info('Programming %d FPGAs took %.3f seconds.' % (
         len(fpga_list), time.time() - stime))
 
 
+def check_fpgas_programmed(fpga_list, progfile=None, timeout=10,
+                           trust_rcs=False):
+    """
+    Check, on all the FPGAs at once, which are already running a design.
+
+    :param fpga_list: a list of CasperFpga objects
+    :param progfile: the fpg file, defaults to each FPGA's bitstream
+    :param timeout: how long to wait for a response, in seconds
+    :param trust_rcs: see CasperFpga.is_programmed_with
+    :return: a dictionary of True/False, keyed on hostname
+    """
+    return threaded_fpga_function(
+        fpga_list, timeout, ('is_programmed_with', (progfile, ),
+                             {'trust_rcs': trust_rcs}))
+
+
 def threaded_create_fpgas_from_hosts(host_list, fpga_class=None,
                                      port=7147, timeout=10,
                                      best_effort=False, **kwargs):
@@ -444,7 +582,7 @@ def threaded_fpga_operation(fpga_list, timeout, target_function):
         thread_list.append(thread)
     for thread_ in thread_list:
         thread_.join(timeout)
-        if thread_.isAlive():
+        if thread_.is_alive():
             break
     returnval = {}
     hosts_missing = [fpga.host for fpga in fpga_list]
@@ -462,6 +600,53 @@ def threaded_fpga_operation(fpga_list, timeout, target_function):
     return returnval
 
 
+def gather(futures, timeout):
+    """
+    Wait for futures from many hosts, e.g. from
+    KatcpTransport.katcprequest_async, each of which has its own timeout.
+
+    :param futures: a dictionary of futures, keyed by hostname
+    :param timeout: the longest to wait, in seconds, for any one host
+    :return: a dictionary, keyed by hostname, of the results, or of the
+        exceptions raised, with a TimeoutError for hosts that did not
+        answer in time
+    """
+    concurrent.futures.wait(list(futures.values()), timeout=timeout)
+    results = {}
+    for host, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[host] = concurrent.futures.TimeoutError(
+                '%s did not answer within %.1fs' % (host, timeout))
+        elif future.cancelled():
+            results[host] = concurrent.futures.CancelledError(host)
+        elif future.exception() is not None:
+            results[host] = future.exception()
+        else:
+            results[host] = future.result()
+    return results
+
+
+def gather_requests(fpga_list, request, request_args=(), timeout=10):
+    """
+    Send the same KATCP request to many FPGAs at once, and collect the
+    replies.
+
+    :param fpga_list: list of CasperFpga objects with KATCP transports
+    :param request: the request string, e.g. 'sensor-value'
+    :param request_args: the arguments to the request
+    :param timeout: the request timeout per host, in seconds
+    :return: a dictionary, keyed by hostname, of (reply, informs) tuples, or
+        of the exception for hosts that failed
+    """
+    futures = dict(
+        (fpga.host, fpga.transport.katcprequest_async(
+            request, timeout, request_args))
+        for fpga in fpga_list)
+    # the client fails requests at their timeout; allow it to do so
+    return gather(futures, timeout + 1.0)
+
+
 def threaded_non_blocking_request(fpga_list, timeout, request, request_args):
     """
     Make a non-blocking KatCP request to a list of KatcpClientFpgas, using
@@ -474,67 +659,22 @@ def threaded_non_blocking_request(fpga_list, timeout, request, request_args):
     :return: a dictionary, keyed by hostname, of result dictionaries containing
         reply and informs
     """
-
-    raise DeprecationWarning
-
-    num_fpgas = len(fpga_list)
-    reply_queue = queue.Queue(maxsize=num_fpgas)
-    requests = {}
-    replies = {}
-
-    # reply callback
-    def reply_cb(host, req_id):
-        LOGGER.debug('Reply(%s) from host(%s)' % (req_id, host))
-        reply_queue.put_nowait([host, req_id])
-
-    # start the requests
-    LOGGER.debug('Send request(%s) to %i hosts.' % (request, num_fpgas))
-    lock = threading.Lock()
-    for fpga_ in fpga_list:
-        lock.acquire()
-        req = fpga_.nb_request(request, None, reply_cb, *request_args)
-        requests[req['host']] = [req['request'], req['id']]
-        lock.release()
-        LOGGER.debug('Request \'%s\' id(%s) to host(%s)' % (
-            req['request'], req['id'], req['host']))
-
-    # wait for replies from the requests
-    timedout = False
-    done = False
-    while (not timedout) and (not done):
-        try:
-            it = reply_queue.get(block=True, timeout=timeout)
-        except:
-            timedout = True
-            break
-        replies[it[0]] = it[1]
-        if len(replies) == num_fpgas:
-            done = True
-    if timedout:
-        LOGGER.error('non_blocking_request timeout after %is.' % timeout)
-        LOGGER.error(replies)
-        raise RuntimeError('non_blocking_request timeout after %is.' % timeout)
-
-    # process the replies
+    LOGGER.debug('Send request(%s) to %i hosts.' % (request, len(fpga_list)))
+    results = gather_requests(fpga_list, request, request_args, timeout)
     returnval = {}
     for fpga_ in fpga_list:
-        try:
-            request_id = replies[fpga_.host]
-        except KeyError:
-            LOGGER.error(replies)
-            raise KeyError(
+        result = results[fpga_.host]
+        if isinstance(result, Exception):
+            LOGGER.error('%s: %s' % (fpga_.host, result))
+            raise RuntimeError(
                 'Didn\'t get a reply for FPGA \'%s\' so the request \'%s\' '
                 'probably didn\'t complete.' % (fpga_.host, request))
-        reply, informs = fpga_.nb_get_request_result(request_id)
-        frv = {'request': requests[fpga_.host][0],
-               'reply': reply.arguments[0],
-               'reply_args': reply.arguments}
-        informlist = []
-        for inf in informs:
-            informlist.append(inf.arguments)
-        frv['informs'] = informlist
-        returnval[fpga_.host] = frv
-        fpga_.nb_pop_request_by_id(request_id)
+        reply, informs = result
+        returnval[fpga_.host] = {
+            'request': request,
+            'reply': reply.arguments[0],
+            'reply_args': reply.arguments,
+            'informs': [inf.arguments for inf in informs]}
     return returnval
 
 
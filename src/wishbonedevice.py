@@ -1,4 +1,5 @@
 import logging
+import struct
 
 class WishBoneDevice(object):
 
@@ -10,6 +11,23 @@ class WishBoneDevice(object):
     def _write(self, data, addr=0):
         self.itf.write_int(self.name, data, word_offset = addr, blindwrite=True)
 
+    def _write_many(self, data, addr=0):
+        """ Write a sequence of words to the same address, in order,
+        batched by the interface if it supports it.
+        """
+        self._write_words([(d, addr) for d in data])
+
+    def _write_words(self, writes):
+        """ Write a sequence of (data, addr) words, in order, batched by
+        the interface if it supports it.
+        """
+        if hasattr(self.itf, 'blindwrite_many'):
+            writes = [(struct.pack('>I', int(d)), a * 4) for d, a in writes]
+            self.itf.blindwrite_many(self.name, writes)
+        else:
+            for d, a in writes:
+                self._write(d, a)
+
     def _read(self, addr=0, size=4):
         if size==4:
             return self.itf.read_int(self.name, word_offset = addr)